@@ -1,5 +1,9 @@
+import tracemalloc
+from typing import Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
 from aiogram.webhook.aiohttp_server import (
@@ -9,6 +13,7 @@ from aiogram.webhook.aiohttp_server import (
 )
 from aiohttp import web
 from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -23,29 +28,78 @@ from .bot_multi import (
     bot_multi_include_routers,
     bot_multi_middlewares_register,
 )
-from .config import load_config
+from .bot_main.utils.errors import ErrorReporter
+from .bot_multi.confirmations import Confirmations
+from .bot_multi.outbox import Outbox
+from .bot_multi.texts import TextMessage
+from .config import Config, load_config
 from .logger import setup_logger
+from .monitoring import (
+    CACHES,
+    LoopMonitor,
+    MongoCommandMetrics,
+    ProfilerHandler,
+    TelegramRequestMetrics,
+    TenantLabels,
+    Tracer,
+    UpdateRecorder,
+    instrument_dispatcher,
+    instrument_engine,
+    instrument_redis,
+    setup_metrics_route,
+    track_cache,
+)
 from .on import startup, shutdown
 
 
-def main():
+def create_app(
+        config: Config,
+        mongo: Optional[AsyncIOMotorClient] = None,
+        redis: Optional[Redis] = None,
+) -> web.Application:
     """
-    Main entry point of the application.
+    Create the web application serving the webhooks of the main and multi-bot dispatchers.
+
+    :param config: The Config object.
+    :param mongo: The MongoDB client replacing the one of the configuration, e.g. a stand-in in tests.
+    :param redis: The Redis client replacing the one of the configuration, e.g. a stand-in in tests.
+    :return: The web application.
     """
-    # Load configuration
-    config = load_config()
+    # Create tracer of the updates logging the slow ones
+    tracer = Tracer(
+        slow_update_threshold=config.tracing.SLOW_UPDATE_THRESHOLD,
+        export_path=config.tracing.EXPORT_PATH,
+        export_all=config.tracing.EXPORT_ALL,
+    )
+
+    # Create recorder of a sample of the updates if configured
+    recorder = UpdateRecorder(
+        path=config.recording.PATH,
+        key=config.recording.ANONYMIZE_KEY,
+        sample_rate=config.recording.SAMPLE_RATE,
+    ) if config.recording.PATH else None
+
+    # Create monitor of the event loop lag logging the blocking callbacks
+    loop_monitor = LoopMonitor(
+        interval=config.loop.LAG_INTERVAL,
+        block_threshold=config.loop.BLOCK_THRESHOLD,
+    )
 
-    # Create Aiohttp session
-    session = AiohttpSession()
+    # Create Aiohttp session, pointed at another Bot API server if configured
+    api = TelegramAPIServer.from_base(config.bot.API_BASE_URL) if config.bot.API_BASE_URL else PRODUCTION
+    session = AiohttpSession(api=api)
+    session.middleware(TelegramRequestMetrics())
 
     # Create MongoDB client
-    mongo = AsyncIOMotorClient(config.mongodb.dsn())
+    if mongo is None:
+        mongo = AsyncIOMotorClient(config.mongodb.dsn(), event_listeners=[MongoCommandMetrics()])
 
     # Create database engine
     engine = create_async_engine(
         url=config.database.url(),
         pool_pre_ping=True,
     )
+    instrument_engine(engine)
     # Create session maker for database
     sessionmaker = async_sessionmaker(
         bind=engine,
@@ -54,10 +108,26 @@ def main():
     )
 
     # Create Redis storage
-    storage = RedisStorage.from_url(
-        url=config.redis.dsn(),
+    if redis is None:
+        redis = Redis.from_url(config.redis.dsn())
+    storage = RedisStorage(
+        redis=redis,
         key_builder=DefaultKeyBuilder(with_bot_id=True),
     )
+    instrument_redis(storage.redis)
+
+    # Create confirmations of delivered messages and outbox delivering operator replies
+    confirmations = Confirmations()
+    outbox = Outbox(storage.redis, session, sessionmaker, config, confirmations)
+    # Create reporter of errors to the developer
+    error_reporter = ErrorReporter(config.bot.ERROR_REPORT_WINDOW)
+    # Report the memory of the caches and long-lived state, evicting the caches beyond their budget
+    CACHES.configure(config.memory.CACHE_BUDGETS, config.memory.DEFAULT_CACHE_BUDGET)
+    track_cache("confirmations", confirmations.confirmations, evictable=False)
+    track_cache("settings", confirmations.settings)
+    track_cache("outbox_bots", outbox.bots)
+    for language_code, texts in TextMessage.data.items():
+        track_cache(f"texts_{language_code}", texts, evictable=False)
 
     # Bot settings
     bot_settings = {
@@ -72,6 +142,12 @@ def main():
         "sessionmaker": sessionmaker,
         "mongo_client": mongo,
         "storage": storage,
+        "redis": storage.redis,
+        "outbox": outbox,
+        "confirmations": confirmations,
+        "error_reporter": error_reporter,
+        "recorder": recorder,
+        "loop_monitor": loop_monitor,
     }
 
     # Create web application
@@ -87,6 +163,7 @@ def main():
         config=config,
         sessionmaker=sessionmaker,
     )
+    instrument_dispatcher(bot_main_dispatcher, "main", tracer=tracer, recorder=recorder)
 
     # Create multi-bot dispatcher with main bot as default bot
     bot_multi_dispatcher = Dispatcher(
@@ -102,6 +179,7 @@ def main():
         mongo_client=mongo,
         sessionmaker=sessionmaker,
     )
+    instrument_dispatcher(bot_multi_dispatcher, "multi", TenantLabels(config.metrics.MAX_TENANTS), tracer, recorder)
 
     # Register startup and shutdown functions for main dispatcher
     bot_main_dispatcher.startup.register(startup)
@@ -112,26 +190,54 @@ def main():
     SimpleRequestHandler(
         dispatcher=bot_main_dispatcher,
         bot=bot_main,
+        handle_in_background=config.webhook.HANDLE_IN_BACKGROUND,
     ).register(app, path=bot_main_path)
 
     # Register TokenBasedRequestHandler for multi-bot dispatcher
     bot_multi_path = config.webhook.PATH_BOT_MULTI
-    TokenBasedRequestHandler(
+    bot_multi_handler = TokenBasedRequestHandler(
         dispatcher=bot_multi_dispatcher,
         bot_settings=bot_settings,
-    ).register(app, path=bot_multi_path)
+        handle_in_background=config.webhook.HANDLE_IN_BACKGROUND,
+    )
+    bot_multi_handler.register(app, path=bot_multi_path)
+    # Bots are created for every token seen, evicted bots are created again on their next update
+    track_cache("webhook_bots", bot_multi_handler.bots)
+
+    # Register route exposing the metrics
+    setup_metrics_route(app, config.metrics.PATH)
+    # Register routes profiling the process if a token is configured
+    if config.profiler.TOKEN:
+        ProfilerHandler(
+            token=config.profiler.TOKEN,
+            max_seconds=config.profiler.MAX_SECONDS,
+            interval=config.profiler.INTERVAL,
+        ).register(app, path=config.profiler.PATH)
 
     # Setup application with main and multi-bot dispatchers
     setup_application(app, bot_main_dispatcher, bot=bot_main)
     setup_application(app, bot_multi_dispatcher)
+    return app
 
-    # Run the web application
-    web.run_app(app, host=config.app.HOST, port=config.app.PORT)
 
+def main():
+    """
+    Main entry point of the application.
+    """
+    # Load configuration
+    config = load_config()
 
-if __name__ == "__main__":
     # Setup logger
-    setup_logger()
+    setup_logger(config.logging)
+
+    # Trace the allocations from the start if configured
+    if config.memory.TRACEMALLOC_FRAMES:
+        tracemalloc.start(config.memory.TRACEMALLOC_FRAMES)
+
+    # Run the web application
+    web.run_app(create_app(config), host=config.app.HOST, port=config.app.PORT)
+
 
+if __name__ == "__main__":
     # Run the main function
     main()
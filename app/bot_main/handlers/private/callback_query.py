@@ -1,14 +1,19 @@
 from aiogram import Router, Bot
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode
 from aiogram.types import CallbackQuery
 
+from app.bot_main.utils.broadcast import Broadcast
+from app.bot_multi.confirmations import CONFIRMATION_MODES, Confirmations
+from app.bot_main.utils.jobs import ExportJob
 from app.bot_main.utils.texts.buttons import ButtonCode
 from app.bot_main.utils.manager import Manager
+from app.bot_main.utils.pagination import parse_page_data
 from app.bot_main.utils.filters import IsPrivateFilter
 from app.bot_main.utils.states import State
 from app.config import ALLOWED_UPDATES
 from app.database.models import BotDB
-from app.mongodb.models import TextMongo
+from app.mongodb.models import SettingsMongo, TextMongo
 
 from .windows import Window
 from ...utils.texts.messages import MessageCode
@@ -47,20 +52,24 @@ async def handler(call: CallbackQuery, manager: Manager) -> None:
 async def handler(call: CallbackQuery, manager: Manager) -> None:
     match call.data:
         case ButtonCode.back:
-            await manager.state.update_data(current_page=1)
+            await manager.state.update_data(current_page=1, page_cursor=None)
             await Window.main_menu(manager)
         case bot_id if bot_id.isdigit():
             await manager.state.update_data(bot_id=int(bot_id))
             await Window.bot_info(manager)
         case cdata if cdata.startswith("page:"):
-            page = int(cdata.split(":")[1])
-            await manager.state.update_data(current_page=page)
+            page, cursor = parse_page_data(cdata)
+            await manager.state.update_data(current_page=page, page_cursor={State.bot_list.state: cursor})
             await Window.bot_list(manager)
     await call.answer()
 
 
 @router.callback_query(State.bot_info)
-async def handler(call: CallbackQuery, manager: Manager, session: AiohttpSession) -> None:
+async def handler(call: CallbackQuery,
+                  manager: Manager,
+                  session: AiohttpSession,
+                  confirmations: Confirmations,
+                  ) -> None:
     match call.data:
         case ButtonCode.back:
             await Window.bot_list(manager)
@@ -68,6 +77,25 @@ async def handler(call: CallbackQuery, manager: Manager, session: AiohttpSession
             await Window.user_list(manager)
         case ButtonCode.text_list:
             await Window.text_list(manager)
+        case ButtonCode.broadcast:
+            state_data = await manager.state.get_data()
+            if await Broadcast.get_progress(manager.redis, state_data["bot_id"]) is not None:
+                text = manager.text_message.get(MessageCode.broadcast_running)
+                return await call.answer(text, show_alert=True)
+            await Window.broadcast(manager)
+        case ButtonCode.confirmations:
+            state_data = await manager.state.get_data()
+            bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
+            mongodb = manager.mongo_client[bot_db.username]
+            settings = await SettingsMongo.load(mongodb)
+            index = CONFIRMATION_MODES.index(settings.confirmation_mode)
+            await SettingsMongo.create_or_update(
+                mongodb,
+                _id=settings.id,
+                confirmation_mode=CONFIRMATION_MODES[(index + 1) % len(CONFIRMATION_MODES)],
+            )
+            confirmations.invalidate(mongodb)
+            await Window.bot_info(manager)
         case ButtonCode.back:
             await Window.bot_info(manager)
         case ButtonCode.update_token:
@@ -97,21 +125,77 @@ async def handler(call: CallbackQuery, manager: Manager, session: AiohttpSession
     await call.answer()
 
 
+@router.callback_query(State.broadcast)
+async def handler(call: CallbackQuery, manager: Manager) -> None:
+    match call.data:
+        case ButtonCode.back:
+            await Window.bot_info(manager)
+    await call.answer()
+
+
+@router.callback_query(State.broadcast_confirm)
+async def handler(call: CallbackQuery, manager: Manager, session: AiohttpSession) -> None:
+    match call.data:
+        case ButtonCode.back:
+            await Window.broadcast(manager)
+        case ButtonCode.confirm:
+            state_data = await manager.state.get_data()
+            bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
+            token = BotDB.decrypt_token(manager.config.SECRET_KEY, bot_db.token)
+            is_started = await Broadcast.start(
+                bot_main=manager.bot,
+                bot=Bot(token, session, ParseMode.HTML),
+                redis=manager.redis,
+                mongodb=manager.mongo_client[bot_db.username],
+                bot_id=bot_db.id,
+                bot_username=bot_db.username,
+                owner_id=call.from_user.id,
+                language_code=manager.text_message.language_code,
+                text=state_data["broadcast_text"],
+                config=manager.config.broadcast,
+            )
+            if not is_started:
+                text = manager.text_message.get(MessageCode.broadcast_running)
+                return await call.answer(text, show_alert=True)
+            await Window.bot_info(manager)
+    await call.answer()
+
+
 @router.callback_query(State.user_list)
 async def handler(call: CallbackQuery, manager: Manager) -> None:
     match call.data:
         case ButtonCode.back:
-            await manager.state.update_data(current_page=1)
+            await manager.state.update_data(current_page=1, page_cursor=None)
             await Window.bot_info(manager)
-        case export_type if export_type in [ButtonCode.export_csv, ButtonCode.export_json]:
-            text = manager.text_message.get(MessageCode.in_development)
-            await call.answer(text, show_alert=True)
+        case export_type if export_type in [ButtonCode.export_csv, ButtonCode.export_json, ButtonCode.export_ndjson]:
+            state_data = await manager.state.get_data()
+            bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
+            export_format = export_type.removeprefix("export_")
+
+            if not await ExportJob.send_cached(manager.bot, manager.redis, call.from_user.id, bot_db.id, export_format):
+                export_job = ExportJob(
+                    bot=manager.bot,
+                    redis=manager.redis,
+                    state=manager.state,
+                    mongodb=manager.mongo_client[bot_db.username],
+                    bot_id=bot_db.id,
+                    bot_username=bot_db.username,
+                    user_id=call.from_user.id,
+                    export_format=export_format,
+                    text_message=manager.text_message,
+                )
+                if not await export_job.start():
+                    text = manager.text_message.get(MessageCode.export_running)
+                    return await call.answer(text, show_alert=True)
+                await Window.user_list(manager)
+        case ButtonCode.import_users:
+            await Window.user_import(manager)
         case user_id if user_id.isdigit():
             await manager.state.update_data(user_id=int(user_id))
             await Window.user_info(manager)
         case cdata if cdata.startswith("page:"):
-            page = int(cdata.split(":")[1])
-            await manager.state.update_data(current_page=page)
+            page, cursor = parse_page_data(cdata)
+            await manager.state.update_data(current_page=page, page_cursor={State.user_list.state: cursor})
             await Window.user_list(manager)
     await call.answer()
 
@@ -124,18 +208,26 @@ async def handler(call: CallbackQuery, manager: Manager) -> None:
     await call.answer()
 
 
+@router.callback_query(State.user_import)
+async def handler(call: CallbackQuery, manager: Manager) -> None:
+    match call.data:
+        case ButtonCode.back:
+            await Window.user_list(manager)
+    await call.answer()
+
+
 @router.callback_query(State.text_list)
 async def handler(call: CallbackQuery, manager: Manager) -> None:
     match call.data:
         case ButtonCode.back:
-            await manager.state.update_data(current_page=1)
+            await manager.state.update_data(current_page=1, page_cursor=None)
             await Window.bot_info(manager)
         case text_id if text_id.isdigit():
             await manager.state.update_data(text_id=int(text_id))
             await Window.text_info(manager)
         case cdata if cdata.startswith("page:"):
-            page = int(cdata.split(":")[1])
-            await manager.state.update_data(current_page=page)
+            page, cursor = parse_page_data(cdata)
+            await manager.state.update_data(current_page=page, page_cursor={State.text_list.state: cursor})
             await Window.text_list(manager)
     await call.answer()
 
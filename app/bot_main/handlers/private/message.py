@@ -6,9 +6,13 @@ from aiogram.types import Message, User
 from aiogram.utils.token import validate_token, TokenValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.bot_main.utils.importer import MAX_IMPORT_SIZE, ImportManager
+from app.bot_main.utils.jobs import ImportJob
 from app.bot_main.utils.manager import Manager
 from app.bot_main.utils.states import State
 from app.bot_main.utils.filters import IsPrivateFilter
+from app.bot_main.utils.texts.messages import MessageCode
+from app.bot_multi.outbox import Outbox
 from app.config import Config, ALLOWED_UPDATES
 from app.database.models import BotDB, UserDB
 
@@ -32,6 +36,7 @@ async def handler(message: Message,
                   config: Config,
                   manager: Manager,
                   user_db: UserDB,
+                  outbox: Outbox,
                   ) -> None:
     try:
         token = message.text
@@ -46,6 +51,8 @@ async def handler(message: Message,
             token=BotDB.encrypt_token(config.SECRET_KEY, token),
             username=bot_user.username,
         )
+        # A bot registered again has a new token, replies queued meanwhile are sent with it
+        outbox.forget_bot(bot_user.id)
         await bot.set_webhook(
             config.webhook.DOMAIN +
             config.webhook.PATH_BOT_MULTI.format(bot_token=token),
@@ -69,6 +76,14 @@ async def handler(message: Message, manager: Manager) -> None:
     await manager.delete_message(message)
 
 
+@router.message(State.broadcast)
+async def handler(message: Message, manager: Manager) -> None:
+    if message.content_type == "text" and len(message.html_text) <= 4096:
+        await manager.state.update_data(broadcast_text=message.html_text)
+        await Window.broadcast_confirm(manager)
+    await manager.delete_message(message)
+
+
 @router.message(State.text_edit_media)
 async def handler(message: Message, manager: Manager) -> None:
     if message.content_type == "text" and len(message.text) <= 500:
@@ -76,3 +91,31 @@ async def handler(message: Message, manager: Manager) -> None:
             await manager.state.update_data(media_url=message.text)
             await Window.text_edit_media_confirm(manager)
     await manager.delete_message(message)
+
+
+@router.message(State.user_import)
+async def handler(message: Message, manager: Manager) -> None:
+    import_format = ImportManager.get_format(message.document.file_name) if message.document else None
+    if import_format is None or (message.document.file_size or 0) > MAX_IMPORT_SIZE:
+        await Window.user_import(manager, manager.text_message.get(MessageCode.user_import_rejected))
+        return await manager.delete_message(message)
+
+    state_data = await manager.state.get_data()
+    bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
+    import_job = ImportJob(
+        bot=manager.bot,
+        redis=manager.redis,
+        state=manager.state,
+        mongodb=manager.mongo_client[bot_db.username],
+        bot_id=bot_db.id,
+        bot_username=bot_db.username,
+        user_id=message.from_user.id,
+        document=message.document,
+        import_format=import_format,
+        text_message=manager.text_message,
+    )
+    if not await import_job.start():
+        await Window.user_import(manager, manager.text_message.get(MessageCode.import_running))
+    else:
+        await Window.user_import(manager)
+    await manager.delete_message(message)
@@ -4,21 +4,37 @@ from aiogram import Bot
 from aiogram.enums import ChatMemberStatus
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State as St
 from aiogram.types import User, ChatMemberUpdated
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.bot_main.utils.texts.buttons import TextButton
 from app.bot_main.utils.texts.messages import MessageCode, TextMessage
 from app.bot_main.utils import keyboards
+from app.bot_main.utils.broadcast import Broadcast
+from app.bot_main.utils.jobs import ExportJob, ImportJob
 from app.bot_main.utils.keyboards import InlineKeyboardPaginator
 from app.bot_main.utils.manager import Manager
+from app.bot_main.utils.pagination import page_cursors, page_query
 from app.bot_main.utils.states import State
 from app.database.models import BotDB
-from app.mongodb.models import UserMongo, TextMongo
+from app.mongodb.models import SettingsMongo, UserMongo, TextMongo
 
 
 class Window:
 
+    @staticmethod
+    def _clamp_page(state_data: dict, total_pages: int, state: St) -> tuple[int, str | None]:
+        """
+        Get the current page and its cursor from the state data.
+
+        The cursor is only used by the list it was created for and is dropped if the page is out of range.
+        """
+        current_page = state_data.get("current_page", 1)
+        if 1 <= current_page <= max(total_pages, 1):
+            return current_page, (state_data.get("page_cursor") or {}).get(state.state)
+        return max(total_pages, 1), None
+
     @staticmethod
     async def main_menu(manager: Manager) -> None:
         text = manager.text_message.get(MessageCode.main_menu)
@@ -49,10 +65,14 @@ class Window:
     @staticmethod
     async def bot_list(manager: Manager) -> None:
         state_data = await manager.state.get_data()
-        current_page, page_size = state_data.get("current_page", 1), 10
+        page_size, user_id = 10, manager.user.id
+
+        total = await BotDB.count_cached(manager.async_session, user_id=user_id)
+        total_pages = (total + page_size - 1) // page_size
+        current_page, cursor = Window._clamp_page(state_data, total_pages, State.bot_list)
 
-        bots_list = await BotDB.paginate(manager.async_session, current_page, page_size)
-        total_pages = await BotDB.total_pages(manager.async_session, page_size)
+        query = page_query(current_page, page_size, total, cursor)
+        bots_list = await BotDB.paginate_keyset(manager.async_session, **query, user_id=user_id)
         items = [(bot.username, bot.id) for bot in bots_list]
 
         text = manager.text_message.get(MessageCode.bot_list)
@@ -61,6 +81,7 @@ class Window:
             items=items,
             current_page=current_page,
             total_pages=total_pages,
+            cursors=page_cursors(current_page, [bot.id for bot in bots_list]),
             after_builder=after_builder,
         ).as_markup()
 
@@ -72,35 +93,87 @@ class Window:
         state_data = await manager.state.get_data()
         bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
 
+        settings = await SettingsMongo.load(manager.mongo_client[bot_db.username])
         text = manager.text_message.get(MessageCode.bot_info)
+        text += "\n\n" + manager.text_message.get(f"confirmation_mode_{settings.confirmation_mode}")
+        progress = await Broadcast.get_progress(manager.redis, bot_db.id)
+        if progress is not None:
+            text += "\n\n" + manager.text_message.get(MessageCode.broadcast_progress).format_map(progress)
         reply_markup = keyboards.bot_information(manager.text_button, bot_db).as_markup()
 
         await manager.send_message(text, reply_markup=reply_markup)
         await manager.state.set_state(State.bot_info)
 
+    @staticmethod
+    async def broadcast(manager: Manager) -> None:
+        text = manager.text_message.get(MessageCode.broadcast)
+        reply_keyboard = keyboards.back(manager.text_button).as_markup()
+
+        await manager.send_message(text, reply_markup=reply_keyboard)
+        await manager.state.set_state(State.broadcast)
+
+    @staticmethod
+    async def broadcast_confirm(manager: Manager) -> None:
+        text = manager.text_message.get(MessageCode.broadcast_confirm)
+        reply_keyboard = keyboards.back_confirm(manager.text_button).as_markup()
+
+        state_data = await manager.state.get_data()
+        frmt = {"text": state_data["broadcast_text"]}
+
+        await manager.send_message(text.format_map(frmt), reply_markup=reply_keyboard)
+        await manager.state.set_state(State.broadcast_confirm)
+
     @staticmethod
     async def user_list(manager: Manager) -> None:
         state_data = await manager.state.get_data()
-        current_page, page_size = state_data.get("current_page", 1), 10
+        page_size = 10
 
         bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
-        users_list = await UserMongo.paginate(manager.mongo_client[bot_db.username], current_page, page_size)
-        total_pages = await UserMongo.total_pages(manager.mongo_client[bot_db.username], page_size)
+        mongodb = manager.mongo_client[bot_db.username]
+        total = await UserMongo.count(mongodb)
+        total_pages = (total + page_size - 1) // page_size
+        current_page, cursor = Window._clamp_page(state_data, total_pages, State.user_list)
+
+        query = page_query(current_page, page_size, total, cursor)
+        users_list = await UserMongo.paginate_keyset(mongodb, **query, projection=["full_name"])
         items = [(user.full_name, user.id) for user in users_list]
 
         text = manager.text_message.get(MessageCode.user_list)
+        progress = await ExportJob.get_progress(manager.redis, manager.user.id, bot_db.id)
+        if progress is not None:
+            exported, export_total = progress
+            progress_text = manager.text_message.get(MessageCode.export_progress)
+            text += "\n\n" + progress_text.format(count=exported, total=export_total)
         before_builder = keyboards.export_tools(manager.text_button)
         after_builder = keyboards.back(manager.text_button)
         reply_markup = InlineKeyboardPaginator(
             items=items,
             current_page=current_page,
             total_pages=total_pages,
+            cursors=page_cursors(current_page, [user.id for user in users_list]),
             before_builder=before_builder,
             after_builder=after_builder,
         ).as_markup()
 
-        await manager.send_message(text, reply_markup=reply_markup)
+        message = await manager.send_message(text, reply_markup=reply_markup)
         await manager.state.set_state(State.user_list)
+        ExportJob.attach(manager.user.id, message)
+
+    @staticmethod
+    async def user_import(manager: Manager, result: str | None = None) -> None:
+        state_data = await manager.state.get_data()
+        text = manager.text_message.get(MessageCode.user_import)
+        if result is not None:
+            text += "\n\n" + result
+        progress = await ImportJob.get_progress(manager.redis, manager.user.id, state_data["bot_id"])
+        if progress is not None:
+            progress_text = manager.text_message.get(MessageCode.import_progress)
+            text += "\n\n" + progress_text.format(count=progress[0])
+        reply_keyboard = keyboards.back(manager.text_button).as_markup()
+
+        message = await manager.send_message(text, reply_markup=reply_keyboard)
+        await manager.state.set_state(State.user_import)
+        ImportJob.attach(manager.user.id, message)
 
     @staticmethod
     async def user_info(manager: Manager) -> None:
@@ -113,13 +186,18 @@ class Window:
     @staticmethod
     async def text_list(manager: Manager) -> None:
         state_data = await manager.state.get_data()
-        current_page, page_size = state_data.get("current_page", 1), 10
+        page_size = 10
 
         bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
-        text_list = await TextMongo.paginate(manager.mongo_client[bot_db.username], current_page, page_size)
-        total_pages = await TextMongo.total_pages(manager.mongo_client[bot_db.username], page_size)
-        items = [(getattr(text, f"description_{manager.user.language_code}"), text.id)
-                 for text in text_list]
+        mongodb = manager.mongo_client[bot_db.username]
+        total = await TextMongo.count(mongodb)
+        total_pages = (total + page_size - 1) // page_size
+        current_page, cursor = Window._clamp_page(state_data, total_pages, State.text_list)
+
+        description = f"description_{manager.user.language_code}"
+        query = page_query(current_page, page_size, total, cursor)
+        text_list = await TextMongo.paginate_keyset(mongodb, **query, projection=[description])
+        items = [(getattr(text, description), text.id) for text in text_list]
 
         text = manager.text_message.get(MessageCode.text_list)
         after_builder = keyboards.back(manager.text_button)
@@ -127,6 +205,7 @@ class Window:
             items=items,
             current_page=current_page,
             total_pages=total_pages,
+            cursors=page_cursors(current_page, [text.id for text in text_list]),
             after_builder=after_builder,
         ).as_markup()
 
@@ -148,7 +227,10 @@ class Window:
 
         state_data = await manager.state.get_data()
         bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
-        text_mongo = await TextMongo.get(manager.mongo_client[bot_db.username], state_data["text_id"])
+        text_mongo = await TextMongo.get_by_key(
+            manager.mongo_client[bot_db.username], "_id", state_data["text_id"],
+            projection=[state_data["text_language_code"][-2:]],
+        )
         frmt = {"old_text": getattr(text_mongo, state_data["text_language_code"][-2:])}
 
         await manager.send_message(text.format_map(frmt), reply_markup=reply_keyboard)
@@ -172,7 +254,10 @@ class Window:
 
         state_data = await manager.state.get_data()
         bot_db = await BotDB.get(manager.async_session, state_data["bot_id"])
-        text_mongo = await TextMongo.get(manager.mongo_client[bot_db.username], state_data["text_id"])
+        text_mongo = await TextMongo.get_by_key(
+            manager.mongo_client[bot_db.username], "_id", state_data["text_id"],
+            projection=["media_url"],
+        )
         frmt = {"old_media_url": text_mongo.media_url}
 
         await manager.send_message(text.format_map(frmt), reply_markup=reply_keyboard)
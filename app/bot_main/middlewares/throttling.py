@@ -5,6 +5,8 @@ from aiogram.dispatcher.flags import get_flag
 from aiogram.types import TelegramObject, User
 from cachetools import TTLCache
 
+from app.monitoring import count_cache_lookup, track_cache
+
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
@@ -31,6 +33,7 @@ class ThrottlingMiddleware(BaseMiddleware):
         self.caches: Dict[str, MutableMapping[int, None]] = {}
         for name, ttl in ttl_map.items():
             self.caches[name] = TTLCache(maxsize=10_000, ttl=ttl)
+            track_cache(f"throttling_main_{name}", self.caches[name])
 
     async def __call__(
             self,
@@ -53,7 +56,9 @@ class ThrottlingMiddleware(BaseMiddleware):
 
             # Check if the user is already throttled for the given key
             if throttling_key and user.id in self.caches[throttling_key]:
+                count_cache_lookup(f"throttling_main_{throttling_key}", True)
                 return None
+            count_cache_lookup(f"throttling_main_{throttling_key}", False)
 
             # Add the user to the cache to indicate throttling
             self.caches[throttling_key][user.id] = None
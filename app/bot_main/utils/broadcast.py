@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import uuid
+from contextlib import suppress
+from typing import Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot_main.utils.texts.messages import MessageCode, TextMessage
+from app.config import BroadcastConfig, Config
+from app.database.models import BotDB
+from app.mongodb.models import UserMongo
+
+# Set of the ids of the bots with a broadcast in progress
+BROADCASTS_KEY = "broadcasts"
+
+# Number of recipients read and sent between two checkpoints,
+# at most this many users may receive the message twice after a restart
+BATCH_SIZE = 100
+# Attempts to send the message to a user on network and server errors or flood limits
+SEND_ATTEMPTS = 5
+# Lifetime in seconds of the lock of a running broadcast, refreshed while it runs,
+# so a broadcast lost with its instance is resumed by another one
+LOCK_TTL = 60
+# Interval in seconds between two refreshes of the lock
+LOCK_REFRESH = LOCK_TTL / 4
+
+# Refresh the lock of a broadcast, if it is still held by the instance
+REFRESH_LOCK = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+# Delete the lock of a broadcast, if it is still held by the instance
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+
+class TokenBucket:
+    """
+    Paces calls to a rate, allowing bursts of up to capacity calls.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = asyncio.get_running_loop().time()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a call is allowed.
+        """
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back all calls for the given number of seconds, e.g. after a flood limit error.
+        """
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class Broadcast:
+    """
+    Sends a text message to all member users of a bot in the background.
+
+    Recipients are read from the users collection in ascending _id order and sent to in batches by a bounded
+    number of workers, paced by a token bucket to the rate limit of the bot. The text, the counters and the
+    _id of the last finished batch are stored in Redis, so a broadcast interrupted by a restart resumes after
+    that batch. Users who blocked the bot are marked as kicked and skipped by later broadcasts.
+
+    A running broadcast holds a lock refreshed while it runs. Every instance resumes the broadcasts whose lock
+    has expired, at startup and then every LOCK_TTL seconds, so a broadcast runs in one instance at a time.
+    """
+    # References to the tasks of the running broadcasts of this process
+    tasks: Set[asyncio.Task] = set()
+    # Task resuming the broadcasts of the stopped instances
+    watcher: Optional[asyncio.Task] = None
+
+    def __init__(
+            self,
+            bot_main: Bot,
+            bot: Bot,
+            redis: Redis,
+            mongodb: AsyncIOMotorDatabase,
+            bot_id: int,
+            bot_username: str,
+            owner_id: int,
+            language_code: str,
+            text: str,
+            config: BroadcastConfig,
+            checkpoint: int = 0,
+            sent: int = 0,
+            blocked: int = 0,
+            failed: int = 0,
+            lock_token: Optional[str] = None,
+    ) -> None:
+        self.bot_main = bot_main
+        self.bot = bot
+        self.redis = redis
+        self.mongodb = mongodb
+        self.bot_id = bot_id
+        self.bot_username = bot_username
+        self.owner_id = owner_id
+        self.language_code = language_code
+        self.text = text
+        self.config = config
+
+        self.checkpoint = checkpoint
+        self.sent = sent
+        self.blocked = blocked
+        self.failed = failed
+        self.lock_token = lock_token or uuid.uuid4().hex
+
+    @staticmethod
+    def _key(bot_id: int) -> str:
+        return f"broadcast:{bot_id}"
+
+    @staticmethod
+    def _lock_key(bot_id: int) -> str:
+        return f"broadcast:{bot_id}:lock"
+
+    @classmethod
+    async def get_progress(cls, redis: Redis, bot_id: int) -> Optional[Dict[str, int]]:
+        """
+        Get the counters of the broadcast of a bot.
+
+        :return: The sent, blocked and failed counters, or None if no broadcast of the bot is in progress.
+        """
+        data = await redis.hmget(cls._key(bot_id), "sent", "blocked", "failed")
+        if data[0] is None:
+            return None
+        return dict(zip(["sent", "blocked", "failed"], map(int, data)))
+
+    @classmethod
+    async def start(
+            cls,
+            bot_main: Bot,
+            bot: Bot,
+            redis: Redis,
+            mongodb: AsyncIOMotorDatabase,
+            bot_id: int,
+            bot_username: str,
+            owner_id: int,
+            language_code: str,
+            text: str,
+            config: BroadcastConfig,
+    ) -> bool:
+        """
+        Store a new broadcast of a bot and run it in a background task.
+
+        :return: False if a broadcast of the bot is already in progress.
+        """
+        key = cls._key(bot_id)
+        if not await redis.hsetnx(key, "owner_id", owner_id):
+            return False
+        await redis.hset(key, mapping={
+            "bot_username": bot_username,
+            "language_code": language_code,
+            "text": text,
+            "checkpoint": 0,
+            "sent": 0,
+            "blocked": 0,
+            "failed": 0,
+        })
+        # Locked before it is listed, so the other instances do not resume it
+        broadcast = cls(bot_main, bot, redis, mongodb, bot_id, bot_username, owner_id, language_code, text, config)
+        await redis.set(cls._lock_key(bot_id), broadcast.lock_token, ex=LOCK_TTL)
+        await redis.sadd(BROADCASTS_KEY, bot_id)
+        broadcast._spawn()
+        return True
+
+    @classmethod
+    async def resume_all(
+            cls,
+            bot_main: Bot,
+            session: AiohttpSession,
+            redis: Redis,
+            mongo_client: AsyncIOMotorClient,
+            sessionmaker: async_sessionmaker,
+            config: Config,
+    ) -> None:
+        """
+        Resume the interrupted broadcasts whose lock has expired from their checkpoints.
+        """
+        async with sessionmaker() as async_session:
+            for bot_id in map(int, await redis.smembers(BROADCASTS_KEY)):
+                lock_token = uuid.uuid4().hex
+                if not await redis.set(cls._lock_key(bot_id), lock_token, nx=True, ex=LOCK_TTL):
+                    # The broadcast is running in this or another instance
+                    continue
+
+                state = await redis.hgetall(cls._key(bot_id))
+                data = {key.decode(): value.decode() for key, value in state.items()}
+                bot_db = await BotDB.get(async_session, bot_id)
+                if not data or bot_db is None:
+                    await redis.srem(BROADCASTS_KEY, bot_id)
+                    await redis.delete(cls._key(bot_id), cls._lock_key(bot_id))
+                    continue
+
+                token = BotDB.decrypt_token(config.SECRET_KEY, bot_db.token)
+                cls(
+                    bot_main=bot_main,
+                    bot=Bot(token, session, ParseMode.HTML),
+                    redis=redis,
+                    mongodb=mongo_client[bot_db.username],
+                    bot_id=bot_id,
+                    bot_username=data["bot_username"],
+                    owner_id=int(data["owner_id"]),
+                    language_code=data["language_code"],
+                    text=data["text"],
+                    config=config.broadcast,
+                    checkpoint=int(data["checkpoint"]),
+                    sent=int(data["sent"]),
+                    blocked=int(data["blocked"]),
+                    failed=int(data["failed"]),
+                    lock_token=lock_token,
+                )._spawn()
+
+    @classmethod
+    async def watch(
+            cls,
+            bot_main: Bot,
+            session: AiohttpSession,
+            redis: Redis,
+            mongo_client: AsyncIOMotorClient,
+            sessionmaker: async_sessionmaker,
+            config: Config,
+    ) -> None:
+        """
+        Resume the interrupted broadcasts, then keep resuming the broadcasts of the stopped instances.
+        """
+        await cls.resume_all(bot_main, session, redis, mongo_client, sessionmaker, config)
+
+        async def resume_later() -> None:
+            while True:
+                await asyncio.sleep(LOCK_TTL)
+                try:
+                    await cls.resume_all(bot_main, session, redis, mongo_client, sessionmaker, config)
+                except Exception as ex:  # noqa
+                    logging.error(f"Resuming broadcasts failed: {ex}")
+
+        cls.watcher = asyncio.create_task(resume_later())
+
+    @classmethod
+    async def cancel_all(cls) -> None:
+        """
+        Cancel the running broadcasts of this process, keeping their checkpoints for resumption,
+        and release their locks.
+        """
+        watcher, cls.watcher = cls.watcher, None
+        tasks = [*cls.tasks, *([watcher] if watcher is not None else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self) -> None:
+        task = asyncio.create_task(self.run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self) -> None:
+        bucket = TokenBucket(self.config.RATE)
+        semaphore = asyncio.Semaphore(self.config.WORKERS)
+
+        async def send(user_id: int) -> Optional[bool]:
+            async with semaphore:
+                return await self._send(bucket, user_id)
+
+        text_code = MessageCode.broadcast_finished
+        keeper = asyncio.create_task(self._keep_lock(asyncio.current_task()))
+        try:
+            recipients = {"state": "member", "_id": {"$gt": self.checkpoint}}
+            async for users in UserMongo.iterate_batches(self.mongodb, recipients, ["_id"], BATCH_SIZE):
+                results = await asyncio.gather(*[send(user.id) for user in users])
+
+                kicked = [user.id for user, result in zip(users, results) if result is None]
+                await UserMongo.update_many(self.mongodb, kicked, state="kicked")
+                self.blocked += len(kicked)
+                self.sent += results.count(True)
+                self.failed += results.count(False)
+                self.checkpoint = users[-1].id
+                await self.redis.hset(self._key(self.bot_id), mapping={
+                    "checkpoint": self.checkpoint,
+                    "sent": self.sent,
+                    "blocked": self.blocked,
+                    "failed": self.failed,
+                })
+        except asyncio.CancelledError:
+            keeper.cancel()
+            await self._release()
+            raise
+        except Exception as ex:  # noqa
+            logging.exception(f"Broadcast of @{self.bot_username} failed: {ex}")
+            text_code = MessageCode.broadcast_failed
+        keeper.cancel()
+
+        await self.redis.delete(self._key(self.bot_id))
+        await self.redis.srem(BROADCASTS_KEY, self.bot_id)
+        await self._release()
+
+        text = TextMessage(self.language_code).get(text_code).format(
+            bot_username=self.bot_username, sent=self.sent, blocked=self.blocked, failed=self.failed,
+        )
+        with suppress(Exception):
+            await self.bot_main.send_message(self.owner_id, text)
+
+    async def _keep_lock(self, task: asyncio.Task) -> None:
+        """
+        Refresh the lock for the whole run, and stop the broadcast if another instance took it over.
+        """
+        while True:
+            await asyncio.sleep(LOCK_REFRESH)
+            try:
+                if not await self.redis.eval(REFRESH_LOCK, 1, self._lock_key(self.bot_id), self.lock_token, LOCK_TTL):
+                    logging.warning(f"Broadcast of @{self.bot_username} lost its lock")
+                    task.cancel()
+                    return
+            except Exception as ex:  # noqa
+                logging.warning(f"Lock of the broadcast of @{self.bot_username} not refreshed: {ex}")
+
+    async def _release(self) -> None:
+        """
+        Delete the lock, unless it has expired and was taken by another instance.
+        """
+        await self.redis.eval(RELEASE_LOCK, 1, self._lock_key(self.bot_id), self.lock_token)
+
+    async def _send(self, bucket: TokenBucket, user_id: int) -> Optional[bool]:
+        """
+        Send the message to a user.
+
+        :return: True if the message was sent, None if the user blocked the bot, False on other errors.
+        """
+        for attempt in range(SEND_ATTEMPTS):
+            await bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, self.text)
+                return True
+            except TelegramRetryAfter as ex:
+                bucket.pause(ex.retry_after)
+            except TelegramForbiddenError:
+                return None
+            except TelegramBadRequest:
+                return False
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(2 ** attempt)
+        return False
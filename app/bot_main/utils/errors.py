@@ -0,0 +1,112 @@
+import asyncio
+import traceback
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import BufferedInputFile, InputMediaDocument, Update
+from aiogram.utils.markdown import hbold
+
+from app.config import BASE_DIR
+
+
+@dataclass
+class ErrorGroup:
+    # Number of occurrences in the current window
+    count: int = 0
+    # First occurrence of the current window, reported as sample
+    exception: Optional[BaseException] = None
+    update: Optional[Update] = None
+
+
+class ErrorReporter:
+    """
+    Reports errors to the developer, grouped by fingerprint.
+
+    The first occurrence of an error is reported at once, the following ones are only counted and reported
+    together once per window, with the traceback and the update of the first occurrence of the window.
+    A group without occurrences for a whole window is dropped, so the next occurrence is reported at once again.
+    """
+
+    def __init__(self, window: int) -> None:
+        """
+        :param window: The window in seconds between two reports of the same error.
+        """
+        self.window = window
+        self.groups: Dict[str, ErrorGroup] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def fingerprint(exception: BaseException) -> str:
+        """
+        Get the fingerprint of an exception: its type and the innermost frame of the application raising it.
+        """
+        frames = traceback.extract_tb(exception.__traceback__)
+        frame = next((f for f in reversed(frames) if f.filename.startswith(str(BASE_DIR))), None)
+        if frame is None and frames:
+            frame = frames[-1]
+        location = f"{frame.filename}:{frame.lineno}" if frame is not None else "unknown"
+        return f"{type(exception).__module__}.{type(exception).__qualname__}@{location}"
+
+    def report(self, bot: Bot, chat_id: int, exception: BaseException, update: Update) -> None:
+        """
+        Count an error, reporting it at once if it is the first occurrence.
+
+        :param bot: The bot sending the reports.
+        :param chat_id: The ID of the chat of the developer.
+        :param exception: The exception.
+        :param update: The update the exception was raised for.
+        """
+        key = self.fingerprint(exception)
+        group = self.groups.get(key)
+        if group is not None:
+            if group.count == 0:
+                group.exception, group.update = exception, update
+            group.count += 1
+            return
+
+        self.groups[key] = ErrorGroup()
+        task = asyncio.create_task(self._run(bot, chat_id, key, ErrorGroup(1, exception, update)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, bot: Bot, chat_id: int, key: str, first: ErrorGroup) -> None:
+        try:
+            await self._send(bot, chat_id, first, "first occurrence")
+            while True:
+                await asyncio.sleep(self.window)
+                group = self.groups[key]
+                if group.count == 0:
+                    break
+                self.groups[key] = ErrorGroup()
+                await self._send(bot, chat_id, group, f"{group.count} occurrences in the last {self.window}s")
+        finally:
+            del self.groups[key]
+
+    @staticmethod
+    async def _send(bot: Bot, chat_id: int, group: ErrorGroup, occurrences: str) -> None:
+        exception, update = group.exception, group.update
+        caption = f"{hbold(type(exception).__name__)}: {str(exception)[:900]}\n\n{occurrences}"
+
+        media = [
+            InputMediaDocument(media=BufferedInputFile(
+                "".join(traceback.format_exception(exception)).encode(),
+                filename=f"error_{update.update_id}.txt",
+            )),
+            InputMediaDocument(media=BufferedInputFile(
+                update.model_dump_json(indent=2, exclude_none=True).encode(),
+                filename=f"update_{update.update_id}.json",
+            ), caption=caption),
+        ]
+        with suppress(TelegramAPIError):
+            await bot.send_media_group(chat_id=chat_id, media=media)
+
+    async def close(self) -> None:
+        """
+        Cancel the pending reports.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -1,63 +1,250 @@
+import asyncio
 import csv
+import gzip
+import io
 import json
-from dataclasses import fields
-from io import BytesIO
-from typing import List, Dict, Any
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncGenerator, Awaitable, BinaryIO, Callable, Dict, List, Optional, TextIO, Tuple, Type
 
-import aiofiles
+from aiogram import Bot
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.mongodb.models import UserMongo
 
+# User fields included in the export
+EXPORT_FIELDS = ["_id", "username", "full_name", "language_code", "state", "is_banned", "created_at"]
+
+# Compressed size after which an export part is finished, below the 50 MB upload limit
+# of the Bot API with a margin for the batch that crosses it
+MAX_PART_SIZE = 45 * 1024 * 1024
+
+
+class ExportWriter:
+    """
+    Base class for writers serializing rows of users into a text stream.
+    """
+    extension: str
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+
+    def begin(self) -> None:
+        """
+        Write the beginning of the file.
+        """
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Write a batch of rows.
+        """
+        raise NotImplementedError
+
+    def end(self) -> None:
+        """
+        Write the end of the file.
+        """
+
+
+class CSVWriter(ExportWriter):
+    extension = "csv"
+
+    def __init__(self, stream: TextIO) -> None:
+        super().__init__(stream)
+        self.writer = csv.DictWriter(stream, EXPORT_FIELDS, restval="null", quoting=csv.QUOTE_ALL)
+
+    def begin(self) -> None:
+        self.writer.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self.writer.writerows(rows)
+
+
+class JSONWriter(ExportWriter):
+    extension = "json"
+
+    def __init__(self, stream: TextIO) -> None:
+        super().__init__(stream)
+        self.is_first = True
+
+    def begin(self) -> None:
+        self.stream.write("[")
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self.stream.write("\n" if self.is_first else ",\n")
+            self.stream.write(json.dumps(row, ensure_ascii=False, sort_keys=True))
+            self.is_first = False
+
+    def end(self) -> None:
+        self.stream.write("\n]\n")
+
+
+class NDJSONWriter(ExportWriter):
+    extension = "ndjson"
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self.stream.writelines(json.dumps(row, ensure_ascii=False, sort_keys=True) + "\n" for row in rows)
+
+
+WRITERS: Dict[str, Type[ExportWriter]] = {
+    writer.extension: writer for writer in [CSVWriter, JSONWriter, NDJSONWriter]
+}
+
+
+class SpooledInputFile(InputFile):
+    """
+    Input file uploading the content of a file object in chunks.
+    """
+
+    def __init__(self, file: BinaryIO, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
 
 class ExportManager:
+    """
+    Streams the users of a bot database into gzip-compressed spooled temporary files.
 
-    def __init__(self, users: List[UserMongo]) -> None:
-        self.rows = []
-        self.users = users
-        self.buffer = BytesIO()
+    Users are read from a MongoDB cursor in batches, and every batch is serialized and compressed
+    in a worker thread, so memory use does not depend on the number of users and the event loop
+    is not blocked. Each file stays in memory up to max_memory bytes and is moved to disk beyond.
+    When a file grows past max_part_size, the export continues in a new one, each of them being a
+    complete file of the chosen format.
+    """
 
-    def _get_users_list(self) -> List[Dict[str, Any]]:
+    def __init__(
+            self,
+            mongodb: AsyncIOMotorDatabase,
+            export_format: str,
+            batch_size: int = 1000,
+            max_memory: int = 4 * 1024 * 1024,
+            max_part_size: int = MAX_PART_SIZE,
+    ) -> None:
         """
-        Convert the list of UserMongo objects to a list of dictionaries.
+        Initialize the ExportManager.
+
+        :param mongodb: The database of the bot.
+        :param export_format: One of "csv", "json" or "ndjson".
+        :param batch_size: The number of users read and written at once.
+        :param max_memory: The size in bytes above which a file is moved to disk.
+        :param max_part_size: The compressed size in bytes above which a new file is started.
         """
-        user_list = []
-        for user in self.users:
-            del user.message_silent_id
-            del user.message_thread_id
-            del user.message_silent_mode
-            user_list.append(user.to_dict())
-        return user_list
+        if export_format not in WRITERS:
+            raise ValueError(f"Unknown export format {export_format}")
+
+        self.mongodb = mongodb
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.max_memory = max_memory
+        self.max_part_size = max_part_size
+        self.count = 0
 
-    async def save_as_json(self) -> bytes:
+    @staticmethod
+    def _get_row(user: UserMongo) -> Dict[str, Any]:
         """
-        Save the data as a JSON file and return the file content as bytes.
+        Convert a UserMongo object to a row of exported fields.
+        """
+        document = user.to_document()
+        row = {field: document[field] for field in EXPORT_FIELDS}
+        if isinstance(row["created_at"], datetime):
+            row["created_at"] = row["created_at"].isoformat()
+        return row
 
-        Returns:
-            bytes: The content of the JSON file as bytes.
+    def _open_part(self) -> Tuple[BinaryIO, gzip.GzipFile, io.TextIOWrapper, ExportWriter]:
+        """
+        Create a new file and start writing the export format into it.
         """
-        async with aiofiles.tempfile.NamedTemporaryFile("w+", suffix=".json", delete=True) as f:
-            data = json.dumps(self._get_users_list(), ensure_ascii=False, indent=2, sort_keys=True)
-            await f.write(data)
-            await f.seek(0)
-            self.buffer = f.buffer.read()
+        file = SpooledTemporaryFile(max_size=self.max_memory)  # noqa:SIM115
+        gzip_file = gzip.GzipFile(fileobj=file, mode="wb")
+        stream = io.TextIOWrapper(gzip_file, encoding="utf-8", newline="")
+        writer = WRITERS[self.export_format](stream)
+        writer.begin()
+        return file, gzip_file, stream, writer
 
-        return self.buffer
+    @staticmethod
+    def _write_part(
+            file: BinaryIO, gzip_file: gzip.GzipFile, stream: io.TextIOWrapper, writer: ExportWriter,
+            rows: List[Dict[str, Any]],
+    ) -> int:
+        """
+        Write a batch of rows into a file.
 
-    async def save_as_csv(self):
-        async with aiofiles.tempfile.NamedTemporaryFile("w+", suffix=".csv", delete=True) as f:
-            excluded_fields = ["message_silent_id", "message_thread_id", "message_silent_mode"]
-            fieldnames = [field.name for field in fields(UserMongo) if field.name not in excluded_fields]
+        :return: The compressed size of the file. The compressor is flushed after every batch,
+            otherwise it may hold back a large amount of well compressible data.
+        """
+        writer.write(rows)
+        stream.flush()
+        gzip_file.flush()
+        return file.tell()
+
+    @staticmethod
+    def _close_part(file: BinaryIO, gzip_file: gzip.GzipFile, stream: io.TextIOWrapper, writer: ExportWriter) -> None:
+        """
+        Finish the export format and the compression of a file and rewind it.
+        """
+        writer.end()
+        stream.flush()
+        stream.detach()
+        # Closing the GzipFile writes the trailer and leaves the underlying file open
+        gzip_file.close()
+        file.seek(0)
+
+    async def write(
+            self,
+            on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> List[BinaryIO]:
+        """
+        Write all users of the bot.
 
-            writer = csv.DictWriter(f, fieldnames, restval="null", quoting=csv.QUOTE_ALL)
-            await writer.writeheader()
-            users_list = self._get_users_list()
+        :param on_progress: Coroutine function called with the number of exported users after every batch.
+        :return: The files, positioned at their beginning.
+        """
+        loop = asyncio.get_running_loop()
+        files: List[BinaryIO] = []
+
+        part = await loop.run_in_executor(None, self._open_part)
+        size = 0
+        async for users in UserMongo.iterate_batches(self.mongodb, projection=EXPORT_FIELDS,
+                                                     batch_size=self.batch_size):
+            if size >= self.max_part_size:
+                await loop.run_in_executor(None, self._close_part, *part)
+                files.append(part[0])
+                part = await loop.run_in_executor(None, self._open_part)
+
+            rows = [self._get_row(user) for user in users]
+            size = await loop.run_in_executor(None, self._write_part, *part, rows)
+            self.count += len(rows)
+            if on_progress is not None:
+                await on_progress(self.count)
 
-            for user in users_list:
-                user_data = {field.name: getattr(user, field.name)
-                             for field in fields(UserMongo) if
-                             field.name not in excluded_fields}
-                await writer.writerow(user_data)
-            await f.seek(0)
-            self.buffer = f.buffer.read()
+        await loop.run_in_executor(None, self._close_part, *part)
+        files.append(part[0])
+        return files
 
-        return self.buffer
+    async def as_input_files(
+            self,
+            filename: str,
+            on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> List[SpooledInputFile]:
+        """
+        Write all users of the bot and wrap the files into input files for sending as documents.
+
+        :param filename: The file name without extensions.
+        :param on_progress: Coroutine function called with the number of exported users after every batch.
+        :return: A list of SpooledInputFile objects, numbered when the export is split into parts.
+        """
+        files = await self.write(on_progress)
+        extension = f"{self.export_format}.gz"
+        if len(files) == 1:
+            return [SpooledInputFile(files[0], filename=f"{filename}.{extension}")]
+        return [
+            SpooledInputFile(file, filename=f"{filename}_part{number}.{extension}")
+            for number, file in enumerate(files, start=1)
+        ]
@@ -0,0 +1,207 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, TextIO
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.mongodb.models import UserMongo
+
+# Size limit in bytes of files downloaded by bots through the Bot API
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+
+# User fields overwritten for existing users, the other fields are only set for new users
+UPDATE_FIELDS = ["username", "full_name", "language_code"]
+
+USER_STATES = ["member", "kicked"]
+NULL_VALUES = ["", "null", "None"]
+TRUE_VALUES = ["true", "1", "yes"]
+FALSE_VALUES = ["false", "0", "no"]
+
+
+def read_csv(stream: TextIO) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Read rows of a CSV file with a header line.
+    """
+    yield from csv.DictReader(stream)
+
+
+def read_ndjson(stream: TextIO) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Read rows of a file with a JSON object per line, yielding None for lines that are not valid.
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+READERS: Dict[str, Callable[[TextIO], Iterator[Optional[Dict[str, Any]]]]] = {
+    "csv": read_csv,
+    "ndjson": read_ndjson,
+    "jsonl": read_ndjson,
+}
+
+
+class ImportManager:
+    """
+    Imports users into a bot database from a CSV or NDJSON file, optionally gzip-compressed.
+
+    The file is parsed as a stream in a worker thread, and valid rows are written in batches of
+    unordered bulk upserts, so the number of rows is not limited by memory. New users are inserted,
+    existing users only get their username, full_name and language_code updated.
+    """
+
+    def __init__(
+            self,
+            mongodb: AsyncIOMotorDatabase,
+            import_format: str,
+            batch_size: int = 1000,
+    ) -> None:
+        """
+        Initialize the ImportManager.
+
+        :param mongodb: The database of the bot.
+        :param import_format: One of the READERS keys, see get_format.
+        :param batch_size: The number of rows written at once.
+        """
+        if import_format not in READERS:
+            raise ValueError(f"Unknown import format {import_format}")
+
+        self.mongodb = mongodb
+        self.import_format = import_format
+        self.batch_size = batch_size
+
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+
+    @staticmethod
+    def get_format(filename: Optional[str]) -> Optional[str]:
+        """
+        Get the import format from the extension of a file name, ignoring a .gz extension.
+
+        :return: The import format, or None if the file is not supported.
+        """
+        if not filename:
+            return None
+        name = filename.lower().removesuffix(".gz")
+        extension = name.rpartition(".")[2]
+        return extension if extension in READERS else None
+
+    @staticmethod
+    def _parse_bool(value: Any) -> bool:
+        if isinstance(value, bool):
+            return value
+        value = str(value).lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        raise ValueError(f"Invalid boolean {value}")
+
+    @staticmethod
+    def _parse_datetime(value: Any) -> datetime:
+        created_at = datetime.fromisoformat(str(value))
+        if created_at.tzinfo is not None:
+            # Stored timestamps are naive UTC
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return created_at
+
+    def _parse_row(self, row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Validate a row and convert it to UserMongo fields, the missing fields are left out.
+
+        :return: The fields of the user, or None if the row is rejected.
+        """
+        if not isinstance(row, dict):
+            return None
+        values = {key: value for key, value in row.items() if value is not None and value not in NULL_VALUES}
+
+        try:
+            user_id = int(values.get("_id", values.get("id")))
+            if user_id <= 0:
+                return None
+
+            data: Dict[str, Any] = {"_id": user_id}
+            for key in UPDATE_FIELDS:
+                if key in values:
+                    data[key] = str(values[key])
+            if "state" in values:
+                if values["state"] not in USER_STATES:
+                    return None
+                data["state"] = values["state"]
+            if "is_banned" in values:
+                data["is_banned"] = self._parse_bool(values["is_banned"])
+            if "created_at" in values:
+                data["created_at"] = self._parse_datetime(values["created_at"])
+        except (TypeError, ValueError):
+            return None
+        return data
+
+    def _read_batches(self, file: BinaryIO) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Parse the file and yield lists of at most batch_size valid rows.
+        """
+        file.seek(0)
+        if file.read(2) == b"\x1f\x8b":
+            file.seek(0)
+            file = gzip.GzipFile(fileobj=file, mode="rb")
+        else:
+            file.seek(0)
+        # utf-8-sig skips the byte order mark written by spreadsheet applications
+        stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+        batch: List[Dict[str, Any]] = []
+        try:
+            for row in READERS[self.import_format](stream):
+                data = self._parse_row(row)
+                if data is None:
+                    self.rejected += 1
+                    continue
+                batch.append(data)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            # Leave the underlying file open for its owner
+            stream.detach()
+
+    @property
+    def count(self) -> int:
+        """The number of rows read."""
+        return self.inserted + self.updated + self.rejected
+
+    async def read(
+            self,
+            file: BinaryIO,
+            on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Import all rows of a file.
+
+        :param file: The binary file object to read.
+        :param on_progress: Coroutine function called with the number of rows read after every batch.
+        :raises ValueError: If the file is not valid UTF-8.
+        :raises OSError: If the file is not a valid gzip file.
+        :raises csv.Error: If the file is not a valid CSV file.
+        """
+        loop = asyncio.get_running_loop()
+        batches = self._read_batches(file)
+        try:
+            while (batch := await loop.run_in_executor(None, next, batches, None)) is not None:
+                inserted, updated = await UserMongo.bulk_upsert(self.mongodb, batch, UPDATE_FIELDS)
+                self.inserted += inserted
+                self.updated += updated
+                if on_progress is not None:
+                    await on_progress(self.count)
+        finally:
+            batches.close()
@@ -0,0 +1,369 @@
+import asyncio
+import csv
+import json
+import logging
+import uuid
+from contextlib import suppress
+from tempfile import SpooledTemporaryFile
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Document, Message
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from redis.asyncio import Redis
+
+from app.bot_main.utils.export import ExportManager, SpooledInputFile
+from app.bot_main.utils.importer import ImportManager
+from app.bot_main.utils.states import State
+from app.bot_main.utils.texts.messages import MessageCode, TextMessage
+from app.mongodb.models import UserMongo
+from app.monitoring import count_cache_lookup
+
+# Lifetime in seconds of the job locks, refreshed while the job runs,
+# so the lock of a job lost with its process expires on its own
+JOB_LOCK_TTL = 120
+# Interval in seconds between two refreshes of a job lock
+JOB_LOCK_REFRESH = JOB_LOCK_TTL / 4
+# Lifetime in seconds of the file_ids of a finished export
+EXPORT_RESULT_TTL = 600
+# Minimal interval in seconds between two edits of the progress message
+PROGRESS_INTERVAL = 3.0
+
+# Refresh the lock and the progress of an owner, if the lock is still held by the job
+REFRESH_LOCK = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+# Delete the lock and the progress of an owner, if the lock is still held by the job
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('DEL', KEYS[1], KEYS[2])
+"""
+
+
+class Job:
+    """
+    Job of an owner on the users of a bot running in the background.
+
+    The lock and the progress of the job are stored in Redis, with one job of a kind per owner at a time.
+    The lock is refreshed for the whole run. While the owner stays in the window of the job, its message is
+    edited with the progress.
+    """
+    # Name of the job in its Redis keys and logs
+    name: str
+    # State name and text of the window showing the progress
+    window_state: str
+    window_code: str
+    progress_code: str
+    # Running jobs of this process by owner id, also keeping references to their tasks
+    jobs: Dict[int, "Job"]
+    tasks: Set[asyncio.Task]
+
+    def __init__(
+            self,
+            bot: Bot,
+            redis: Redis,
+            state: FSMContext,
+            mongodb: AsyncIOMotorDatabase,
+            bot_id: int,
+            bot_username: str,
+            user_id: int,
+            text_message: TextMessage,
+    ) -> None:
+        self.bot = bot
+        self.redis = redis
+        self.state = state
+        self.mongodb = mongodb
+        self.bot_id = bot_id
+        self.bot_username = bot_username
+        self.user_id = user_id
+        self.text_message = text_message
+
+        self.token = uuid.uuid4().hex
+        self.message: Optional[Message] = None
+        self.total = 0
+        self.last_edit = 0.0
+
+    @classmethod
+    def _lock_key(cls, user_id: int) -> str:
+        return f"{cls.name}:{user_id}:lock"
+
+    @classmethod
+    def _state_key(cls, user_id: int) -> str:
+        return f"{cls.name}:{user_id}:state"
+
+    @classmethod
+    async def get_progress(cls, redis: Redis, user_id: int, bot_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Get the progress of the running job of an owner.
+
+        :return: The number of processed users and the total, or None if no job on the bot is running.
+        """
+        data = await redis.hgetall(cls._state_key(user_id))
+        if not data or int(data[b"bot_id"]) != bot_id:
+            return None
+        return int(data[b"count"]), int(data[b"total"])
+
+    @classmethod
+    def attach(cls, user_id: int, message: Message) -> None:
+        """
+        Set the message of the window where the running job of an owner shows its progress.
+        """
+        job = cls.jobs.get(user_id)
+        if job is not None:
+            job.message = message
+
+    @classmethod
+    async def cancel_all(cls) -> None:
+        """
+        Cancel the running jobs of this process and wait for them to release their locks.
+        """
+        for task in cls.tasks:
+            task.cancel()
+        await asyncio.gather(*cls.tasks, return_exceptions=True)
+
+    async def start(self) -> bool:
+        """
+        Acquire the lock of the owner and run the job in a background task.
+
+        :return: False if a job of the owner is already running.
+        """
+        if not await self.redis.set(self._lock_key(self.user_id), self.token, nx=True, ex=JOB_LOCK_TTL):
+            return False
+
+        await self.prepare()
+        await self._save_progress(0)
+
+        task = asyncio.create_task(self.run())
+        self.jobs[self.user_id] = self
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def prepare(self) -> None:
+        """
+        Prepare the job before it is started, e.g. set its total.
+        """
+
+    async def execute(self) -> None:
+        raise NotImplementedError
+
+    def failed_text(self) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Release the resources of the job after its run.
+        """
+
+    async def run(self) -> None:
+        keeper = asyncio.create_task(self._keep_lock())
+        try:
+            await self.execute()
+        except Exception as ex:  # noqa
+            logging.exception(f"Job {self.name} of @{self.bot_username} failed: {ex}")
+            with suppress(Exception):
+                await self.bot.send_message(self.user_id, self.failed_text())
+        finally:
+            keeper.cancel()
+            self.close()
+            if self.jobs.get(self.user_id) is self:
+                del self.jobs[self.user_id]
+            await self._release()
+            await self._edit_message(None)
+
+    async def _save_progress(self, count: int) -> None:
+        key = self._state_key(self.user_id)
+        await self.redis.hset(key, mapping={"bot_id": self.bot_id, "count": count, "total": self.total})
+        await self.redis.expire(key, JOB_LOCK_TTL)
+
+    async def _keep_lock(self) -> None:
+        """
+        Refresh the lock for the whole run, including the transfers of the files.
+        """
+        keys = [self._lock_key(self.user_id), self._state_key(self.user_id)]
+        while True:
+            await asyncio.sleep(JOB_LOCK_REFRESH)
+            try:
+                if not await self.redis.eval(REFRESH_LOCK, 2, *keys, self.token, JOB_LOCK_TTL):
+                    logging.warning(f"Job {self.name} of @{self.bot_username} lost its lock")
+                    return
+            except Exception as ex:  # noqa
+                logging.warning(f"Lock of job {self.name} of @{self.bot_username} not refreshed: {ex}")
+
+    async def _on_progress(self, count: int) -> None:
+        # Progress is informational, its failures do not abort the job
+        try:
+            await self._save_progress(count)
+
+            loop = asyncio.get_running_loop()
+            if loop.time() - self.last_edit >= PROGRESS_INTERVAL:
+                self.last_edit = loop.time()
+                text = self.text_message.get(self.progress_code)
+                await self._edit_message(text.format(count=count, total=max(count, self.total)))
+        except Exception as ex:  # noqa
+            logging.warning(f"Progress of job {self.name} of @{self.bot_username} not saved: {ex}")
+
+    async def _release(self) -> None:
+        """
+        Delete the progress and the lock of the owner, unless the lock has expired and was taken by another job.
+        """
+        keys = [self._lock_key(self.user_id), self._state_key(self.user_id)]
+        await self.redis.eval(RELEASE_LOCK, 2, *keys, self.token)
+
+    async def _edit_message(self, progress: Optional[str]) -> None:
+        """
+        Show the progress in the window of the job, if the owner is still looking at it for the same bot.
+        """
+        if self.message is None:
+            return
+
+        state_data = await self.state.get_data()
+        if (
+                await self.state.get_state() != self.window_state
+                or state_data.get("message_id") != self.message.message_id
+                or state_data.get("bot_id") != self.bot_id
+        ):
+            return
+
+        text = self.text_message.get(self.window_code)
+        if progress is not None:
+            text = f"{text}\n\n{progress}"
+        with suppress(TelegramBadRequest):
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=self.message.chat.id,
+                message_id=self.message.message_id,
+                reply_markup=self.message.reply_markup,
+            )
+
+
+class ExportJob(Job):
+    """
+    Export of the users of a bot running in the background.
+
+    The progress is shown in the user list window. The file_ids of the sent documents are cached,
+    so a repeated export of the same bot and format sends them again without exporting.
+    """
+    name = "export"
+    window_state = State.user_list.state
+    window_code = MessageCode.user_list
+    progress_code = MessageCode.export_progress
+    jobs: Dict[int, "ExportJob"] = {}
+    tasks: Set[asyncio.Task] = set()
+
+    def __init__(
+            self,
+            bot: Bot,
+            redis: Redis,
+            state: FSMContext,
+            mongodb: AsyncIOMotorDatabase,
+            bot_id: int,
+            bot_username: str,
+            user_id: int,
+            export_format: str,
+            text_message: TextMessage,
+    ) -> None:
+        super().__init__(bot, redis, state, mongodb, bot_id, bot_username, user_id, text_message)
+        self.export_format = export_format
+        self.documents: List[SpooledInputFile] = []
+
+    @staticmethod
+    def _result_key(bot_id: int, export_format: str) -> str:
+        return f"export:{bot_id}:{export_format}:result"
+
+    @classmethod
+    async def send_cached(cls, bot: Bot, redis: Redis, user_id: int, bot_id: int, export_format: str) -> bool:
+        """
+        Send the documents of a recently finished export again.
+
+        :return: True if the documents were sent, False if there is no cached result.
+        """
+        file_ids = await redis.get(cls._result_key(bot_id, export_format))
+        count_cache_lookup("export_results", file_ids is not None)
+        if file_ids is None:
+            return False
+
+        for file_id in json.loads(file_ids):
+            await bot.send_document(user_id, document=file_id)
+        return True
+
+    async def prepare(self) -> None:
+        self.total = await UserMongo.count(self.mongodb)
+
+    async def execute(self) -> None:
+        export_manager = ExportManager(self.mongodb, self.export_format)
+        self.documents = await export_manager.as_input_files(f"{self.bot_username}_users", self._on_progress)
+
+        file_ids: List[str] = []
+        for document in self.documents:
+            message = await self.bot.send_document(self.user_id, document=document)
+            file_ids.append(message.document.file_id)
+
+        key = self._result_key(self.bot_id, self.export_format)
+        await self.redis.set(key, json.dumps(file_ids), ex=EXPORT_RESULT_TTL)
+
+    def failed_text(self) -> str:
+        return self.text_message.get(MessageCode.export_failed)
+
+    def close(self) -> None:
+        for document in self.documents:
+            document.file.close()
+
+
+class ImportJob(Job):
+    """
+    Import of users into a bot from a file sent by the owner, running in the background.
+
+    The progress is shown in the user import window, and the owner gets a message with the result.
+    """
+    name = "import"
+    window_state = State.user_import.state
+    window_code = MessageCode.user_import
+    progress_code = MessageCode.import_progress
+    jobs: Dict[int, "ImportJob"] = {}
+    tasks: Set[asyncio.Task] = set()
+
+    def __init__(
+            self,
+            bot: Bot,
+            redis: Redis,
+            state: FSMContext,
+            mongodb: AsyncIOMotorDatabase,
+            bot_id: int,
+            bot_username: str,
+            user_id: int,
+            document: Document,
+            import_format: str,
+            text_message: TextMessage,
+    ) -> None:
+        super().__init__(bot, redis, state, mongodb, bot_id, bot_username, user_id, text_message)
+        self.document = document
+        self.import_manager = ImportManager(mongodb, import_format)
+
+    async def execute(self) -> None:
+        result_code = MessageCode.user_import_result
+        with SpooledTemporaryFile(max_size=4 * 1024 * 1024) as file:
+            await self.bot.download(self.document, destination=file)
+            try:
+                await self.import_manager.read(file, self._on_progress)
+            except (ValueError, OSError, csv.Error):
+                result_code = MessageCode.user_import_failed
+        await self.bot.send_message(self.user_id, self._result_text(result_code))
+
+    def failed_text(self) -> str:
+        return self._result_text(MessageCode.user_import_failed)
+
+    def _result_text(self, code: str) -> str:
+        return self.text_message.get(code).format(
+            inserted=self.import_manager.inserted,
+            updated=self.import_manager.updated,
+            rejected=self.import_manager.rejected,
+        )
@@ -1,4 +1,4 @@
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -29,8 +29,10 @@ def export_tools(text_button: TextButton) -> InlineKeyboardBuilder:
         *[
             text_button.get_button(ButtonCode.export_csv),
             text_button.get_button(ButtonCode.export_json),
+            text_button.get_button(ButtonCode.export_ndjson),
         ], width=2,
     )
+    builder.row(text_button.get_button(ButtonCode.import_users))
     return builder
 
 
@@ -66,6 +68,12 @@ def bot_information(text_button: TextButton, bot_db: BotDB) -> InlineKeyboardBui
             text_button.get_button(ButtonCode.text_list),
         ]
     )
+    builder.row(
+        *[
+            text_button.get_button(ButtonCode.broadcast),
+            text_button.get_button(ButtonCode.confirmations),
+        ]
+    )
     builder.row(
         *[
             text_button.get_button(on_or_off_bot_callback_data),
@@ -143,6 +151,7 @@ class InlineKeyboardPaginator:
         total_pages (int): The total number of pages.
         current_page (int): The current page number.
         data_pattern (str): The pattern to be used for the callback data.
+        cursors (Dict[int, str]): Cursors of known pages, appended to their callback data.
         before_builder (InlineKeyboardBuilder): A builder to be attached before the items and navigation.
         after_builder (InlineKeyboardBuilder): A builder to be attached after the items and navigation.
     """
@@ -160,6 +169,7 @@ class InlineKeyboardPaginator:
             total_pages: int = 1,
             row_width: int = 1,
             data_pattern: str = "page:{}",
+            cursors: Optional[Dict[int, str]] = None,
             before_builder: Optional[InlineKeyboardBuilder] = None,
             after_builder: Optional[InlineKeyboardBuilder] = None,
     ) -> None:
@@ -168,6 +178,7 @@ class InlineKeyboardPaginator:
         self.total_pages = total_pages
         self.row_width = row_width
         self.data_pattern = data_pattern
+        self.cursors = cursors or {}
 
         self.builder = InlineKeyboardBuilder()
         self.before_builder = before_builder
@@ -185,6 +196,14 @@ class InlineKeyboardPaginator:
 
         return builder
 
+    def _page_data(self, page: int) -> str:
+        """
+        Generate the callback data for the page.
+        """
+        if page in self.cursors:
+            return self.data_pattern.format(f"{page}:{self.cursors[page]}")
+        return self.data_pattern.format(page)
+
     def _navigation_builder(self) -> InlineKeyboardBuilder:
         """
         Generate the buttons for the navigation.
@@ -216,7 +235,7 @@ class InlineKeyboardPaginator:
             keyboard_dict[self.current_page] = self.current_page_label.format(self.current_page)
 
             for key, val in sorted(keyboard_dict.items()):
-                builder.button(text=str(val), callback_data=str(key))
+                builder.button(text=str(val), callback_data=self._page_data(key))
             builder.adjust(5)
 
         return builder
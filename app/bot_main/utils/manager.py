@@ -17,6 +17,7 @@ from aiogram.types.base import (
     UNSET_PARSE_MODE,
 )
 from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from app.bot_main.utils.texts.buttons import TextButton
@@ -45,6 +46,7 @@ class Manager:
         self.async_session: AsyncSession = data.get("async_session", None)
         self.sessionmaker: async_sessionmaker = data.get("sessionmaker", None)
         self.mongo_client: AsyncIOMotorClient = data.get("mongo_client", None)
+        self.redis: Redis = data.get("redis", None)
 
         self.user: User = data.get("event_from_user", None)
         self.user_db: UserDB = data.get("user_db", None)
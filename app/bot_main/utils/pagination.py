@@ -0,0 +1,63 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Cursor prefixes stored in the page callback data
+AFTER = "a"
+BEFORE = "b"
+
+
+def parse_page_data(data: str) -> Tuple[int, Optional[str]]:
+    """
+    Parse page callback data in the format "page:<number>[:<cursor>]".
+
+    :param data: The callback data.
+    :return: A tuple containing the page number and the cursor, if any.
+    """
+    page, _, cursor = data.split(":", 1)[1].partition(":")
+    return int(page), cursor or None
+
+
+def page_cursors(current_page: int, ids: Sequence[int]) -> Dict[int, str]:
+    """
+    Build cursors for the pages adjacent to the current one.
+
+    :param current_page: The current page number.
+    :param ids: The primary keys of the records on the current page, in ascending order.
+    :return: A mapping of page numbers to cursors.
+    """
+    if not ids:
+        return {}
+    return {
+        current_page - 1: f"{BEFORE}{ids[0]}",
+        current_page + 1: f"{AFTER}{ids[-1]}",
+    }
+
+
+def page_query(page: int, page_size: int, total: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build keyword arguments for paginate_keyset.
+
+    Adjacent pages seek from the cursor. Pages without a cursor are only the first, the last or the
+    ones close to them, so they are read with a small offset from the nearest end of the list.
+
+    :param page: The page number.
+    :param page_size: The number of records per page.
+    :param total: The total number of records.
+    :param cursor: The cursor of the page, if known.
+    :return: Keyword arguments for paginate_keyset.
+    """
+    if cursor:
+        kind, value = cursor[0], int(cursor[1:])
+        if kind == AFTER:
+            return {"limit": page_size, "after": value}
+        if kind == BEFORE:
+            return {"limit": page_size, "before": value}
+
+    offset = (page - 1) * page_size
+    offset_from_end = total - page * page_size
+    if offset <= offset_from_end or offset >= total:
+        return {"limit": page_size, "offset": offset}
+    return {
+        "limit": min(page_size, total - offset),
+        "offset": max(offset_from_end, 0),
+        "from_end": True,
+    }
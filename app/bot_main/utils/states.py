@@ -9,9 +9,12 @@ class State(StatesGroup):
 
     bot_list = St()
     bot_info = St()
+    broadcast = St()
+    broadcast_confirm = St()
 
     user_list = St()
     user_info = St()
+    user_import = St()
 
     text_list = St()
     text_info = St()
@@ -38,6 +38,11 @@ class ButtonCode(InitValue):
 
     export_csv: str
     export_json: str
+    export_ndjson: str
+    import_users: str
+
+    broadcast: str
+    confirmations: str
 
 
 class TextButton:
@@ -65,6 +70,11 @@ class TextButton:
             ButtonCode.edit_media_url: "🌐 Edit Banner Link",
             ButtonCode.export_csv: "💾 Export to CSV",
             ButtonCode.export_json: "📋 Export to JSON",
+            ButtonCode.export_ndjson: "📑 Export to NDJSON",
+            ButtonCode.import_users: "📥 Import Users",
+
+            ButtonCode.broadcast: "📢 Broadcast",
+            ButtonCode.confirmations: "🔔 Confirmations",
         },
         LanguageCode.ru: {
             ButtonCode.back: "↩️ Назад",
@@ -86,6 +96,11 @@ class TextButton:
             ButtonCode.edit_media_url: "🌐 Изменить ссылку баннера",
             ButtonCode.export_csv: "💾 Экспорт в CSV",
             ButtonCode.export_json: "📋 Экспорт в JSON",
+            ButtonCode.export_ndjson: "📑 Экспорт в NDJSON",
+            ButtonCode.import_users: "📥 Импорт пользователей",
+
+            ButtonCode.broadcast: "📢 Рассылка",
+            ButtonCode.confirmations: "🔔 Уведомления",
         }
     }
 
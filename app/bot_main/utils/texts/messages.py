@@ -14,9 +14,27 @@ class MessageCode(InitValue):
 
     bot_list: str
     bot_info: str
+    confirmation_mode_coalesce: str
+    confirmation_mode_every: str
+    confirmation_mode_off: str
+    broadcast: str
+    broadcast_confirm: str
+    broadcast_progress: str
+    broadcast_running: str
+    broadcast_finished: str
+    broadcast_failed: str
 
     user_list: str
     user_info: str
+    export_progress: str
+    export_running: str
+    export_failed: str
+    import_progress: str
+    import_running: str
+    user_import: str
+    user_import_result: str
+    user_import_failed: str
+    user_import_rejected: str
 
     text_list: str
     text_info: str
@@ -50,10 +68,49 @@ class TextMessage:
             # Сообщения о боте
             MessageCode.bot_list: "🤖 List of Bots:",
             MessageCode.bot_info: "🤖 Bot Information",
+            MessageCode.confirmation_mode_coalesce: "🔔 Delivery confirmations: one per burst of messages",
+            MessageCode.confirmation_mode_every: "🔔 Delivery confirmations: for every message",
+            MessageCode.confirmation_mode_off: "🔕 Delivery confirmations: off",
+            MessageCode.broadcast: "📢 Broadcast\n\n"
+                                   "Please send the text to send to all users of the bot:",
+            MessageCode.broadcast_confirm: "✅ Confirm Broadcast\n\n"
+                                           "Text:\n"
+                                           "{text}\n\n"
+                                           "Confirm?",
+            MessageCode.broadcast_progress: "📢 Broadcast in progress: {sent} sent, "
+                                            "{blocked} blocked, {failed} failed",
+            MessageCode.broadcast_running: "📢 A broadcast of this bot is already in progress.",
+            MessageCode.broadcast_finished: "✅ The broadcast of @{bot_username} is finished\n\n"
+                                            "Sent: {sent}\n"
+                                            "Blocked: {blocked}\n"
+                                            "Failed: {failed}",
+            MessageCode.broadcast_failed: "❌ The broadcast of @{bot_username} has been stopped by an error\n\n"
+                                          "Sent: {sent}\n"
+                                          "Blocked: {blocked}\n"
+                                          "Failed: {failed}",
 
             # Сообщения о пользователях
             MessageCode.user_list: "👤 List of Users:",
             MessageCode.user_info: "👤 User Information",
+            MessageCode.export_progress: "⏳ Exporting users: {count} of {total}",
+            MessageCode.export_running: "⏳ An export is already running, please wait until it is finished.",
+            MessageCode.export_failed: "❌ The export of users has failed, please try again later.",
+            MessageCode.import_progress: "⏳ Importing users: {count} rows read",
+            MessageCode.import_running: "⏳ An import is already running, please wait until it is finished.",
+            MessageCode.user_import: "📥 Import Users\n\n"
+                                     "Send a CSV or NDJSON file of up to 20 MB, it may be compressed with gzip. "
+                                     "Every row needs the _id of the user, the columns username, full_name, "
+                                     "language_code, state, is_banned and created_at are optional.",
+            MessageCode.user_import_result: "✅ Import finished\n\n"
+                                            "Inserted: {inserted}\n"
+                                            "Updated: {updated}\n"
+                                            "Rejected: {rejected}",
+            MessageCode.user_import_failed: "❌ The file could not be read, "
+                                            "rows before the error have been imported.\n\n"
+                                            "Inserted: {inserted}\n"
+                                            "Updated: {updated}\n"
+                                            "Rejected: {rejected}",
+            MessageCode.user_import_rejected: "❌ Only CSV or NDJSON files of up to 20 MB can be imported.",
 
             # Сообщения о тексте
             MessageCode.text_list: "📜 List of Messages:",
@@ -91,10 +148,49 @@ class TextMessage:
             # Сообщения о боте
             MessageCode.bot_list: "🤖 Список ботов:",
             MessageCode.bot_info: "🤖 Информация о боте",
+            MessageCode.confirmation_mode_coalesce: "🔔 Уведомления о доставке: одно на серию сообщений",
+            MessageCode.confirmation_mode_every: "🔔 Уведомления о доставке: на каждое сообщение",
+            MessageCode.confirmation_mode_off: "🔕 Уведомления о доставке: выключены",
+            MessageCode.broadcast: "📢 Рассылка\n\n"
+                                   "Пожалуйста, отправьте текст для всех пользователей бота:",
+            MessageCode.broadcast_confirm: "✅ Подтвердить рассылку\n\n"
+                                           "Текст:\n"
+                                           "{text}\n\n"
+                                           "Подтвердить?",
+            MessageCode.broadcast_progress: "📢 Идёт рассылка: отправлено {sent}, "
+                                            "заблокировали {blocked}, ошибок {failed}",
+            MessageCode.broadcast_running: "📢 Рассылка этого бота уже выполняется.",
+            MessageCode.broadcast_finished: "✅ Рассылка @{bot_username} завершена\n\n"
+                                            "Отправлено: {sent}\n"
+                                            "Заблокировали: {blocked}\n"
+                                            "Ошибок: {failed}",
+            MessageCode.broadcast_failed: "❌ Рассылка @{bot_username} остановлена из-за ошибки\n\n"
+                                          "Отправлено: {sent}\n"
+                                          "Заблокировали: {blocked}\n"
+                                          "Ошибок: {failed}",
 
             # Сообщения о пользователях
             MessageCode.user_list: "👤 Список пользователей:",
             MessageCode.user_info: "👤 Информация о пользователе",
+            MessageCode.export_progress: "⏳ Экспорт пользователей: {count} из {total}",
+            MessageCode.export_running: "⏳ Экспорт уже выполняется, дождитесь его завершения.",
+            MessageCode.export_failed: "❌ Не удалось экспортировать пользователей, попробуйте позже.",
+            MessageCode.import_progress: "⏳ Импорт пользователей: прочитано строк {count}",
+            MessageCode.import_running: "⏳ Импорт уже выполняется, дождитесь его завершения.",
+            MessageCode.user_import: "📥 Импорт пользователей\n\n"
+                                     "Отправьте файл CSV или NDJSON размером до 20 МБ, можно сжатый gzip. "
+                                     "В каждой строке нужен _id пользователя, столбцы username, full_name, "
+                                     "language_code, state, is_banned и created_at необязательны.",
+            MessageCode.user_import_result: "✅ Импорт завершён\n\n"
+                                            "Добавлено: {inserted}\n"
+                                            "Обновлено: {updated}\n"
+                                            "Отклонено: {rejected}",
+            MessageCode.user_import_failed: "❌ Не удалось прочитать файл, "
+                                            "строки до ошибки были импортированы.\n\n"
+                                            "Добавлено: {inserted}\n"
+                                            "Обновлено: {updated}\n"
+                                            "Отклонено: {rejected}",
+            MessageCode.user_import_rejected: "❌ Импортировать можно только файлы CSV или NDJSON размером до 20 МБ.",
 
             # Сообщения о тексте
             MessageCode.text_list: "📜 Список сообщений:",
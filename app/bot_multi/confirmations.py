@@ -0,0 +1,158 @@
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.mongodb.models import SettingsMongo
+from app.monitoring import count_cache_lookup
+
+# Confirmation modes of the bot settings
+COALESCE = "coalesce"
+EVERY = "every"
+OFF = "off"
+CONFIRMATION_MODES = [COALESCE, EVERY, OFF]
+
+# Seconds the settings of a bot are cached
+SETTINGS_TTL = 60
+
+
+@dataclass
+class Confirmation:
+    text: str
+    message_id: Optional[int] = None
+    # Number of messages confirmed by this confirmation
+    count: int = 1
+
+
+class Confirmations:
+    """
+    Sends the "message sent" confirmations of the bots according to their confirmation mode.
+
+    In the "coalesce" mode a confirmation is sent for the first message and reused for the following messages
+    with the same text in the same chat and topic: while messages keep coming, the confirmation is edited once
+    per window with their number, and it is deleted after a window without messages. In the "every" mode each
+    message gets its own confirmation deleted after the window, and in the "off" mode none is sent.
+    """
+
+    def __init__(self) -> None:
+        # Open confirmations by bot id, chat id, topic id and text
+        self.confirmations: Dict[Tuple[int, int, Optional[int], str], Confirmation] = {}
+        # Settings of the bots by database name, with their expiration time
+        self.settings: Dict[str, Tuple[float, SettingsMongo]] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def get_settings(self, mongodb: AsyncIOMotorDatabase) -> SettingsMongo:
+        """
+        Get the settings of a bot from the cache or from its database.
+        """
+        now = asyncio.get_running_loop().time()
+        cached = self.settings.get(mongodb.name)
+        if cached is not None and cached[0] > now:
+            count_cache_lookup("settings", True)
+            return cached[1]
+        count_cache_lookup("settings", False)
+
+        settings = await SettingsMongo.load(mongodb)
+        self.settings[mongodb.name] = (now + SETTINGS_TTL, settings)
+        return settings
+
+    def invalidate(self, mongodb: AsyncIOMotorDatabase) -> None:
+        """
+        Drop the cached settings of a bot after they have been changed.
+        """
+        self.settings.pop(mongodb.name, None)
+
+    async def confirm(
+            self,
+            bot: Bot,
+            chat_id: int,
+            reply_to_message_id: int,
+            text: str,
+            mode: str,
+            window: int,
+            message_thread_id: Optional[int] = None,
+    ) -> None:
+        """
+        Confirm a message.
+
+        :param bot: The bot sending the confirmation.
+        :param chat_id: The ID of the chat of the message.
+        :param reply_to_message_id: The ID of the message to reply to.
+        :param text: The text of the confirmation.
+        :param mode: The confirmation mode of the bot.
+        :param window: The confirmation window of the bot in seconds.
+        :param message_thread_id: The ID of the topic of the message, confirmations are coalesced per topic.
+        """
+        if mode == OFF:
+            return
+
+        key = (bot.id, chat_id, message_thread_id, text)
+        if mode == COALESCE and key in self.confirmations:
+            self.confirmations[key].count += 1
+            return
+
+        # Registered before sending, so messages arriving meanwhile are counted instead of confirmed again
+        confirmation = Confirmation(text)
+        if mode == COALESCE:
+            self.confirmations[key] = confirmation
+
+        try:
+            message = await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                reply_to_message_id=reply_to_message_id,
+                allow_sending_without_reply=True,
+            )
+        except TelegramAPIError:
+            if self.confirmations.get(key) is confirmation:
+                del self.confirmations[key]
+            return
+        confirmation.message_id = message.message_id
+
+        task = asyncio.create_task(self._expire(bot, chat_id, key, confirmation, window))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _expire(
+            self,
+            bot: Bot,
+            chat_id: int,
+            key: Tuple[int, int, Optional[int], str],
+            confirmation: Confirmation,
+            window: int,
+    ) -> None:
+        """
+        Keep the confirmation while messages keep coming, then delete it.
+        """
+        try:
+            # The confirmation was sent for a single message
+            shown = 1
+            while True:
+                await asyncio.sleep(window)
+                if confirmation.count == shown:
+                    break
+                shown = confirmation.count
+                with suppress(TelegramAPIError):
+                    await bot.edit_message_text(
+                        text=f"{confirmation.text} ({shown})",
+                        chat_id=chat_id,
+                        message_id=confirmation.message_id,
+                    )
+        finally:
+            if self.confirmations.get(key) is confirmation:
+                del self.confirmations[key]
+
+        with suppress(TelegramAPIError):
+            await bot.delete_message(chat_id=chat_id, message_id=confirmation.message_id)
+
+    async def close(self) -> None:
+        """
+        Cancel the pending deletions, the confirmations are left in the chats.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -1,16 +1,17 @@
-import asyncio
 from contextlib import suppress
 from typing import Optional
 
 from aiogram import Router, F
-from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import Message
 from aiogram.utils.markdown import hcode
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from app.bot_multi.confirmations import Confirmations
 from app.bot_multi.filters import IsGroupFilter
 from app.bot_multi.filters.is_group import IsGroupLinkedFilter
+from app.bot_multi.outbox import Outbox
 from app.bot_multi.texts import TextMessage, MessageCode
 from app.bot_multi.types.album import Album
 from app.mongodb.models import UserMongo
@@ -50,7 +51,7 @@ async def handler(message: Message,
         user_mongo.message_silent_mode = True
         user_mongo.message_silent_id = msg.message_id
 
-    await UserMongo.update(mongodb, **user_mongo.to_dict())
+    await user_mongo.save(mongodb)
 
 
 @router.message(Command("information"))
@@ -94,7 +95,7 @@ async def handler(message: Message,
     else:
         user_mongo.is_banned = True
         text = text_message.get(MessageCode.user_blocked)
-    await UserMongo.update(mongodb, **user_mongo.to_dict())
+    await user_mongo.save(mongodb)
     await message.reply(text)
 
 
@@ -116,6 +117,9 @@ async def handler(message: Message) -> None:
 async def handler(message: Message,
                   user_mongo: UserMongo,
                   text_message: TextMessage,
+                  mongodb: AsyncIOMotorDatabase,
+                  outbox: Outbox,
+                  confirmations: Confirmations,
                   album: Optional[Album] = None,
                   ) -> None:
     """
@@ -125,19 +129,16 @@ async def handler(message: Message,
         """If silent mode is enabled ignore all messages"""
         return
 
-    text = text_message.get(MessageCode.message_sent_to_user)
-
-    try:
-        if not album:
-            await message.copy_to(chat_id=user_mongo.id)
-        else:
-            await album.copy_to(chat_id=user_mongo.id)
-    except TelegramAPIError as ex:
-        if "blocked" in ex.message:
-            text = text_message.get(MessageCode.blocked_by_user)
-    except (Exception,):
-        text = text_message.get(MessageCode.message_not_sent)
-
-    msg = await message.reply(text)
-    await asyncio.sleep(5)
-    await msg.delete()
+    # The reply is delivered by the outbox, which confirms it with the delivery state
+    settings = await confirmations.get_settings(mongodb)
+    await outbox.enqueue(
+        bot_id=message.bot.id,
+        chat_id=user_mongo.id,
+        from_chat_id=message.chat.id,
+        from_message_id=message.message_id,
+        message_thread_id=message.message_thread_id,
+        language_code=text_message.language_code,
+        confirmation_mode=settings.confirmation_mode,
+        confirmation_window=settings.confirmation_window,
+        media=[media.model_dump(exclude_none=True) for media in album.as_media_group] if album else None,
+    )
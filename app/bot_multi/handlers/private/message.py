@@ -7,6 +7,7 @@ from aiogram.types import Message, ErrorEvent
 from aiogram.exceptions import TelegramBadRequest
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from app.bot_multi.confirmations import Confirmations
 from app.bot_multi.filters import IsPrivateFilter
 from app.bot_multi.texts import TextMessage, MessageCode
 from app.bot_multi.types.album import Album
@@ -38,6 +39,7 @@ async def handler(message: Message,
                   user_mongo: UserMongo,
                   text_message: TextMessage,
                   mongodb: AsyncIOMotorDatabase,
+                  confirmations: Confirmations,
                   album: Optional[Album] = None,
                   ) -> None:
     """
@@ -75,21 +77,35 @@ async def handler(message: Message,
         else:
             raise
 
-    text = text_message.get(MessageCode.message_sent)
-    msg = await message.reply(text)
-    await asyncio.sleep(5)
-    await msg.delete()
+    settings = await confirmations.get_settings(mongodb)
+    await confirmations.confirm(
+        bot=message.bot,
+        chat_id=message.chat.id,
+        reply_to_message_id=message.message_id,
+        text=text_message.get(MessageCode.message_sent),
+        mode=settings.confirmation_mode,
+        window=settings.confirmation_window,
+    )
 
 
 @router.edited_message()
-async def handler(message: Message, text_message: TextMessage) -> None:
+async def handler(message: Message,
+                  text_message: TextMessage,
+                  mongodb: AsyncIOMotorDatabase,
+                  confirmations: Confirmations,
+                  ) -> None:
     """
     Handle edited messages in private chats.
     """
-    text = text_message.get(MessageCode.message_edited)
-    msg = await message.reply(text)
-    await asyncio.sleep(5)
-    await msg.delete()
+    settings = await confirmations.get_settings(mongodb)
+    await confirmations.confirm(
+        bot=message.bot,
+        chat_id=message.chat.id,
+        reply_to_message_id=message.message_id,
+        text=text_message.get(MessageCode.message_edited),
+        mode=settings.confirmation_mode,
+        window=settings.confirmation_window,
+    )
 
 
 @router.error(F.exception.message.contains("chat not found"))
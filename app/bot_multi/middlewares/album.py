@@ -7,6 +7,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, TelegramObject
 from cachetools import TTLCache
 
+from app.monitoring import count_cache_lookup, track_cache
 from ..types.album import Album, Media
 
 
@@ -31,6 +32,7 @@ class AlbumMiddleware(BaseMiddleware):
         self.album_key = album_key
         self.latency = latency
         self.cache: MutableMapping[str, Dict[str, Any]] = TTLCache(maxsize=10_000, ttl=ttl)
+        track_cache("album", self.cache)
 
     @staticmethod
     def get_content(message: Message) -> Optional[Tuple[Media, str]]:
@@ -68,6 +70,7 @@ class AlbumMiddleware(BaseMiddleware):
             key = event.media_group_id
             media, content_type = cast(Tuple[Media, str], self.get_content(event))
 
+            count_cache_lookup("album", key in self.cache)
             if key in self.cache:
                 if content_type not in self.cache[key]:
                     self.cache[key][content_type] = [media]
@@ -76,7 +79,8 @@ class AlbumMiddleware(BaseMiddleware):
                 self.cache[key][content_type].append(media)
                 return None
 
-            self.cache[key] = {
+            # Kept by reference, the entry may be evicted from the cache while waiting
+            album = self.cache[key] = {
                 content_type: [media],
                 "messages": [event],
                 "caption": event.html_text,
@@ -86,7 +90,7 @@ class AlbumMiddleware(BaseMiddleware):
 
             # Validate the album data using the Album model
             data[self.album_key] = Album.model_validate(
-                self.cache[key], context={"bot": data["bot"]}
+                album, context={"bot": data["bot"]}
             )
 
         # Call the handler function with the event and data
@@ -7,6 +7,9 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.bot_multi.texts import TextMessage, default_mongodb_texts
 from app.mongodb.models import TextMongo
 
+# Fields used to build the messages, descriptions are only needed by the constructor bot
+TEXT_FIELDS = ["code", "en", "ru", "media_url"]
+
 
 class TextMessageMiddleware(BaseMiddleware):
     """
@@ -31,12 +34,12 @@ class TextMessageMiddleware(BaseMiddleware):
 
         if mongodb is not None and user is not None:
             # Retrieve text messages from MongoDB
-            texts = await TextMongo.all(mongodb)
+            texts = await TextMongo.all(mongodb, projection=TEXT_FIELDS)
 
             if not texts:
                 # Insert default text messages if none exist
                 await TextMongo.insert_default(mongodb, default_mongodb_texts)
-                texts = await TextMongo.all(mongodb)
+                texts = await TextMongo.all(mongodb, projection=TEXT_FIELDS)
 
             # Create TextMessage object with user's language code
             text_message = TextMessage(user.language_code)
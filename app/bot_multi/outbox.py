@@ -0,0 +1,367 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError,
+)
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot_multi.confirmations import Confirmations
+from app.bot_multi.texts import MessageCode, TextMessage
+from app.bot_multi.types.album import INPUT_TYPES
+from app.config import Config
+from app.database.models import BotDB
+from app.monitoring import count_cache_lookup
+
+# Number of queues, replies to the same chat are in the same queue
+SHARDS = 16
+# Replies of a queue delivered at the same time by an instance, replies to the same chat are delivered in order
+CONCURRENCY = 8
+# Attempts to deliver a message on network and server errors, flood limits or a changed token
+MAX_ATTEMPTS = 6
+# Delay in seconds before the second attempt, doubled for every further attempt
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# Seconds a worker waits for a reply in a single BLMOVE
+BLOCK_TIMEOUT = 5
+# Seconds between two moves of the due retries to their queues
+SCHEDULE_INTERVAL = 1.0
+# Seconds the processing lists of an instance are kept for it without renewing its lease
+LEASE_TTL = 30
+
+DEAD_LETTER_KEY = "outbox:dead"
+DEAD_LETTER_LIMIT = 10000
+
+# Move the due retries of a delayed set to the front of their queue
+MOVE_DUE = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+    redis.call('RPUSH', KEYS[2], item)
+end
+return #items
+"""
+# Park a reply behind the pending retry of its chat, if there is one
+PARK = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('LREM', KEYS[3], 1, ARGV[1])
+return 1
+"""
+# Release the hold of a chat whose retried reply is done, its parked replies go to the front of the queue in order
+RELEASE = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('RPUSH', KEYS[3], items[i])
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('LREM', KEYS[4], 1, ARGV[1])
+return #items
+"""
+
+
+class Outbox:
+    """
+    Redis-backed queue delivering replies of operators to users.
+
+    Handlers enqueue a reply and return at once. Replies are sharded by bot and chat over lists with one
+    worker each, which moves replies to the processing list of its instance with BLMOVE and delivers up to
+    CONCURRENCY of them at a time, replies to the same chat one after the other. A reply failing with
+    a transient error is put into a delayed set with the time of its next attempt instead of blocking the
+    worker, and moved back to its queue when due. Meanwhile its chat is held: the later replies to the chat
+    are parked, and go back to the front of the queue in order once the retried reply is delivered or
+    dead-lettered. Replies that still fail are pushed to a dead-letter list. The operator gets a confirmation
+    of the final delivery state.
+
+    Every instance renews a lease while it runs. The processing lists of instances whose lease expired,
+    e.g. after a crash, are moved back to their queues and delivered first.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            session: AiohttpSession,
+            sessionmaker: async_sessionmaker,
+            config: Config,
+            confirmations: Confirmations,
+    ) -> None:
+        self.redis = redis
+        self.session = session
+        self.sessionmaker = sessionmaker
+        self.config = config
+        self.confirmations = confirmations
+        self.instance = uuid.uuid4().hex
+        self.move_due = redis.register_script(MOVE_DUE)
+        self.park = redis.register_script(PARK)
+        self.release = redis.register_script(RELEASE)
+
+        # Bots of the tenants by id, their tokens are decrypted once
+        self.bots: Dict[int, Bot] = {}
+        # Last delivery by bot and chat, awaited by the next one to keep the order
+        self.chats: Dict[Tuple[int, int], asyncio.Task] = {}
+        self.workers: List[asyncio.Task] = []
+        self.tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _queue_key(shard: int) -> str:
+        return f"outbox:{shard}"
+
+    @staticmethod
+    def _delayed_key(shard: int) -> str:
+        return f"outbox:{shard}:delayed"
+
+    def _processing_key(self, shard: int) -> str:
+        return f"outbox:{shard}:processing:{self.instance}"
+
+    @staticmethod
+    def _hold_key(shard: int, bot_id: int, chat_id: int) -> str:
+        return f"outbox:{shard}:hold:{bot_id}:{chat_id}"
+
+    @staticmethod
+    def _held_key(shard: int, bot_id: int, chat_id: int) -> str:
+        return f"outbox:{shard}:held:{bot_id}:{chat_id}"
+
+    @staticmethod
+    def _lease_key(instance: str) -> str:
+        return f"outbox:lease:{instance}"
+
+    @staticmethod
+    def _shard(bot_id: int, chat_id: int) -> int:
+        return zlib.crc32(f"{bot_id}:{chat_id}".encode()) % SHARDS
+
+    async def enqueue(
+            self,
+            bot_id: int,
+            chat_id: int,
+            from_chat_id: int,
+            from_message_id: int,
+            message_thread_id: Optional[int],
+            language_code: str,
+            confirmation_mode: str,
+            confirmation_window: int,
+            media: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Queue a reply for delivery.
+
+        :param bot_id: The ID of the bot sending the reply.
+        :param chat_id: The ID of the user chat.
+        :param from_chat_id: The ID of the group chat of the operator.
+        :param from_message_id: The ID of the message of the operator, copied unless media is given.
+        :param message_thread_id: The ID of the topic of the message.
+        :param language_code: The language code of the confirmation.
+        :param confirmation_mode: The confirmation mode of the bot.
+        :param confirmation_window: The confirmation window of the bot in seconds.
+        :param media: The media group to send, as dumped InputMedia objects.
+        """
+        item = {
+            "bot_id": bot_id,
+            "chat_id": chat_id,
+            "from_chat_id": from_chat_id,
+            "from_message_id": from_message_id,
+            "message_thread_id": message_thread_id,
+            "language_code": language_code,
+            "confirmation_mode": confirmation_mode,
+            "confirmation_window": confirmation_window,
+            "media": media,
+        }
+        await self.redis.lpush(self._queue_key(self._shard(bot_id, chat_id)), json.dumps(item))
+
+    async def start(self) -> None:
+        """
+        Requeue the replies of the stopped instances and start the workers.
+        """
+        await self.redis.set(self._lease_key(self.instance), 1, ex=LEASE_TTL)
+        await self._reclaim()
+        for shard in range(SHARDS):
+            self.workers.append(asyncio.create_task(self._work(shard)))
+        self.workers.append(asyncio.create_task(self._schedule()))
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers and release the lease, the replies being delivered are delivered after the next startup
+        or by another instance.
+        """
+        for task in [*self.workers, *self.tasks]:
+            task.cancel()
+        await asyncio.gather(*self.workers, *self.tasks, return_exceptions=True)
+        self.workers.clear()
+        await self.redis.delete(self._lease_key(self.instance))
+
+    def forget_bot(self, bot_id: int) -> None:
+        """
+        Drop the cached bot of a tenant whose token has changed, it is loaded again from the database.
+        """
+        self.bots.pop(bot_id, None)
+
+    async def _reclaim(self) -> None:
+        """
+        Move the replies of the processing lists of the instances without a lease back to their queues.
+        """
+        async for key in self.redis.scan_iter(match="outbox:*:processing:*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            _, shard, _, instance = key.split(":")
+            if instance == self.instance or await self.redis.exists(self._lease_key(instance)):
+                continue
+            # The interrupted replies are older than the queued ones and are delivered first
+            while await self.redis.lmove(key, self._queue_key(int(shard)), "LEFT", "RIGHT"):
+                pass
+
+    async def _schedule(self) -> None:
+        """
+        Renew the lease, move the due retries to their queues and reclaim the replies of the stopped instances.
+        """
+        last_reclaim = time.monotonic()
+        while True:
+            await asyncio.sleep(SCHEDULE_INTERVAL)
+            try:
+                await self.redis.set(self._lease_key(self.instance), 1, ex=LEASE_TTL)
+                for shard in range(SHARDS):
+                    await self.move_due(keys=[self._delayed_key(shard), self._queue_key(shard)],
+                                        args=[time.time(), 100])
+                if time.monotonic() - last_reclaim >= LEASE_TTL:
+                    last_reclaim = time.monotonic()
+                    await self._reclaim()
+            except RedisError as ex:
+                logging.error(f"Outbox scheduling failed: {ex}")
+
+    async def _work(self, shard: int) -> None:
+        queue, processing = self._queue_key(shard), self._processing_key(shard)
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        while True:
+            await semaphore.acquire()
+            raw = await self.redis.blmove(queue, processing, BLOCK_TIMEOUT, "RIGHT", "LEFT")
+            if raw is None:
+                semaphore.release()
+                continue
+            task = asyncio.create_task(self._handle(shard, raw))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _handle(self, shard: int, raw: bytes) -> None:
+        """
+        Deliver a reply after the previous one to the same chat, and remove it from the processing list
+        unless it is retried later. A reply to a held chat is parked behind the retried one.
+        """
+        item = json.loads(raw)
+        key, current = (item["bot_id"], item["chat_id"]), asyncio.current_task()
+        previous, self.chats[key] = self.chats.get(key), current
+        hold_keys = [self._hold_key(shard, *key), self._held_key(shard, *key)]
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            # Retried replies hold their chat, the others wait for them
+            if "attempt" not in item and await self.park(keys=[*hold_keys, self._processing_key(shard)], args=[raw]):
+                return
+            try:
+                retried = await self._process(shard, raw, item)
+            except Exception as ex:  # noqa
+                logging.exception(f"Outbox delivery failed: {ex}")
+                retried = False
+            if retried:
+                return
+            if "attempt" in item:
+                await self.release(keys=[*hold_keys, self._queue_key(shard), self._processing_key(shard)],
+                                   args=[raw])
+            else:
+                await self.redis.lrem(self._processing_key(shard), 1, raw)
+        finally:
+            if self.chats.get(key) is current:
+                del self.chats[key]
+
+    async def _get_bot(self, bot_id: int) -> Optional[Bot]:
+        count_cache_lookup("outbox_bots", bot_id in self.bots)
+        if bot_id not in self.bots:
+            async with self.sessionmaker() as async_session:
+                bot_db = await BotDB.get(async_session, bot_id)
+            if bot_db is None:
+                return None
+            token = BotDB.decrypt_token(self.config.SECRET_KEY, bot_db.token)
+            self.bots[bot_id] = Bot(token, self.session, ParseMode.HTML)
+        return self.bots[bot_id]
+
+    async def _deliver(self, bot: Bot, item: Dict[str, Any]) -> None:
+        if item["media"] is not None:
+            media = [INPUT_TYPES[data["type"]](**data) for data in item["media"]]
+            await bot.send_media_group(chat_id=item["chat_id"], media=media)
+        else:
+            await bot.copy_message(
+                chat_id=item["chat_id"],
+                from_chat_id=item["from_chat_id"],
+                message_id=item["from_message_id"],
+            )
+
+    async def _retry(self, shard: int, raw: bytes, item: Dict[str, Any], delay: float) -> None:
+        """
+        Move a reply from the processing list to the delayed set of its queue until its next attempt,
+        holding its chat meanwhile.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._delayed_key(shard), {json.dumps(item): time.time() + delay})
+            pipe.set(self._hold_key(shard, item["bot_id"], item["chat_id"]), 1)
+            pipe.lrem(self._processing_key(shard), 1, raw)
+            await pipe.execute()
+
+    async def _process(self, shard: int, raw: bytes, item: Dict[str, Any]) -> bool:
+        """
+        Attempt to deliver a reply.
+
+        :return: True if the reply is retried later, False if it is done.
+        """
+        bot = await self._get_bot(item["bot_id"])
+        if bot is None:
+            return False
+
+        text_code, error = MessageCode.message_not_sent, None
+        try:
+            await self._deliver(bot, item)
+            text_code = MessageCode.message_sent_to_user
+        except TelegramUnauthorizedError as ex:
+            # The token was revoked or changed, the bot is loaded again with the token of the database
+            self.forget_bot(item["bot_id"])
+            error = ex
+        except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError) as ex:
+            error = ex
+        except TelegramAPIError as ex:
+            # Other errors, like a blocked bot, do not go away by retrying
+            if "blocked" in ex.message:
+                text_code = MessageCode.blocked_by_user
+
+        if error is not None:
+            attempt = item.get("attempt", 0) + 1
+            if attempt < MAX_ATTEMPTS:
+                delay = error.retry_after if isinstance(error, TelegramRetryAfter) else BASE_DELAY * 2 ** (attempt - 1)
+                await self._retry(shard, raw, {**item, "attempt": attempt}, min(delay, MAX_DELAY))
+                return True
+            await self.redis.lpush(DEAD_LETTER_KEY, json.dumps({**item, "error": str(error)}))
+            await self.redis.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_LIMIT - 1)
+
+        text = TextMessage(item["language_code"]).get(text_code)
+        await self.confirmations.confirm(
+            bot=bot,
+            chat_id=item["from_chat_id"],
+            reply_to_message_id=item["from_message_id"],
+            text=text,
+            mode=item["confirmation_mode"],
+            window=item["confirmation_window"],
+            message_thread_id=item["message_thread_id"],
+        )
+        return False
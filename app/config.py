@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict
 
 from aiogram.enums import UpdateType
 from environs import Env
@@ -18,6 +19,8 @@ ALLOWED_UPDATES = [
 class BotConfig:
     TOKEN: str
     DEV_ID: int
+    ERROR_REPORT_WINDOW: int
+    API_BASE_URL: str
 
 
 @dataclass
@@ -31,6 +34,7 @@ class WebhookConfig:
     DOMAIN: str
     PATH_BOT_MAIN: str
     PATH_BOT_MULTI: str
+    HANDLE_IN_BACKGROUND: bool
 
 
 @dataclass
@@ -46,6 +50,8 @@ class MongoDBConfig:
 
         :return: The generated MongoDB connection DSN.
         """
+        if not self.USER:
+            return f"mongodb://{self.HOST}:{self.PORT}"
         return f"mongodb://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}"
 
 
@@ -71,17 +77,79 @@ class DatabaseConfig:
     DATABASE: str
     HOST: str
     PORT: int
+    # Full connection URL replacing the generated one, e.g. for SQLite
+    URL: str
 
     def url(self, driver: str = "mysql+aiomysql") -> str:
         """
         Generates a database connection URL using the provided driver, username, password, host, port, and database.
 
         :param driver: The driver to use for the connection. Defaults to "mysql+aiomysql".
-        :return: The generated connection URL.
+        :return: The generated connection URL, or the configured URL if set.
         """
+        if self.URL:
+            return self.URL
         return f"{driver}://{self.USERNAME}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.DATABASE}"
 
 
+@dataclass
+class BroadcastConfig:
+    RATE: float
+    WORKERS: int
+
+
+@dataclass
+class MetricsConfig:
+    PATH: str
+    MAX_TENANTS: int
+
+
+@dataclass
+class TracingConfig:
+    SLOW_UPDATE_THRESHOLD: float
+    EXPORT_PATH: str
+    EXPORT_ALL: bool
+
+
+@dataclass
+class MemoryConfig:
+    # Budgets in bytes of the in-process caches by name, 0 for no budget
+    CACHE_BUDGETS: Dict[str, int]
+    DEFAULT_CACHE_BUDGET: int
+    CHECK_INTERVAL: float
+    # Number of frames of the allocations traced from the start, 0 to trace on demand only
+    TRACEMALLOC_FRAMES: int
+
+
+@dataclass
+class LoopConfig:
+    LAG_INTERVAL: float
+    BLOCK_THRESHOLD: float
+
+
+@dataclass
+class ProfilerConfig:
+    PATH: str
+    TOKEN: str
+    MAX_SECONDS: float
+    INTERVAL: float
+
+
+@dataclass
+class RecordingConfig:
+    PATH: str
+    SAMPLE_RATE: float
+    ANONYMIZE_KEY: str
+
+
+@dataclass
+class LoggingConfig:
+    RETENTION_DAYS: int
+    RATE_LIMIT: int
+    RATE_INTERVAL: float
+    QUEUE_SIZE: int
+
+
 @dataclass
 class Config:
     bot: BotConfig
@@ -90,6 +158,14 @@ class Config:
     mongodb: MongoDBConfig
     redis: RedisConfig
     database: DatabaseConfig
+    broadcast: BroadcastConfig
+    metrics: MetricsConfig
+    tracing: TracingConfig
+    recording: RecordingConfig
+    profiler: ProfilerConfig
+    loop: LoopConfig
+    memory: MemoryConfig
+    logging: LoggingConfig
 
     SECRET_KEY: str
 
@@ -104,6 +180,8 @@ def load_config() -> Config:
         bot=BotConfig(
             TOKEN=env.str("BOT_TOKEN"),
             DEV_ID=env.int("BOT_DEV_ID"),
+            ERROR_REPORT_WINDOW=env.int("BOT_ERROR_REPORT_WINDOW", 300),
+            API_BASE_URL=env.str("BOT_API_BASE_URL", ""),
         ),
         app=AppConfig(
             HOST=env.str("APP_HOST"),
@@ -113,6 +191,7 @@ def load_config() -> Config:
             DOMAIN=env.str("WEBHOOK_DOMAIN"),
             PATH_BOT_MAIN=env.str("WEBHOOK_PATH_BOT_MAIN"),
             PATH_BOT_MULTI=env.str("WEBHOOK_PATH_BOT_MULTI"),
+            HANDLE_IN_BACKGROUND=env.bool("WEBHOOK_HANDLE_IN_BACKGROUND", True),
         ),
         mongodb=MongoDBConfig(
             HOST=env.str("MONGO_HOST"),
@@ -131,5 +210,46 @@ def load_config() -> Config:
             USERNAME=env.str("DB_USERNAME"),
             PASSWORD=env.str("DB_PASSWORD"),
             DATABASE=env.str("DB_DATABASE"),
+            URL=env.str("DB_URL", ""),
+        ),
+        broadcast=BroadcastConfig(
+            RATE=env.float("BROADCAST_RATE", 25),
+            WORKERS=env.int("BROADCAST_WORKERS", 8),
+        ),
+        metrics=MetricsConfig(
+            PATH=env.str("METRICS_PATH", "/metrics"),
+            MAX_TENANTS=env.int("METRICS_MAX_TENANTS", 100),
+        ),
+        tracing=TracingConfig(
+            SLOW_UPDATE_THRESHOLD=env.float("TRACING_SLOW_UPDATE_THRESHOLD", 1.0),
+            EXPORT_PATH=env.str("TRACING_EXPORT_PATH", ""),
+            EXPORT_ALL=env.bool("TRACING_EXPORT_ALL", False),
+        ),
+        recording=RecordingConfig(
+            PATH=env.str("RECORDING_PATH", ""),
+            SAMPLE_RATE=env.float("RECORDING_SAMPLE_RATE", 1.0),
+            ANONYMIZE_KEY=env.str("RECORDING_ANONYMIZE_KEY", ""),
+        ),
+        profiler=ProfilerConfig(
+            PATH=env.str("PROFILER_PATH", "/debug"),
+            TOKEN=env.str("PROFILER_TOKEN", ""),
+            MAX_SECONDS=env.float("PROFILER_MAX_SECONDS", 60),
+            INTERVAL=env.float("PROFILER_INTERVAL", 0.005),
+        ),
+        loop=LoopConfig(
+            LAG_INTERVAL=env.float("LOOP_LAG_INTERVAL", 0.1),
+            BLOCK_THRESHOLD=env.float("LOOP_BLOCK_THRESHOLD", 0.25),
+        ),
+        memory=MemoryConfig(
+            CACHE_BUDGETS=env.dict("MEMORY_CACHE_BUDGETS", {}, subcast_values=int),
+            DEFAULT_CACHE_BUDGET=env.int("MEMORY_DEFAULT_CACHE_BUDGET", 0),
+            CHECK_INTERVAL=env.float("MEMORY_CHECK_INTERVAL", 60),
+            TRACEMALLOC_FRAMES=env.int("MEMORY_TRACEMALLOC_FRAMES", 0),
+        ),
+        logging=LoggingConfig(
+            RETENTION_DAYS=env.int("LOGGING_RETENTION_DAYS", 7),
+            RATE_LIMIT=env.int("LOGGING_RATE_LIMIT", 20),
+            RATE_INTERVAL=env.float("LOGGING_RATE_INTERVAL", 60),
+            QUEUE_SIZE=env.int("LOGGING_QUEUE_SIZE", 10000),
         ),
     )
@@ -1,10 +1,11 @@
-from ._base import Base
+from ._base import Base, create_missing_indexes
 
 from .bot import BotDB
 from .user import UserDB
 
 __all__ = [
     "Base",
+    "create_missing_indexes",
 
     "BotDB",
     "UserDB",
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import typing as t
 
+from cachetools import TTLCache
 from sqlalchemy import *
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import InstrumentedAttribute
@@ -10,6 +11,10 @@ from ._base import Base
 
 T = t.TypeVar("T", bound="AbstractModel")
 
+# Seconds the counts of records by table and filter are cached, they are dropped on writes to the table
+COUNT_TTL = 60
+_counts: TTLCache = TTLCache(maxsize=10_000, ttl=COUNT_TTL)
+
 
 class AbstractModel(Base):
     """Base class for all models."""
@@ -33,6 +38,12 @@ class AbstractModel(Base):
         """Return the primary key of the model."""
         return cls.__table__.primary_key.columns.values()[0].name
 
+    @classmethod
+    def _drop_counts(cls) -> None:
+        """Drop the cached counts of the table after a write."""
+        for key in [key for key in _counts if key[0] == cls.__tablename__]:
+            _counts.pop(key, None)
+
     @classmethod
     async def create(
             cls: t.Type[T],
@@ -43,6 +54,7 @@ class AbstractModel(Base):
         instance = cls(**kwargs)
         async_session.add(instance)
         await async_session.commit()
+        cls._drop_counts()
         await async_session.refresh(instance)
         return instance
 
@@ -75,11 +87,7 @@ class AbstractModel(Base):
             **kwargs,
     ) -> None:
         """Update a record in the database by its primary key."""
-        instance = await cls.get(async_session, primary_key)
-        if instance:
-            for attr, value in kwargs.items():
-                setattr(instance, attr, value)
-            await async_session.commit()
+        await cls.update_where(async_session, {cls._get_primary_key(): primary_key}, **kwargs)
 
     @classmethod
     async def update_by_key(
@@ -90,11 +98,24 @@ class AbstractModel(Base):
             **kwargs,
     ) -> None:
         """Update a record in the database by a key."""
-        instance = await cls.get_by_key(async_session, key, value)
-        if instance:
-            for attr, value in kwargs.items():
-                setattr(instance, attr, value)
-            await async_session.commit()
+        await cls.update_where(async_session, {cls._get_column(cls, key): value}, **kwargs)
+
+    @classmethod
+    async def update_where(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            where: t.Dict[str, t.Any],
+            **kwargs,
+    ) -> int:
+        """Update all records matching a filter with a single statement and return the number of rows."""
+        if not kwargs:
+            return 0
+        statement = update(cls).filter_by(**where).values(**kwargs)
+        result = await async_session.execute(statement)
+        await async_session.commit()
+        # Updated columns may be filtered on
+        cls._drop_counts()
+        return result.rowcount
 
     @classmethod
     async def delete(
@@ -103,10 +124,7 @@ class AbstractModel(Base):
             primary_key: int,
     ) -> None:
         """Delete a record from the database by its primary key."""
-        instance = await cls.get(async_session, primary_key)
-        if instance:
-            await async_session.delete(instance)
-            await async_session.commit()
+        await cls.delete_where(async_session, **{cls._get_primary_key(): primary_key})
 
     @classmethod
     async def delete_by_key(
@@ -116,10 +134,92 @@ class AbstractModel(Base):
             value: t.Any,
     ) -> None:
         """Delete a record from the database by a key."""
-        instance = await cls.get_by_key(async_session, key, value)
-        if instance:
-            await async_session.delete(instance)
-            await async_session.commit()
+        await cls.delete_where(async_session, **{cls._get_column(cls, key): value})
+
+    @classmethod
+    async def delete_where(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            **kwargs,
+    ) -> int:
+        """Delete all records matching a filter with a single statement and return the number of rows."""
+        statement = delete(cls).filter_by(**kwargs)
+        result = await async_session.execute(statement)
+        await async_session.commit()
+        cls._drop_counts()
+        return result.rowcount
+
+    @classmethod
+    def _upsert_statement(
+            cls: t.Type[T],
+            dialect: str,
+            rows: t.Sequence[t.Dict[str, t.Any]],
+            update_columns: t.Sequence[str],
+    ) -> Executable:
+        """Build a dialect specific INSERT ... ON DUPLICATE KEY / ON CONFLICT statement."""
+        primary_key = cls._get_primary_key()
+
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+            statement = dialect_insert(cls).values(rows)
+            # MySQL requires at least one assignment, a no-op on the primary key keeps the row untouched
+            columns = update_columns or [primary_key]
+            return statement.on_duplicate_key_update({c: statement.inserted[c] for c in columns})
+
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+            statement = dialect_insert(cls).values(rows)
+            if not update_columns:
+                return statement.on_conflict_do_nothing(index_elements=[primary_key])
+            return statement.on_conflict_do_update(
+                index_elements=[primary_key],
+                set_={c: statement.excluded[c] for c in update_columns},
+            )
+
+        raise ValueError(f"Upsert is not supported for dialect {dialect}")
+
+    @classmethod
+    async def upsert(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            **kwargs,
+    ) -> None:
+        """Insert a record or update the given columns if the primary key already exists."""
+        await cls.bulk_upsert(async_session, [kwargs])
+
+    @classmethod
+    async def bulk_upsert(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            rows: t.Sequence[t.Dict[str, t.Any]],
+            update_columns: t.Optional[t.Sequence[str]] = None,
+    ) -> None:
+        """
+        Insert or update many records with a single statement.
+
+        By default, every column present in the rows except the primary key is updated on conflict.
+        Columns missing from the rows get their defaults on insert and are left untouched on update.
+        """
+        if not rows:
+            return
+
+        if update_columns is None:
+            primary_key = cls._get_primary_key()
+            update_columns = [c for c in rows[0] if c != primary_key]
+        for column in update_columns:
+            if column not in cls.__table__.columns:
+                raise ValueError(f"Column {column} not found in {cls.__name__}")
+
+        dialect = async_session.get_bind().dialect.name
+        statement = cls._upsert_statement(dialect, rows, update_columns)
+        await async_session.execute(statement)
+        await async_session.commit()
+        cls._drop_counts()
 
     @classmethod
     async def create_or_update(
@@ -127,13 +227,18 @@ class AbstractModel(Base):
             async_session: AsyncSession,
             **kwargs,
     ) -> T:
-        """Get and update a record from the database by its primary key."""
-        primary_key = kwargs.get(cls._get_primary_key())
-        instance = await cls.get(async_session, primary_key)
-        if instance:
-            await cls.update(async_session, primary_key, **kwargs)
+        """
+        Create a record or update it by its primary key, then return the stored record.
+
+        The record is read first and written only when it is missing or one of the given columns differs,
+        so repeated calls with unchanged values stay reads.
+        """
+        instance = await async_session.get(cls, kwargs[cls._get_primary_key()])
+        if instance is not None and all(getattr(instance, c) == v for c, v in kwargs.items()):
             return instance
-        return await cls.create(async_session, **kwargs)
+
+        await cls.upsert(async_session, **kwargs)
+        return await async_session.get(cls, kwargs[cls._get_primary_key()], populate_existing=True)
 
     @classmethod
     async def exists(
@@ -180,15 +285,82 @@ class AbstractModel(Base):
         result = await async_session.execute(statement)
         return result.scalars().all()
 
+    @classmethod
+    async def paginate_keyset(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            limit: int,
+            after: t.Any = None,
+            before: t.Any = None,
+            offset: int = 0,
+            from_end: bool = False,
+            **kwargs,
+    ) -> t.Sequence[T]:
+        """
+        Get a page of records ordered by primary key, seeking from a known key instead of skipping rows.
+
+        :param limit: The maximum number of records to return.
+        :param after: Return records with a primary key greater than this value.
+        :param before: Return records with a primary key less than this value.
+        :param offset: The number of records to skip, counted from the start or from the end.
+        :param from_end: Whether the offset is counted from the last record.
+        :return: Records in ascending primary key order.
+        """
+        primary_key = cls.__table__.primary_key.columns[0]
+        statement = select(cls).filter_by(**kwargs)
+
+        if after is not None:
+            statement = statement.where(primary_key > after)
+        if before is not None:
+            statement = statement.where(primary_key < before)
+
+        descending = before is not None or from_end
+        statement = statement.order_by(primary_key.desc() if descending else primary_key)
+        statement = statement.offset(offset).limit(limit)
+
+        result = await async_session.execute(statement)
+        records = result.scalars().all()
+        return records[::-1] if descending else records
+
+    @classmethod
+    async def count(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            **kwargs,
+    ) -> int:
+        """Count records in the database by a filter."""
+        statement = select(func.count(cls.__table__.primary_key.columns[0])).filter_by(**kwargs)
+        query = await async_session.execute(statement)
+        return query.scalar()
+
+    @classmethod
+    async def count_cached(
+            cls: t.Type[T],
+            async_session: AsyncSession,
+            **kwargs,
+    ) -> int:
+        """
+        Count records by a filter, caching the total for COUNT_TTL seconds.
+
+        The cached totals of a table are dropped by the writes of this process, writes of other processes
+        are seen after COUNT_TTL seconds at most.
+        """
+        key = (cls.__tablename__, tuple(sorted(kwargs.items())))
+        total = _counts.get(key)
+        if total is None:
+            total = _counts[key] = await cls.count(async_session, **kwargs)
+        return total
+
     @classmethod
     async def total_pages(
             cls: t.Type[T],
             async_session: AsyncSession,
             page_size: int,
+            **kwargs,
     ) -> int:
-        statement = select(func.count(cls.__table__.primary_key.columns[0]))
-        query = await async_session.execute(statement)
-        return (query.scalar() + page_size - 1) // page_size
+        """Get the number of pages of records matching a filter."""
+        total = await cls.count_cached(async_session, **kwargs)
+        return (total + page_size - 1) // page_size
 
     @classmethod
     async def all(
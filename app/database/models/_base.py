@@ -1,5 +1,21 @@
+from sqlalchemy import Connection, inspect
 from sqlalchemy.orm import DeclarativeBase
 
 
 class Base(DeclarativeBase):
     """Base class for SQLAlchemy models."""
+
+
+def create_missing_indexes(connection: Connection) -> None:
+    """
+    Create the indexes declared on the models but missing from existing tables.
+
+    Base.metadata.create_all only creates the indexes of the tables it creates,
+    indexes added to a model later are created here on the next startup.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
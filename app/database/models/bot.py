@@ -20,6 +20,12 @@ class BotDB(AbstractModel):
           created_at (datetime): The timestamp when the user was created.
     """
     __tablename__ = "bots"
+    __table_args__ = (
+        # Owner-scoped listing, ordered by id
+        Index("ix_bots_user_id_id", "user_id", "id"),
+        # Lookup of the bot linked to a group
+        Index("ix_bots_group_id", "group_id"),
+    )
 
     id: int = Column(
         BigInteger,
@@ -1,25 +1,145 @@
+import atexit
+import json
 import logging
-from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Mapping, Optional, Tuple
 
+from .config import LoggingConfig
 
-def setup_logger() -> None:
-    # Set up basic logging configuration
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # noqa
-        handlers=[
-            # Add a timed rotating file handler to log to a file
-            TimedRotatingFileHandler(
-                filename=f"logs/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log",
-                when="midnight",
-                interval=1,
-                backupCount=1,
-            ),
-            # Add a stream handler to log to the console
-            logging.StreamHandler(),
-        ]
+# Bot ID, update ID, perf_counter() start and I/O counts by backend of the update being processed
+update_context: ContextVar[Optional[Tuple[int, int, float, Mapping[str, int]]]] = ContextVar(
+    "update_context", default=None,
+)
+
+
+class UpdateContextFilter(logging.Filter):
+    """
+    Adds the bot ID, the update ID, the time elapsed since the update was received
+    and the I/O made so far by the update to the records.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = update_context.get()
+        if context is not None:
+            record.bot_id, record.update_id = context[0], context[1]
+            record.latency = round(time.perf_counter() - context[2], 6)
+            if context[3]:
+                record.io = dict(context[3])
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most limit records of the same call site per interval,
+    the next record let through carries the number of the suppressed ones.
+    """
+
+    def __init__(self, limit: int, interval: float) -> None:
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        # Window start, number of records and number of suppressed records by call site
+        self.windows: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        window = self.windows.get((record.pathname, record.lineno))
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window is not None else 0
+            self.windows[(record.pathname, record.lineno)] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+
+        if window[1] >= self.limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler dropping records when the queue is full instead of blocking the event loop.
+
+    Only the message is formatted in the calling thread, as its arguments may change once the record is queued.
+    The traceback of an exception is formatted in the listener thread, which keeps its frames alive until
+    the record is written.
+    """
+
+    def __init__(self, queue_: queue.Queue) -> None:
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON lines.
+    """
+    extra_fields = ["bot_id", "update_id", "latency", "io", "suppressed", "dropped"]
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in self.extra_fields:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logger(config: LoggingConfig) -> None:
+    # Write records to the file and the console in a background thread
+    file_handler = TimedRotatingFileHandler(
+        filename="logs/app.log",
+        when="midnight",
+        interval=1,
+        backupCount=config.RETENTION_DAYS,
+        encoding="utf-8",
     )
+    file_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))  # noqa
+
+    records: queue.Queue = queue.Queue(maxsize=config.QUEUE_SIZE)
+    listener = QueueListener(records, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Filters and prepare run in the calling thread, usually the event loop, before the record is queued:
+    # the filters read the update context and count the records by call site, prepare formats the message.
+    # Tracebacks are formatted and records written in the listener thread
+    queue_handler = NonBlockingQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(config.RATE_LIMIT, config.RATE_INTERVAL))
+    queue_handler.addFilter(UpdateContextFilter())
+
+    # Set up basic logging configuration
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 
     # Set the log level for aiogram.event logger to CRITICAL
     aiogram_logger = logging.getLogger("aiogram.event")
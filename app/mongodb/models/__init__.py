@@ -1,7 +1,9 @@
+from .settings import SettingsMongo
 from .text import TextMongo
 from .user import UserMongo
 
 __all__ = [
+    "SettingsMongo",
     "TextMongo",
     "UserMongo",
 ]
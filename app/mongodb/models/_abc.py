@@ -1,24 +1,128 @@
+import time
 import typing as t
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
+
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+from ._codec import Decoder, Encoder, build_codec
 
 T = t.TypeVar("T", bound="AbstractModel")
 
+# Names of the fields to load, the _id field is always included
+Projection = t.Optional[t.Sequence[str]]
+
+# Collection holding per-collection document counters of a bot database
+COUNTERS_COLLECTION = "counters"
+# Seconds after which a counter is counted again, correcting the counts lost by seeding concurrently with writes
+# and the writes made to the collection directly
+COUNTER_TTL = 600
 
-@dataclass
+
+@dataclass(slots=True)
 class AbstractModel:
     _id: t.Optional[t.Any] = None
+    # Names of the fields assigned since the model was loaded, allocated on the first change
+    _changed: t.Optional[t.Set[str]] = field(default=None, init=False, repr=False, compare=False)
 
     @dataclass
     class Meta:
         collection: str
+        # Optional name of an integer field used for optimistic concurrency in save()
+        version_field: t.Optional[str] = None
+
+    def __post_init__(self) -> None:
+        # Fields assigned after this point are tracked as changed
+        object.__setattr__(self, "_changed", None)
+
+    def __setattr__(self, name: str, value: t.Any) -> None:
+        # Zero-argument super() is not available in slotted dataclasses
+        object.__setattr__(self, name, value)
+        if name == "_changed":
+            return
+        changed = getattr(self, "_changed", None)
+        if changed is None:
+            object.__setattr__(self, "_changed", {name})
+        else:
+            changed.add(name)
 
     @property
     def id(self) -> t.Any:
         return self._id
 
+    @property
+    def changed_fields(self) -> t.Set[str]:
+        """Names of the fields changed since the model was loaded or last saved."""
+        return set(self._changed or ())
+
+    async def save(self, mongodb: AsyncIOMotorDatabase) -> bool:
+        """
+        Write only the changed fields of the document with $set.
+
+        If the model declares Meta.version_field, the update only applies when the stored version
+        matches the loaded one, and the version is incremented.
+
+        :param mongodb: The MongoDB database.
+        :return: False if the document was changed concurrently or no longer exists, True otherwise.
+        """
+        if not self._changed:
+            return True
+
+        query = {"_id": self._id}
+        update = {"$set": {name: getattr(self, name) for name in self._changed}}
+
+        version_field = getattr(self.Meta, "version_field", None)
+        if version_field:
+            version = getattr(self, version_field)
+            # A missing version field is matched by None and set to 1 by $inc
+            query[version_field] = version
+            update["$set"].pop(version_field, None)
+            update["$inc"] = {version_field: 1}
+            if not update["$set"]:
+                del update["$set"]
+
+        result = await mongodb[self.Meta.collection].update_one(query, update)
+        if not result.matched_count:
+            return False
+
+        if version_field:
+            object.__setattr__(self, version_field, (version or 0) + 1)
+        self._changed = None
+        return True
+
+    @classmethod
+    def _codec(cls: t.Type[T]) -> t.Tuple[Decoder, Encoder]:
+        """
+        Generate the document codec of the class and install it in place of from_document and to_document.
+        """
+        decoder, encoder = build_codec(cls)
+        cls.from_document = staticmethod(decoder)
+        cls.to_document = encoder
+        return decoder, encoder
+
+    @classmethod
+    def from_document(cls: t.Type[T], data: t.Mapping[str, t.Any]) -> T:
+        """Build a model from a MongoDB document, ignoring unknown fields."""
+        return cls._codec()[0](data)
+
+    def to_document(self) -> dict:
+        """Convert the model to a MongoDB document."""
+        return self._codec()[1](self)
+
     def to_dict(self) -> dict:
-        return asdict(self)
+        return self.to_document()
+
+    @staticmethod
+    def _projection(projection: Projection) -> t.Optional[t.Dict[str, int]]:
+        """
+        Convert a list of field names to a MongoDB projection.
+
+        Models loaded with a projection are only partially filled, the other fields keep their defaults,
+        so they must not be written back as a whole.
+        """
+        if projection is None:
+            return None
+        return {field: 1 for field in projection}
 
     @classmethod
     async def create(
@@ -29,6 +133,7 @@ class AbstractModel:
         collection = mongodb[cls.Meta.collection]
         model = cls(**kwargs)
         await collection.insert_one(model.to_dict())
+        await cls._increment_count(mongodb, 1)
         return model
 
     @classmethod
@@ -39,7 +144,7 @@ class AbstractModel:
     ) -> T | None:
         collection = mongodb[cls.Meta.collection]
         data = await collection.find_one({"_id": _id})
-        return cls(**data) if data else None
+        return cls.from_document(data) if data else None
 
     @classmethod
     async def get_by_key(
@@ -47,10 +152,11 @@ class AbstractModel:
             mongodb: AsyncIOMotorDatabase,
             key: str,
             value: t.Any,
+            projection: Projection = None,
     ) -> T | None:
         collection = mongodb[cls.Meta.collection]
-        data = await collection.find_one({key: value})
-        return cls(**data) if data else None
+        data = await collection.find_one({key: value}, cls._projection(projection))
+        return cls.from_document(data) if data else None
 
     @classmethod
     async def update(
@@ -60,7 +166,25 @@ class AbstractModel:
     ) -> T | None:
         collection = mongodb[cls.Meta.collection]
         data = await collection.find_one_and_update({"_id": kwargs["_id"]}, {"$set": kwargs})
-        return cls(**data) if data else None
+        return cls.from_document(data) if data else None
+
+    @classmethod
+    async def update_many(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            ids: t.Sequence[t.Any],
+            **kwargs,
+    ) -> int:
+        """
+        Set the given fields of the documents with the given ids in a single command.
+
+        :return: The number of matched documents.
+        """
+        if not ids:
+            return 0
+        collection = mongodb[cls.Meta.collection]
+        result = await collection.update_many({"_id": {"$in": list(ids)}}, {"$set": kwargs})
+        return result.matched_count
 
     @classmethod
     async def delete(
@@ -69,15 +193,17 @@ class AbstractModel:
             _id: t.Any,
     ) -> None:
         collection = mongodb[cls.Meta.collection]
-        await collection.find_one_and_delete({"_id": _id})
+        if await collection.find_one_and_delete({"_id": _id}) is not None:
+            await cls._increment_count(mongodb, -1)
 
     @classmethod
     async def all(
             cls: t.Type[T],
             mongodb: AsyncIOMotorDatabase,
+            projection: Projection = None,
     ) -> t.List[T]:
         collection = mongodb[cls.Meta.collection]
-        return [cls(**data) async for data in collection.find()]
+        return [cls.from_document(data) async for data in collection.find(projection=cls._projection(projection))]
 
     @classmethod
     async def create_or_update(
@@ -85,10 +211,100 @@ class AbstractModel:
             mongodb: AsyncIOMotorDatabase,
             **kwargs,
     ) -> T:
-        instance = await cls.update(mongodb, **kwargs)
-        if instance is not None:
-            return instance
-        return await cls.create(mongodb, **kwargs)
+        """
+        Create a document or update the given fields with a single upsert.
+
+        Fields that are not passed keep their stored values, or get the model defaults on insert.
+        """
+        collection = mongodb[cls.Meta.collection]
+        document = cls(**kwargs).to_document()
+        defaults = {key: value for key, value in document.items() if key not in kwargs}
+        values = {key: value for key, value in kwargs.items() if key != "_id"}
+
+        update = {"$setOnInsert": defaults}
+        if values:
+            update["$set"] = values
+        data = await collection.find_one_and_update(
+            {"_id": kwargs["_id"]}, update,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if data is None:
+            await cls._increment_count(mongodb, 1)
+            return cls.from_document(document)
+        return cls.from_document({**data, **kwargs})
+
+    @classmethod
+    async def bulk_upsert(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            rows: t.Sequence[t.Mapping[str, t.Any]],
+            update_fields: t.Sequence[str],
+    ) -> t.Tuple[int, int]:
+        """
+        Create documents or update existing ones with a single unordered bulk write.
+
+        Of existing documents only the update_fields present in a row are overwritten,
+        the other fields of a row and the model defaults are only written on insert.
+
+        :param mongodb: The MongoDB database.
+        :param rows: Field values of the documents, each including the _id.
+        :param update_fields: Names of the fields updated in existing documents.
+        :return: The numbers of inserted and of matched existing documents.
+        """
+        requests = []
+        for row in rows:
+            document = cls(**row).to_document()
+            values = {key: document[key] for key in update_fields if key in row}
+            defaults = {key: value for key, value in document.items() if key not in values and key != "_id"}
+
+            update = {"$setOnInsert": defaults}
+            if values:
+                update["$set"] = values
+            requests.append(UpdateOne({"_id": document["_id"]}, update, upsert=True))
+
+        if not requests:
+            return 0, 0
+
+        result = await mongodb[cls.Meta.collection].bulk_write(requests, ordered=False)
+        if result.upserted_count:
+            await cls._increment_count(mongodb, result.upserted_count)
+        return result.upserted_count, result.matched_count
+
+    @classmethod
+    async def count(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+    ) -> int:
+        """
+        Get the number of documents in the collection from its cached counter.
+
+        The counter is maintained by create, delete and upserts, and set to the count of the collection metadata
+        on first use and when it is older than COUNTER_TTL seconds, without scanning the collection.
+        """
+        counters = mongodb[COUNTERS_COLLECTION]
+        counter = await counters.find_one({"_id": cls.Meta.collection})
+        if counter is not None and counter.get("counted_at", 0) > time.time() - COUNTER_TTL:
+            return counter["value"]
+
+        counted_at = time.time()
+        total_docs = await mongodb[cls.Meta.collection].estimated_document_count()
+        await counters.update_one(
+            {"_id": cls.Meta.collection},
+            {"$set": {"value": total_docs, "counted_at": counted_at}},
+            upsert=True,
+        )
+        return total_docs
+
+    @classmethod
+    async def _increment_count(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            value: int,
+    ) -> None:
+        """Adjust the cached counter of the collection, if it has been seeded."""
+        counters = mongodb[COUNTERS_COLLECTION]
+        await counters.update_one({"_id": cls.Meta.collection}, {"$inc": {"value": value}})
 
     @classmethod
     async def paginate(
@@ -96,8 +312,9 @@ class AbstractModel:
             mongodb: AsyncIOMotorDatabase,
             page: int,
             page_size: int,
+            projection: Projection = None,
     ) -> t.List[T]:
-        return await cls.paginate_by_filter(mongodb, page, page_size)
+        return await cls.paginate_by_filter(mongodb, page, page_size, projection)
 
     @classmethod
     async def total_pages(
@@ -105,8 +322,7 @@ class AbstractModel:
             mongodb: AsyncIOMotorDatabase,
             page_size: int,
     ) -> int:
-        collection = mongodb[cls.Meta.collection]
-        total_docs = await collection.count_documents({})
+        total_docs = await cls.count(mongodb)
         return (total_docs + page_size - 1) // page_size
 
     @classmethod
@@ -115,9 +331,101 @@ class AbstractModel:
             mongodb: AsyncIOMotorDatabase,
             page: int,
             page_size: int,
+            projection: Projection = None,
             **kwargs,
     ) -> t.List[T]:
         collection = mongodb[cls.Meta.collection]
         skip = (page - 1) * page_size
-        cursor = collection.find(**kwargs).skip(skip).limit(page_size)
-        return [cls(**data) async for data in cursor]
+        cursor = collection.find(projection=cls._projection(projection), **kwargs).skip(skip).limit(page_size)
+        return [cls.from_document(data) async for data in cursor]
+
+    @classmethod
+    async def paginate_keyset(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            limit: int,
+            after: t.Any = None,
+            before: t.Any = None,
+            offset: int = 0,
+            from_end: bool = False,
+            projection: Projection = None,
+            **kwargs,
+    ) -> t.List[T]:
+        """
+        Get a page of documents ordered by _id, seeking from a known _id instead of skipping documents.
+
+        :param limit: The maximum number of documents to return.
+        :param after: Return documents with an _id greater than this value.
+        :param before: Return documents with an _id less than this value.
+        :param offset: The number of documents to skip, counted from the start or from the end.
+        :param from_end: Whether the offset is counted from the last document.
+        :param projection: The fields to load, all fields are loaded by default.
+        :param kwargs: Additional filter conditions.
+        :return: Documents in ascending _id order.
+        """
+        collection = mongodb[cls.Meta.collection]
+        query = dict(kwargs)
+
+        bounds = {}
+        if after is not None:
+            bounds["$gt"] = after
+        if before is not None:
+            bounds["$lt"] = before
+        if bounds:
+            query["_id"] = bounds
+
+        descending = before is not None or from_end
+        cursor = collection.find(query, cls._projection(projection))
+        cursor = cursor.sort("_id", DESCENDING if descending else ASCENDING).skip(offset).limit(limit)
+
+        models = [cls.from_document(data) async for data in cursor]
+        return models[::-1] if descending else models
+
+    @classmethod
+    async def iterate(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            filter: t.Optional[t.Dict[str, t.Any]] = None,  # noqa:A002
+            projection: Projection = None,
+            batch_size: int = 1000,
+    ) -> t.AsyncIterator[T]:
+        """
+        Iterate over the documents of the collection without loading them all into memory.
+
+        Documents are fetched from the server in batches and yielded in ascending _id order,
+        so an interrupted iteration can be resumed with an {"_id": {"$gt": last_id}} filter.
+
+        :param mongodb: The MongoDB database.
+        :param filter: The filter conditions, all documents by default.
+        :param projection: The fields to load, all fields are loaded by default.
+        :param batch_size: The number of documents fetched per round trip.
+        """
+        collection = mongodb[cls.Meta.collection]
+        cursor = collection.find(filter or {}, cls._projection(projection), batch_size=batch_size)
+        async for data in cursor.sort("_id", ASCENDING):
+            yield cls.from_document(data)
+
+    @classmethod
+    async def iterate_batches(
+            cls: t.Type[T],
+            mongodb: AsyncIOMotorDatabase,
+            filter: t.Optional[t.Dict[str, t.Any]] = None,  # noqa:A002
+            projection: Projection = None,
+            batch_size: int = 1000,
+    ) -> t.AsyncIterator[t.List[T]]:
+        """
+        Iterate over the documents of the collection in lists of at most batch_size models.
+
+        :param mongodb: The MongoDB database.
+        :param filter: The filter conditions, all documents by default.
+        :param projection: The fields to load, all fields are loaded by default.
+        :param batch_size: The number of models per list.
+        """
+        batch: t.List[T] = []
+        async for model in cls.iterate(mongodb, filter, projection, batch_size):
+            batch.append(model)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
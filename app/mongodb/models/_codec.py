@@ -0,0 +1,58 @@
+import typing as t
+from dataclasses import MISSING, fields
+
+Decoder = t.Callable[[t.Mapping[str, t.Any]], t.Any]
+Encoder = t.Callable[[t.Any], t.Dict[str, t.Any]]
+
+
+def build_codec(cls: type) -> t.Tuple[Decoder, Encoder]:
+    """
+    Generate functions converting a document to a model of the given slotted dataclass and back.
+
+    The decoder reads only the declared fields, so unknown fields stored in a document are ignored
+    and missing ones get their defaults. It fills the slots of a private subclass that has the same
+    layout but no change tracking, then switches the object to the model class, so hydration is
+    plain attribute stores. The encoder builds a flat dict without the recursive copying done by
+    dataclasses.asdict.
+
+    :param cls: The model class.
+    :return: A tuple containing the decoder and the encoder.
+    """
+    raw_cls = type(f"Raw{cls.__name__}", (cls,), {"__slots__": (), "__setattr__": object.__setattr__})
+    namespace: t.Dict[str, t.Any] = {"cls": cls, "raw_cls": raw_cls, "new": object.__new__}
+    fast_assignments, assignments, items = [], [], []
+
+    for field in fields(cls):
+        if not field.init:
+            continue
+        name = field.name
+        if field.default is not MISSING:
+            namespace[f"default_{name}"] = field.default
+            value = f"data.get({name!r}, default_{name})"
+        elif field.default_factory is not MISSING:
+            namespace[f"factory_{name}"] = field.default_factory
+            value = f"data[{name!r}] if {name!r} in data else factory_{name}()"
+        else:
+            value = f"data[{name!r}]"
+        fast_assignments.append(f"        model.{name} = data[{name!r}]")
+        assignments.append(f"        model.{name} = {value}")
+        items.append(f"        {name!r}: model.{name},")
+
+    source = "\n".join([
+        "def from_document(data):",
+        "    model = new(raw_cls)",
+        "    try:",
+        *fast_assignments,
+        "    except KeyError:",
+        *assignments,
+        "    model._changed = None",
+        "    model.__class__ = cls",
+        "    return model",
+        "",
+        "def to_document(model):",
+        "    return {",
+        *items,
+        "    }",
+    ])
+    exec(source, namespace)  # noqa:S102
+    return namespace["from_document"], namespace["to_document"]
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import typing as t
+from dataclasses import dataclass
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ._abc import AbstractModel
+
+# The _id of the settings document
+SETTINGS_ID = "settings"
+
+
+@dataclass(slots=True)
+class SettingsMongo(AbstractModel):
+    """
+    Model for storing the settings of a bot in MongoDB, as a single document.
+
+    Attributes:
+        _id (str): The unique identifier of the settings document.
+        confirmation_mode (str): How delivered messages are confirmed: "coalesce", "every" or "off".
+        confirmation_window (int): The number of seconds a confirmation is shown and reused for further messages.
+    """
+    _id: t.Optional[str] = SETTINGS_ID
+    confirmation_mode: t.Optional[str] = "coalesce"
+    confirmation_window: t.Optional[int] = 5
+
+    @dataclass
+    class Meta:
+        collection = "settings"
+
+    @classmethod
+    async def load(
+            cls: t.Type[SettingsMongo],
+            mongodb: AsyncIOMotorDatabase,
+    ) -> SettingsMongo:
+        """Get the settings of the bot, or the defaults if they have never been changed."""
+        return await cls.get(mongodb, SETTINGS_ID) or cls()
@@ -8,7 +8,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from ._abc import AbstractModel
 
 
-@dataclass
+@dataclass(slots=True)
 class TextMongo(AbstractModel):
     """
     Model for storing text messages in MongoDB.
@@ -44,3 +44,4 @@ class TextMongo(AbstractModel):
         for _id, text in enumerate(texts, start=1):
             text._id = _id
             await collection.insert_one(text.to_dict())
+        await cls._increment_count(mongodb, len(texts))
@@ -7,7 +7,7 @@ from datetime import datetime
 from ._abc import AbstractModel
 
 
-@dataclass
+@dataclass(slots=True)
 class UserMongo(AbstractModel):
     """
     Model for storing user_list in MongoDB.
@@ -0,0 +1,37 @@
+from .instrumentation import (
+    MongoCommandMetrics,
+    TelegramRequestMetrics,
+    instrument_engine,
+    instrument_redis,
+)
+from .io import BACKENDS, IOBudget, io_budget, io_counter
+from .loop import LoopMonitor
+from .memory import CACHES, allocation_top, track_cache
+from .metrics import TenantLabels, count_cache_lookup
+from .middlewares import instrument_dispatcher
+from .recording import UpdateRecorder
+from .tracing import Tracer, span
+from .web import ProfilerHandler, setup_metrics_route
+
+__all__ = [
+    "BACKENDS",
+    "CACHES",
+    "IOBudget",
+    "LoopMonitor",
+    "MongoCommandMetrics",
+    "ProfilerHandler",
+    "TelegramRequestMetrics",
+    "TenantLabels",
+    "Tracer",
+    "UpdateRecorder",
+    "allocation_top",
+    "count_cache_lookup",
+    "instrument_dispatcher",
+    "instrument_engine",
+    "instrument_redis",
+    "io_budget",
+    "io_counter",
+    "setup_metrics_route",
+    "span",
+    "track_cache",
+]
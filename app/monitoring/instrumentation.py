@@ -0,0 +1,112 @@
+from time import perf_counter
+from typing import Any, Optional, TYPE_CHECKING
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from pymongo import monitoring
+from redis.asyncio import Redis
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .io import count_io
+from .metrics import TELEGRAM_DURATION, TELEGRAM_REQUESTS, observe_storage_call
+from .tracing import record_span, span
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+class TelegramRequestMetrics(BaseRequestMiddleware):
+    """
+    Session middleware counting Bot API requests by method and error and measuring their latency.
+    """
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: "Bot",
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        api_method, error = method.__api_method__, ""
+        count_io("telegram")
+        start = perf_counter()
+        try:
+            with span(api_method, "telegram", bot_id=bot.id):
+                return await make_request(bot, method)
+        except Exception as ex:
+            error = type(ex).__name__
+            raise
+        finally:
+            TELEGRAM_DURATION.labels(api_method).observe(perf_counter() - start)
+            TELEGRAM_REQUESTS.labels(api_method, error).inc()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Command listener counting MongoDB commands and measuring their latency, passed to the client as event listener.
+    """
+
+    def started(self, event_: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event_: monitoring.CommandSucceededEvent) -> None:
+        self._observe(event_.command_name, event_.database_name, event_.duration_micros)
+
+    def failed(self, event_: monitoring.CommandFailedEvent) -> None:
+        self._observe(event_.command_name, event_.database_name, event_.duration_micros, str(event_.failure))
+
+    @staticmethod
+    def _observe(command_name: str, database_name: str, duration_micros: int, error: Optional[str] = None) -> None:
+        count_io("mongodb")
+        # The start is recovered from the duration measured by the driver
+        observe_storage_call("mongodb", command_name, perf_counter() - duration_micros / 1e6, error is not None)
+        # Motor runs commands in threads with a copy of the context of the calling task
+        record_span(command_name, "mongodb", duration_micros / 1e6, error, database=database_name)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Count the SQL statements executed by an engine, measure their latency and record their spans.
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn: Any, *_: Any) -> None:
+        count_io("sql")
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn: Any, _: Any, statement: str, *__: Any) -> None:
+        operation, start = statement.split(None, 1)[0].lower(), conn.info["query_start"].pop()
+        observe_storage_call("sql", operation, start)
+        record_span(operation, "sql", perf_counter() - start, statement=statement)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context: Any) -> None:
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts and context.statement:
+            operation, start = context.statement.split(None, 1)[0].lower(), starts.pop()
+            observe_storage_call("sql", operation, start, True)
+            record_span(operation, "sql", perf_counter() - start, str(context.original_exception),
+                        statement=context.statement)
+
+
+def instrument_redis(redis: Redis) -> None:
+    """
+    Count the commands sent by a Redis client, measure their latency and record their spans.
+    """
+    execute_command = redis.execute_command
+
+    async def timed_execute_command(*args: Any, **options: Any) -> Any:
+        count_io("redis")
+        start, failed = perf_counter(), False
+        try:
+            with span(str(args[0]).lower(), "redis"):
+                return await execute_command(*args, **options)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            observe_storage_call("redis", str(args[0]).lower(), start, failed)
+
+    redis.execute_command = timed_execute_command
@@ -0,0 +1,103 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Tuple
+
+# Backends whose operations are counted: SQL statements, MongoDB commands, Redis commands and Bot API requests
+BACKENDS = ("sql", "mongodb", "redis", "telegram")
+
+# Counters of the operations of the current update and of the enclosing scopes
+_counters: ContextVar[Tuple[Counter, ...]] = ContextVar("io_counters", default=())
+# Budgets checking the updates finished while they are active
+_budgets: List["IOBudget"] = []
+
+
+def count_io(backend: str) -> None:
+    """
+    Count an operation of a backend in the current update.
+    """
+    for counter in _counters.get():
+        counter[backend] += 1
+
+
+def current_io() -> Counter:
+    """
+    The counter of the innermost scope, e.g. the current update, empty outside of a scope.
+    """
+    counters = _counters.get()
+    return counters[-1] if counters else Counter()
+
+
+@contextmanager
+def io_counter() -> Iterator[Counter]:
+    """
+    Count the operations made meanwhile in the current context, including the tasks and threads started in it.
+    """
+    counter: Counter = Counter()
+    token = _counters.set(_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _counters.reset(token)
+
+
+def finish_update(dispatcher: str, update_type: str, counter: Counter) -> None:
+    """
+    Pass the operations of a processed update to the active budgets.
+    """
+    for budget in _budgets:
+        budget.updates.append((dispatcher, update_type, Counter(counter)))
+
+
+class IOBudget:
+    """
+    The maximal number of operations by backend of every update processed while it is active.
+    """
+
+    def __init__(self, **limits: int) -> None:
+        unknown = set(limits) - set(BACKENDS)
+        if unknown:
+            raise ValueError(f"Unknown backends {', '.join(sorted(unknown))}, expected {', '.join(BACKENDS)}")
+        self.limits = limits
+        self.updates: List[Tuple[str, str, Counter]] = []
+
+    def violations(self) -> List[str]:
+        return [
+            f"{dispatcher} {update_type}: {backend} {counter[backend]} > {limit}"
+            for dispatcher, update_type, counter in self.updates
+            for backend, limit in self.limits.items()
+            if counter[backend] > limit
+        ]
+
+    def maximum(self) -> Dict[str, int]:
+        """
+        The maximal number of operations of an update by backend.
+        """
+        return {
+            backend: max((counter[backend] for _, _, counter in self.updates), default=0)
+            for backend in BACKENDS
+        }
+
+
+@contextmanager
+def io_budget(**limits: int) -> Iterator[IOBudget]:
+    """
+    Assert that every update processed meanwhile, by feeding it to a dispatcher or posting it to a webhook,
+    makes at most the given number of operations by backend, e.g. io_budget(mongodb=1, telegram=1).
+
+    The dispatchers must be instrumented, the budget is checked when leaving the block.
+
+    :raises AssertionError: An update exceeded the budget or no update was processed.
+    """
+    budget = IOBudget(**limits)
+    _budgets.append(budget)
+    try:
+        yield budget
+    finally:
+        _budgets.remove(budget)
+
+    if not budget.updates:
+        raise AssertionError("No update was processed")
+    violations = budget.violations()
+    if violations:
+        raise AssertionError("I/O budget exceeded:\n" + "\n".join(violations))
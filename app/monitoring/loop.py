@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from .metrics import LOOP_BLOCKS, LOOP_LAG
+
+
+class LoopMonitor:
+    """
+    Measures the lag of the event loop and logs the stack of the callbacks blocking it.
+
+    A task sleeping interval seconds measures how late it wakes up. A watchdog thread checks that the task
+    keeps waking up, when it has not for interval + block_threshold seconds the loop is blocked and the stack
+    of the event loop thread, the offending callback, is logged once per block.
+    """
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.25) -> None:
+        """
+        Initialize the LoopMonitor.
+
+        :param interval: The number of seconds between two measures of the lag.
+        :param block_threshold: The number of seconds from which a blocking callback is logged.
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    async def start(self) -> None:
+        """
+        Start measuring the lag of the running loop and watching it.
+        """
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self._measure())
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self) -> None:
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.watchdog is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.watchdog.join)
+
+    async def _measure(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            LOOP_LAG.observe(max(self.heartbeat - start - self.interval, 0.0))
+
+    def _watch(self) -> None:
+        # Heartbeat of the block already logged
+        logged = 0.0
+        while not self.stopped.wait(self.block_threshold / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.block_threshold or heartbeat == logged:
+                continue
+            logged = heartbeat
+
+            frame = sys._current_frames().get(self.loop_thread_id)  # noqa
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable"
+            LOOP_BLOCKS.inc()
+            logging.warning("Event loop blocked for %.0fms, stack of the blocking callback:\n%s",
+                            blocked * 1000, stack)
@@ -0,0 +1,251 @@
+import asyncio
+import dataclasses
+import logging
+import math
+import sys
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterator, List, MutableMapping, Optional, Set
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from pydantic import BaseModel
+
+from .metrics import CACHE_EVICTIONS
+
+# Number of entries of a cache measured to estimate the size of all of them
+SAMPLE_SIZE = 32
+# Maximal depth of the objects measured in an entry
+MAX_DEPTH = 8
+
+_ATOMS = (str, bytes, int, float, bool, type(None))
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def deep_size(obj: Any, seen: Optional[Set[int]] = None, depth: int = 0) -> int:
+    """
+    Estimate the memory of an object with the containers, models and dataclasses it holds.
+
+    Other objects, e.g. Bot objects sharing a session, are measured without the objects they reference.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, _ATOMS) or depth >= MAX_DEPTH:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_size(key, seen, depth + 1) + deep_size(value, seen, depth + 1)
+                          for key, value in obj.items())
+    if isinstance(obj, _CONTAINERS):
+        return size + sum(deep_size(item, seen, depth + 1) for item in obj)
+    if isinstance(obj, BaseModel) or dataclasses.is_dataclass(obj):
+        if hasattr(obj, "__dict__"):
+            return size + deep_size(vars(obj), seen, depth + 1)
+        return size + sum(deep_size(getattr(obj, name, None), seen, depth + 1)
+                          for name in getattr(type(obj), "__slots__", ()))
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(vars(obj))
+    return size
+
+
+@dataclass
+class TrackedCache:
+    name: str
+    cache: MutableMapping
+    # Entries may be evicted to keep the cache within its budget
+    evictable: bool = True
+    # Budget in bytes overriding the configured one, 0 for no budget
+    budget: Optional[int] = None
+
+
+class CacheRegistry(Collector):
+    """
+    Registry of the in-process caches and long-lived state, reporting their number of entries and estimated
+    memory, and evicting the oldest entries of the caches exceeding their memory budget.
+    """
+
+    def __init__(self) -> None:
+        self.caches: Dict[str, TrackedCache] = {}
+        self.budgets: Dict[str, int] = {}
+        self.default_budget = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, cache: MutableMapping, evictable: bool = True, budget: Optional[int] = None) -> None:
+        self.caches[name] = TrackedCache(name, cache, evictable, budget)
+
+    def configure(self, budgets: Dict[str, int], default_budget: int = 0) -> None:
+        """
+        Set the memory budgets in bytes of the caches by name and of the others, 0 for no budget.
+        """
+        self.budgets = budgets
+        self.default_budget = default_budget
+
+    def budget(self, tracked: TrackedCache) -> int:
+        if not tracked.evictable:
+            return 0
+        if tracked.budget is not None:
+            return tracked.budget
+        return self.budgets.get(tracked.name, self.default_budget)
+
+    @staticmethod
+    def entries(cache: MutableMapping) -> int:
+        if hasattr(cache, "expire"):
+            # Expired entries of cachetools caches are only dropped on writes
+            cache.expire()
+        return len(cache)
+
+    @staticmethod
+    def estimate(cache: MutableMapping) -> int:
+        """
+        Estimate the memory of a cache from the average size of a sample of its entries.
+        """
+        size = len(cache)
+        if not size:
+            return sys.getsizeof(cache)
+        step = max(size // SAMPLE_SIZE, 1)
+        sampled, total = 0, 0
+        for key in islice(list(cache), 0, None, step):
+            value = cache.get(key)
+            total += deep_size(key) + deep_size(value)
+            sampled += 1
+        # Containers of the cachetools caches are a few dicts of the size of the cache
+        return sys.getsizeof(cache) + math.ceil(total / max(sampled, 1) * size)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Report the number of entries, the estimated bytes and the budget of every cache.
+        """
+        return [
+            {
+                "cache": tracked.name,
+                "entries": self.entries(tracked.cache),
+                "bytes": self.estimate(tracked.cache),
+                "budget": self.budget(tracked),
+            }
+            for tracked in self.caches.values()
+        ]
+
+    def enforce(self) -> None:
+        """
+        Evict the oldest entries of the caches exceeding their budget.
+        """
+        for tracked in self.caches.values():
+            budget = self.budget(tracked)
+            if not budget or not self.entries(tracked.cache):
+                continue
+            used = self.estimate(tracked.cache)
+            if used <= budget:
+                continue
+
+            cache = tracked.cache
+            count = math.ceil(len(cache) * (1 - budget / used))
+            for _ in range(count):
+                if hasattr(cache, "popitem") and hasattr(cache, "expire"):
+                    # Least recently used or first to expire entry of cachetools caches
+                    cache.popitem()
+                else:
+                    # Dicts keep the insertion order
+                    cache.pop(next(iter(cache)))
+            CACHE_EVICTIONS.labels(tracked.name).inc(count)
+            logging.warning("Cache %s used %d bytes of its %d bytes budget, evicted %d entries",
+                            tracked.name, used, budget, count)
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.enforce()
+
+    def start(self, interval: float) -> None:
+        """
+        Start enforcing the budgets every interval seconds.
+        """
+        self.task = asyncio.create_task(self.watch(interval))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        entries = GaugeMetricFamily("bot_cache_entries", "Number of entries of an in-process cache.",
+                                    labels=["cache"])
+        size = GaugeMetricFamily("bot_cache_bytes", "Estimated memory of an in-process cache in bytes.",
+                                 labels=["cache"])
+        for tracked in self.caches.values():
+            entries.add_metric([tracked.name], self.entries(tracked.cache))
+            size.add_metric([tracked.name], self.estimate(tracked.cache))
+        yield entries
+        yield size
+
+
+CACHES = CacheRegistry()
+REGISTRY.register(CACHES)
+
+
+def track_cache(name: str, cache: MutableMapping, evictable: bool = True, budget: Optional[int] = None) -> None:
+    """
+    Report the number of entries and the memory of a cache, evicting entries beyond its memory budget.
+
+    :param name: The name of the cache used as label value and to configure its budget.
+    :param cache: The cache, a dict or a cachetools cache.
+    :param evictable: Entries may be evicted, false for state that must be kept.
+    :param budget: The budget in bytes overriding the configured one, 0 for no budget.
+    """
+    CACHES.register(name, cache, evictable, budget)
+
+
+def _allocation_top(limit: int, group_by: str) -> Dict[str, Any]:
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_bytes": traced,
+        "peak_bytes": peak,
+        "top": [
+            {
+                "location": [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback],
+                "bytes": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in snapshot.statistics(group_by)[:limit]
+        ],
+    }
+
+
+async def allocation_top(limit: int = 20, seconds: float = 30, group_by: str = "lineno") -> Dict[str, Any]:
+    """
+    Report the code locations holding the most memory allocated by Python.
+
+    When tracemalloc is not tracing already, it traces the allocations for a number of seconds,
+    reporting the memory allocated meanwhile and still held, e.g. the growth of caches.
+    The snapshot is taken and grouped in the executor, it takes seconds on large heaps.
+
+    :param limit: The number of locations reported.
+    :param seconds: The duration of the tracing when tracemalloc is not tracing already.
+    :param group_by: Group the allocations by lineno, filename or traceback.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        if started:
+            await asyncio.sleep(seconds)
+        result = await asyncio.get_running_loop().run_in_executor(None, _allocation_top, limit, group_by)
+    finally:
+        if started:
+            tracemalloc.stop()
+    result["traced_seconds"] = seconds if started else None
+    return result
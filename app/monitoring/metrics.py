@@ -0,0 +1,105 @@
+from time import perf_counter
+from typing import Dict
+
+from prometheus_client import Counter, Histogram
+
+# Label value of the tenants beyond the cardinality limit
+OTHER_TENANTS = "other"
+
+UPDATES = Counter(
+    "bot_updates_total",
+    "Number of processed updates.",
+    ["dispatcher", "update_type", "tenant", "status"],
+)
+UPDATE_DURATION = Histogram(
+    "bot_update_duration_seconds",
+    "Time spent processing an update.",
+    ["dispatcher", "update_type", "tenant"],
+)
+MIDDLEWARE_DURATION = Histogram(
+    "bot_middleware_duration_seconds",
+    "Time spent in a middleware, excluding the middlewares and handlers it calls.",
+    ["dispatcher", "middleware"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+STORAGE_CALLS = Counter(
+    "bot_storage_calls_total",
+    "Number of calls to the SQL database, MongoDB and Redis.",
+    ["backend", "operation", "status"],
+)
+STORAGE_DURATION = Histogram(
+    "bot_storage_call_duration_seconds",
+    "Latency of calls to the SQL database, MongoDB and Redis.",
+    ["backend", "operation"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+TELEGRAM_REQUESTS = Counter(
+    "bot_telegram_requests_total",
+    "Number of Bot API requests by method and error, the error is empty for successful requests.",
+    ["method", "error"],
+)
+TELEGRAM_DURATION = Histogram(
+    "bot_telegram_request_duration_seconds",
+    "Latency of Bot API requests.",
+    ["method"],
+)
+UPDATE_IO = Histogram(
+    "bot_update_io_operations",
+    "Number of SQL statements, MongoDB commands, Redis commands and Bot API requests made by an update.",
+    ["dispatcher", "backend"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+)
+CACHE_REQUESTS = Counter(
+    "bot_cache_requests_total",
+    "Number of cache lookups by result, hit or miss.",
+    ["cache", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "bot_cache_evictions_total",
+    "Number of entries evicted from an in-process cache to keep it within its memory budget.",
+    ["cache"],
+)
+LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds",
+    "Delay of the event loop in running a callback scheduled at a known time.",
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+LOOP_BLOCKS = Counter(
+    "bot_event_loop_blocks_total",
+    "Number of times a callback blocked the event loop longer than the threshold.",
+)
+
+
+class TenantLabels:
+    """
+    Maps tenants to label values, keeping the number of series bounded.
+
+    The first max_tenants tenants seen get their own label value, the others share the "other" value.
+    """
+
+    def __init__(self, max_tenants: int) -> None:
+        self.max_tenants = max_tenants
+        self.tenants: Dict[str, str] = {}
+
+    def get(self, tenant: str) -> str:
+        label = self.tenants.get(tenant)
+        if label is None:
+            if len(self.tenants) >= self.max_tenants:
+                return OTHER_TENANTS
+            label = self.tenants[tenant] = tenant
+        return label
+
+
+def count_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Count a lookup of a cache in the bot_cache_requests_total counter.
+    """
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_storage_call(backend: str, operation: str, start: float, failed: bool = False) -> None:
+    """
+    Record a call to a storage backend started at the given perf_counter() time.
+    """
+    STORAGE_CALLS.labels(backend, operation, "error" if failed else "ok").inc()
+    STORAGE_DURATION.labels(backend, operation).observe(perf_counter() - start)
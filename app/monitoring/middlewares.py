@@ -0,0 +1,219 @@
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+from app.logger import update_context
+from .io import BACKENDS, current_io, finish_update, io_counter
+from .metrics import MIDDLEWARE_DURATION, UPDATES, UPDATE_DURATION, UPDATE_IO, TenantLabels
+from .recording import UpdateRecorder, UpdateRecordingMiddleware
+from .tracing import Tracer, span
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Outer middleware counting the updates of a dispatcher and measuring their processing time.
+    """
+
+    def __init__(self, dispatcher: str, tenants: Optional[TenantLabels] = None) -> None:
+        """
+        Initialize the UpdateMetricsMiddleware.
+
+        :param dispatcher: The name of the dispatcher used as label value.
+        :param tenants: The tenant labels of a multi-bot dispatcher, the tenant label is the bot ID.
+            Without them the tenant label is the dispatcher name.
+        """
+        self.dispatcher = dispatcher
+        self.tenants = tenants
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram update.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        tenant = self.dispatcher if self.tenants is None else self.tenants.get(str(data["bot"].id))
+        try:
+            update_type = event.event_type
+        except Exception:  # noqa
+            update_type = "unknown"
+
+        start, status = perf_counter(), "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            UPDATE_DURATION.labels(self.dispatcher, update_type, tenant).observe(perf_counter() - start)
+            UPDATES.labels(self.dispatcher, update_type, tenant, status).inc()
+
+
+class IOCountingMiddleware(BaseMiddleware):
+    """
+    Outer middleware counting the SQL statements, MongoDB commands, Redis commands and Bot API requests of an update.
+    """
+
+    def __init__(self, dispatcher: str) -> None:
+        self.dispatcher = dispatcher
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        with io_counter() as counter:
+            try:
+                return await handler(event, data)
+            finally:
+                for backend in BACKENDS:
+                    UPDATE_IO.labels(self.dispatcher, backend).observe(counter[backend])
+                try:
+                    update_type = event.event_type
+                except Exception:  # noqa
+                    update_type = "unknown"
+                finish_update(self.dispatcher, update_type, counter)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Outer middleware adding the bot ID, the update ID, the latency and the I/O counts to the log records of an update.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        token = update_context.set((data["bot"].id, event.update_id, perf_counter(), current_io()))
+        try:
+            return await handler(event, data)
+        finally:
+            update_context.reset(token)
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Outer middleware tracing the processing of an update, the spans recorded meanwhile belong to its trace.
+    """
+
+    def __init__(self, dispatcher: str, tracer: Tracer) -> None:
+        self.dispatcher = dispatcher
+        self.tracer = tracer
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        with self.tracer.trace(str(event.update_id), dispatcher=self.dispatcher, bot_id=data["bot"].id) as root:
+            try:
+                return await handler(event, data)
+            finally:
+                root.attributes.update({f"io.{backend}": count for backend, count in current_io().items()})
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """
+    Inner middleware recording a span of the handler, named after its module and line as all handlers are
+    named "handler".
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        code = getattr(callback, "__code__", None)
+        name = f"{callback.__module__}:{code.co_firstlineno if code else callback.__qualname__}"
+        with span(name, "handler"):
+            return await handler(event, data)
+
+
+class TimedMiddleware:
+    """
+    Wraps a middleware, measuring the time spent in it without the time of the middlewares and handlers it calls,
+    and recording its span.
+    """
+
+    def __init__(self, middleware: Callable, dispatcher: str, name: str) -> None:
+        self.middleware = middleware
+        self.name = name
+        self.histogram = MIDDLEWARE_DURATION.labels(dispatcher, name)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        inner = 0.0
+
+        async def timed_handler(event_: TelegramObject, data_: Dict[str, Any]) -> Any:
+            nonlocal inner
+            handler_start = perf_counter()
+            try:
+                return await handler(event_, data_)
+            finally:
+                inner += perf_counter() - handler_start
+
+        start = perf_counter()
+        try:
+            with span(self.name, "middleware"):
+                return await self.middleware(timed_handler, event, data)
+        finally:
+            self.histogram.observe(perf_counter() - start - inner)
+
+
+def instrument_dispatcher(
+        dp: Dispatcher,
+        name: str,
+        tenants: Optional[TenantLabels] = None,
+        tracer: Optional[Tracer] = None,
+        recorder: Optional[UpdateRecorder] = None,
+) -> None:
+    """
+    Add update metrics, I/O counts, log context, tracing and recording to a dispatcher
+    and measure its registered middlewares.
+
+    Must be called after the middlewares of the dispatcher are registered.
+
+    :param dp: The Dispatcher object.
+    :param name: The name of the dispatcher used as label value.
+    :param tenants: The tenant labels of a multi-bot dispatcher.
+    :param tracer: The tracer of the updates, without it no spans are recorded.
+    :param recorder: The recorder of the updates, without it no updates are recorded.
+    """
+    for observer in dp.observers.values():
+        for manager in (observer.outer_middleware, observer.middleware):
+            middlewares = list(manager)
+            for middleware in middlewares:
+                manager.unregister(middleware)
+            if observer is dp.update and manager is observer.outer_middleware:
+                # Registered first to measure the whole processing of the update
+                manager.register(UpdateMetricsMiddleware(name, tenants))
+                if recorder is not None:
+                    manager.register(UpdateRecordingMiddleware(name, recorder))
+                manager.register(IOCountingMiddleware(name))
+                manager.register(LogContextMiddleware())
+                if tracer is not None:
+                    manager.register(UpdateTracingMiddleware(name, tracer))
+            for middleware in middlewares:
+                manager.register(TimedMiddleware(middleware, name, type(middleware).__name__))
+            if tracer is not None and observer is not dp.update and manager is observer.middleware:
+                # Registered last to wrap the handler only, routers have no middlewares of their own
+                manager.register(HandlerTracingMiddleware())
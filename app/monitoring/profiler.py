@@ -0,0 +1,141 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, List, Tuple
+
+# What a task waits on, by the first package found in the coroutines of its await chain.
+# Motor returns futures of the executor, the Mongo calls are found by the models awaiting them
+WAITING_ON = [
+    ("motor", "mongodb"),
+    ("app.mongodb", "mongodb"),
+    ("sqlalchemy", "sql"),
+    ("aiomysql", "sql"),
+    ("aiosqlite", "sql"),
+    ("redis", "redis"),
+    ("aiogram.client", "telegram"),
+    ("aiohttp", "http"),
+]
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads of the process from a background thread and counts them
+    as collapsed stacks, the input format of flamegraph.pl and speedscope.
+
+    Only one sampler runs at a time, the sampling holds the GIL for the time of walking the stacks.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float = 0.005) -> None:
+        """
+        Initialize the StackSampler.
+
+        :param interval: The number of seconds between two samples.
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._lock.locked()
+
+    def run(self, seconds: float) -> None:
+        """
+        Sample the stacks for a number of seconds, blocking the calling thread.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            own_id = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():  # noqa
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+
+    def collapsed(self) -> str:
+        """
+        Render the counted stacks as collapsed stacks, one "frame;frame;frame count" line per stack.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def await_chain(task: asyncio.Task) -> Tuple[List[str], Any]:
+    """
+    Follow the await chain of a task from its coroutine to the innermost awaited object.
+
+    :return: The names of the coroutines of the chain and the innermost awaited object, usually a future.
+    """
+    chain, awaitable = [], task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) \
+            or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            break
+        chain.append(frame_name(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) \
+            or getattr(awaitable, "ag_await", None)
+    return chain, awaitable
+
+
+def waiting_on(chain: List[str], awaitable: Any) -> str:
+    if not chain:
+        return "unknown"
+    if chain[-1].startswith("asyncio.tasks:sleep"):
+        return "sleep"
+    for package, name in WAITING_ON:
+        if any(frame.startswith(package) for frame in chain):
+            return name
+    if isinstance(awaitable, asyncio.Future):
+        return "future"
+    return chain[-1].split(":", 1)[0]
+
+
+def task_snapshot() -> Dict[str, Any]:
+    """
+    Snapshot the asyncio tasks of the running loop, grouped by the name of their coroutine,
+    the innermost coroutine of the application they are in, e.g. a handler, and what they are waiting on.
+
+    Must be called in the event loop thread.
+    """
+    groups: Counter = Counter()
+    waiting: Counter = Counter()
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        chain, awaitable = await_chain(task)
+        coroutine = chain[0] if chain else task.get_name()
+        in_app = next((frame for frame in reversed(chain) if frame.startswith("app.")), None)
+        waits = waiting_on(chain, awaitable)
+        groups[(coroutine, in_app, waits)] += 1
+        waiting[waits] += 1
+    return {
+        "tasks": len(tasks),
+        "waiting_on": dict(waiting.most_common()),
+        "groups": [
+            {"coroutine": coroutine, "in": in_app, "waiting_on": waits, "count": count}
+            for (coroutine, in_app, waits), count in groups.most_common()
+        ],
+    }
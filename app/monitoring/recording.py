@@ -0,0 +1,212 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Anonymized IDs are in [ANONYMIZED_ID_BASE, 2 * ANONYMIZED_ID_BASE), keeping the sign of the original ID
+ANONYMIZED_ID_BASE = 10 ** 12
+
+# Keys of the integer IDs of users, chats and bots
+ID_KEYS = {"id", "user_id", "user_chat_id", "chat_id", "migrate_to_chat_id", "migrate_from_chat_id"}
+# Keys of the names of users, chats and topics, replaced by a pseudonym
+NAME_KEYS = {"first_name", "last_name", "username", "title", "name", "author_signature", "file_name"}
+# Keys of the texts written by users, replaced keeping their length and commands
+TEXT_KEYS = {"text", "caption", "explanation", "question"}
+# Keys of the other personal data, replaced by a placeholder
+PRIVATE_KEYS = {"phone_number", "email", "vcard", "address", "bio", "url", "invite_link"}
+# Keys of coordinates, dropped to zero
+LOCATION_KEYS = {"latitude", "longitude", "horizontal_accuracy"}
+
+
+class Anonymizer:
+    """
+    Replaces the personal data of updates by keyed hashes, the same value is always replaced by the same one
+    so that users, chats, bots and topics stay related across updates.
+    """
+
+    def __init__(self, key: str) -> None:
+        # A key of its own, recordings shared for replay must not depend on the encryption key of the tokens
+        if not key:
+            raise ValueError("An anonymization key is required, set RECORDING_ANONYMIZE_KEY")
+        self.key = key.encode()
+
+    def digest(self, value: Any) -> int:
+        return int.from_bytes(hmac.new(self.key, str(value).encode(), hashlib.sha256).digest()[:8], "big")
+
+    def anonymize_id(self, value: int) -> int:
+        # Private chats share the ID of their user, both are anonymized from the absolute value
+        anonymized = ANONYMIZED_ID_BASE + self.digest(abs(value)) % ANONYMIZED_ID_BASE
+        return -anonymized if value < 0 else anonymized
+
+    def anonymize_name(self, value: str) -> str:
+        return f"name{self.digest(value) % 10 ** 8}"
+
+    @staticmethod
+    def anonymize_text(value: str, entities: Optional[List[Dict[str, Any]]]) -> str:
+        """
+        Replace the characters of a text but the spaces and the bot commands,
+        keeping its length in UTF-16 code units so that the offsets of its entities stay valid.
+        """
+        commands = [
+            (entity["offset"], entity["offset"] + entity["length"])
+            for entity in entities or [] if entity.get("type") == "bot_command"
+        ]
+        result, offset = [], 0
+        for char in value:
+            width = 2 if ord(char) > 0xFFFF else 1
+            if char.isspace() or any(start <= offset < end for start, end in commands):
+                result.append(char)
+            else:
+                result.append("x" * width)
+            offset += width
+        return "".join(result)
+
+    def anonymize(self, value: Any) -> Any:
+        """
+        Anonymize an update dumped as JSON compatible values.
+        """
+        if isinstance(value, list):
+            return [self.anonymize(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for key, item in value.items():
+            if key in ID_KEYS and isinstance(item, int):
+                result[key] = self.anonymize_id(item)
+            elif key in NAME_KEYS and isinstance(item, str):
+                result[key] = self.anonymize_name(item)
+            elif key in TEXT_KEYS and isinstance(item, str):
+                result[key] = self.anonymize_text(item, value.get("entities") or value.get("caption_entities"))
+            elif key in PRIVATE_KEYS and isinstance(item, str):
+                result[key] = "anonymized"
+            elif key in LOCATION_KEYS and isinstance(item, (int, float)):
+                result[key] = 0.0
+            else:
+                result[key] = self.anonymize(item)
+        return result
+
+
+class UpdateRecorder:
+    """
+    Records a sample of the incoming updates, anonymized, to a file of gzip compressed JSON lines.
+
+    Updates are sampled by sender, keeping all the updates of the sampled users and chats, e.g. all the messages
+    of an album. Lines are buffered and appended to the file as a new gzip member in the default executor.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            key: str,
+            sample_rate: float = 1.0,
+            buffer_size: int = 100,
+            flush_interval: float = 5.0,
+    ) -> None:
+        """
+        Initialize the UpdateRecorder.
+
+        :param path: The path of the gzip file the updates are appended to.
+        :param key: The key of the anonymization hashes, separate from SECRET_KEY, the same key gives the same
+            IDs across recordings.
+        :param sample_rate: The fraction of the senders whose updates are recorded.
+        :param buffer_size: The number of buffered lines written at once.
+        :param flush_interval: The maximal number of seconds a line stays in the buffer while updates arrive.
+        """
+        self.path = path
+        self.anonymizer = Anonymizer(key)
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.buffer: List[str] = []
+        self.flushed_at = time.monotonic()
+        self.writes: Set[asyncio.Future] = set()
+        self.lock = threading.Lock()
+
+    def sampled(self, data: Dict[str, Any]) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        sender = data.get("event_from_user") or data.get("event_chat")
+        if sender is None:
+            return False
+        return self.anonymizer.digest(sender.id) % 10_000 < self.sample_rate * 10_000
+
+    def record(self, dispatcher: str, event: Update, data: Dict[str, Any], received_at: float) -> None:
+        """
+        Buffer the record of an update.
+
+        :param dispatcher: The name of the dispatcher, main or multi.
+        :param event: The update.
+        :param data: The data of the update, the bot_db of the multi-bot dispatcher is recorded with it.
+        :param received_at: The UNIX time the update was received.
+        """
+        anonymize_id = self.anonymizer.anonymize_id
+        record = {
+            "time": received_at,
+            "dispatcher": dispatcher,
+            "bot_id": anonymize_id(data["bot"].id),
+            "update": self.anonymizer.anonymize(event.model_dump(mode="json", exclude_none=True, by_alias=True)),
+        }
+        bot_db = data.get("bot_db")
+        if bot_db is not None:
+            record["owner_id"] = anonymize_id(bot_db.user_id)
+            if bot_db.group_id is not None:
+                record["group_id"] = anonymize_id(bot_db.group_id)
+        self.buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+        if len(self.buffer) >= self.buffer_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        lines, self.buffer, self.flushed_at = self.buffer, [], time.monotonic()
+        if not lines:
+            return
+        future = asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+        self.writes.add(future)
+        future.add_done_callback(self.writes.discard)
+
+    def _write(self, lines: List[str]) -> None:
+        data = gzip.compress(("\n".join(lines) + "\n").encode())
+        # Executor threads write concurrently, the members must not interleave
+        with self.lock, open(self.path, "ab") as file:
+            file.write(data)
+
+    async def close(self) -> None:
+        """
+        Write the buffered lines and wait for the pending writes.
+        """
+        self.flush()
+        if self.writes:
+            await asyncio.gather(*self.writes)
+
+
+class UpdateRecordingMiddleware(BaseMiddleware):
+    """
+    Outer middleware recording the updates of a dispatcher.
+    """
+
+    def __init__(self, dispatcher: str, recorder: UpdateRecorder) -> None:
+        self.dispatcher = dispatcher
+        self.recorder = recorder
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        received_at = time.time()
+        try:
+            return await handler(event, data)
+        finally:
+            # Sampled and recorded after processing, the inner middlewares have added the sender and bot_db
+            if self.recorder.sampled(data):
+                self.recorder.record(self.dispatcher, event, data, received_at)
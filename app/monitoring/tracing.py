@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+# Kinds of the spans recorded by the application, outbound calls are exported as OTLP client spans
+INTERNAL_KINDS = ["update", "middleware", "handler"]
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_ERROR = 2
+
+SERVICE_NAME = "feedback-bot-constructor"
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    span_id: str
+    parent_id: Optional[str]
+    start: int
+    end: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """
+        The duration of the span in seconds.
+        """
+        return (self.end - self.start) / 1e9
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: List[Span] = field(default_factory=list)
+    # Spans of tasks outliving the update are not recorded after it is finished
+    finished: bool = False
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def _new_span(trace: Trace, name: str, kind: str, start: int, attributes: Dict[str, Any]) -> Span:
+    parent = _span.get()
+    span = Span(name, kind, os.urandom(8).hex(), parent.span_id if parent else None, start, attributes=attributes)
+    trace.spans.append(span)
+    return span
+
+
+@contextmanager
+def span(name: str, kind: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Record a span of the current update, the spans recorded inside it are its children.
+
+    Does nothing outside of an update.
+
+    :param name: The name of the span, e.g. the name of the middleware or the Bot API method.
+    :param kind: The kind of the span: update, middleware, handler, telegram, sql, mongodb or redis.
+    :param attributes: The attributes of the span.
+    """
+    trace = _trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+
+    current = _new_span(trace, name, kind, time.time_ns(), attributes)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as ex:
+        current.error = f"{type(ex).__name__}: {ex}"
+        raise
+    finally:
+        current.end = time.time_ns()
+        _span.reset(token)
+
+
+def record_span(name: str, kind: str, duration: float, error: Optional[str] = None, **attributes: Any) -> None:
+    """
+    Record a finished span of the current update ending now, for calls measured by callbacks
+    instead of wrapping them, like SQL statements and MongoDB commands.
+    """
+    trace = _trace.get()
+    if trace is None or trace.finished:
+        return
+
+    end = time.time_ns()
+    recorded = _new_span(trace, name, kind, end - int(duration * 1e9), attributes)
+    recorded.end, recorded.error = end, error
+
+
+class Tracer:
+    """
+    Collects the spans of updates, logs the slow updates with their span breakdown
+    and optionally exports the spans to a file of OTLP-JSON lines.
+    """
+
+    def __init__(self, slow_update_threshold: float, export_path: str = "", export_all: bool = False) -> None:
+        """
+        Initialize the Tracer.
+
+        :param slow_update_threshold: The processing time in seconds from which an update is logged as slow.
+        :param export_path: The path of the file the traces are appended to, empty to disable the export.
+        :param export_all: Export the traces of all updates instead of the slow ones only.
+        """
+        self.slow_update_threshold = slow_update_threshold
+        self.export_path = export_path
+        self.export_all = export_all
+        # Traces are appended by the executor threads, a lock keeps their lines whole
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Trace the processing of an update, the root span is named after the update.
+        """
+        trace = Trace(os.urandom(16).hex())
+        token = _trace.set(trace)
+        try:
+            with span(name, "update", **attributes) as root:
+                yield root
+        finally:
+            trace.finished = True
+            _trace.reset(token)
+            self._finish(trace)
+
+    def _finish(self, trace: Trace) -> None:
+        root = trace.spans[0]
+        slow = root.duration >= self.slow_update_threshold
+        if slow:
+            logging.warning(self.format_trace(trace))
+        if self.export_path and (slow or self.export_all):
+            line = json.dumps(self.to_otlp(trace), separators=(",", ":")) + "\n"
+            asyncio.get_running_loop().run_in_executor(None, self._write, line)
+
+    def _write(self, line: str) -> None:
+        with self.lock, open(self.export_path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+    @staticmethod
+    def self_times(trace: Trace) -> Dict[str, float]:
+        """
+        Get the time of every span without the time of its children, by span ID.
+        """
+        times = {s.span_id: s.duration for s in trace.spans}
+        for s in trace.spans:
+            if s.parent_id in times:
+                times[s.parent_id] -= s.duration
+        # Concurrent children may overlap
+        return {span_id: max(value, 0.0) for span_id, value in times.items()}
+
+    @classmethod
+    def format_trace(cls, trace: Trace) -> str:
+        """
+        Format a trace as a slow update message with the span tree and the span taking the most time as cause.
+        """
+        self_times = cls.self_times(trace)
+        root = trace.spans[0]
+        cause = max(trace.spans, key=lambda s: self_times[s.span_id])
+        errors = [s for s in trace.spans if s.error]
+
+        attributes = " ".join(f"{key}={value}" for key, value in root.attributes.items())
+        lines = [
+            f"Slow update {root.name} {attributes} took {root.duration * 1000:.1f}ms, "
+            f"cause: {cause.kind} {cause.name} {self_times[cause.span_id] * 1000:.1f}ms"
+            + (f", error: {errors[-1].error}" if errors else ""),
+        ]
+
+        children: Dict[Optional[str], List[Span]] = {}
+        for s in trace.spans:
+            children.setdefault(s.parent_id, []).append(s)
+
+        def add(parent: Span, depth: int) -> None:
+            # The error is shown on the span raising it only, not on the spans it propagates through
+            raised = parent.error and all(child.error != parent.error for child in children.get(parent.span_id, []))
+            lines.append(
+                f"{'  ' * depth}{parent.kind} {parent.name} {parent.duration * 1000:.1f}ms "
+                f"(self {self_times[parent.span_id] * 1000:.1f}ms)"
+                + (f" error: {parent.error}" if raised else "")
+            )
+            for child in children.get(parent.span_id, []):
+                add(child, depth + 1)
+
+        add(root, 1)
+        return "\n".join(lines)
+
+    @staticmethod
+    def to_otlp(trace: Trace) -> Dict[str, Any]:
+        """
+        Convert a trace to an OTLP-JSON ExportTraceServiceRequest.
+        """
+
+        def attribute(key: str, value: Any) -> Dict[str, Any]:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for s in trace.spans:
+            data = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": f"{s.kind} {s.name}",
+                "kind": SPAN_KIND_INTERNAL if s.kind in INTERNAL_KINDS else SPAN_KIND_CLIENT,
+                "startTimeUnixNano": str(s.start),
+                "endTimeUnixNano": str(s.end),
+                "attributes": [attribute(key, value) for key, value in s.attributes.items()],
+            }
+            if s.parent_id is not None:
+                data["parentSpanId"] = s.parent_id
+            if s.error is not None:
+                data["status"] = {"code": STATUS_CODE_ERROR, "message": s.error}
+            spans.append(data)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "app.monitoring"}, "spans": spans}],
+            }],
+        }
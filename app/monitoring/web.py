@@ -0,0 +1,130 @@
+import asyncio
+import hmac
+import math
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from .memory import CACHES, allocation_top
+from .profiler import StackSampler, task_snapshot
+
+
+async def metrics_handler(_: web.Request) -> web.Response:
+    """
+    Render the metrics in the Prometheus text format.
+    """
+    response = web.Response(body=generate_latest(REGISTRY))
+    response.headers["Content-Type"] = CONTENT_TYPE_LATEST
+    return response
+
+
+def setup_metrics_route(app: web.Application, path: str) -> None:
+    """
+    Register the route exposing the metrics.
+
+    :param app: The web application.
+    :param path: The path of the route.
+    """
+    app.router.add_get(path, metrics_handler)
+
+
+class ProfilerHandler:
+    """
+    Admin routes profiling the running process, protected by a bearer token:
+
+    - GET {path}/profile?seconds=10 samples the stacks of the threads for a number of seconds and returns
+      them as collapsed stacks, with format=json together with a snapshot of the tasks taken halfway;
+    - GET {path}/tasks returns a snapshot of the asyncio tasks grouped by coroutine and what they wait on;
+    - GET {path}/memory returns the number of entries, the estimated bytes and the budget of the caches;
+    - GET {path}/memory/top?limit=20&seconds=30&group_by=lineno returns the code locations holding the most
+      memory, traced for a number of seconds unless tracemalloc is tracing from the start.
+    """
+
+    def __init__(self, token: str, max_seconds: float, interval: float) -> None:
+        """
+        Initialize the ProfilerHandler.
+
+        :param token: The bearer token of the requests.
+        :param max_seconds: The maximal duration of a profile.
+        :param interval: The number of seconds between two samples of the stacks.
+        """
+        self.token = token
+        self.max_seconds = max_seconds
+        self.interval = interval
+
+    def authorize(self, request: web.Request) -> None:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {self.token}"):
+            raise web.HTTPUnauthorized()
+
+    def seconds(self, request: web.Request, default: float) -> float:
+        """
+        The duration in seconds of the request, capped to the maximal duration.
+
+        :raises web.HTTPBadRequest: The duration is not a finite number greater than 0.
+        """
+        try:
+            seconds = float(request.query.get("seconds", default))
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds must be a number")
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise web.HTTPBadRequest(text="seconds must be a finite number greater than 0")
+        return min(seconds, self.max_seconds)
+
+    async def profile(self, request: web.Request) -> web.Response:
+        self.authorize(request)
+        seconds = self.seconds(request, 10)
+        if StackSampler.running():
+            raise web.HTTPConflict(text="A profile is already running")
+
+        # The sampler runs in the executor, the event loop keeps processing updates meanwhile
+        sampler = StackSampler(self.interval)
+        sampling = asyncio.get_running_loop().run_in_executor(None, sampler.run, seconds)
+        await asyncio.sleep(seconds / 2)
+        tasks = task_snapshot()
+        try:
+            await sampling
+        except RuntimeError:
+            raise web.HTTPConflict(text="A profile is already running")
+
+        if request.query.get("format") == "json":
+            return web.json_response({
+                "seconds": seconds,
+                "samples": sampler.samples,
+                "collapsed": sampler.collapsed(),
+                "tasks": tasks,
+            })
+        return web.Response(text=sampler.collapsed(), headers={
+            "Content-Disposition": "attachment; filename=profile.collapsed",
+        })
+
+    async def tasks(self, request: web.Request) -> web.Response:
+        self.authorize(request)
+        return web.json_response(task_snapshot())
+
+    async def memory(self, request: web.Request) -> web.Response:
+        self.authorize(request)
+        return web.json_response(CACHES.report())
+
+    async def memory_top(self, request: web.Request) -> web.Response:
+        self.authorize(request)
+        group_by = request.query.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            raise web.HTTPBadRequest(text="group_by must be lineno, filename or traceback")
+        try:
+            limit = int(request.query.get("limit", 20))
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit must be a number")
+        seconds = self.seconds(request, 30)
+        return web.json_response(await allocation_top(limit, seconds, group_by))
+
+    def register(self, app: web.Application, path: str) -> None:
+        """
+        Register the routes.
+
+        :param app: The web application.
+        :param path: The prefix of the routes.
+        """
+        app.router.add_get(f"{path}/profile", self.profile)
+        app.router.add_get(f"{path}/tasks", self.tasks)
+        app.router.add_get(f"{path}/memory", self.memory)
+        app.router.add_get(f"{path}/memory/top", self.memory_top)
@@ -1,13 +1,23 @@
+from typing import Optional
+
 from aiogram import Bot
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramUnauthorizedError
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
 
 from .config import ALLOWED_UPDATES, Config
-from .database.models import Base, BotDB
+from .database.models import Base, BotDB, create_missing_indexes
 from .bot_main import commands as main_commands
+from .bot_main.utils.broadcast import Broadcast
+from .bot_main.utils.errors import ErrorReporter
+from .bot_main.utils.jobs import ExportJob, ImportJob
+from .bot_multi.confirmations import Confirmations
+from .bot_multi.outbox import Outbox
 from .bot_multi import commands as multi_commands
+from .monitoring import CACHES, LoopMonitor, UpdateRecorder
 
 
 # noinspection PyUnusedLocal
@@ -17,13 +27,22 @@ async def startup(
         session: AiohttpSession,
         engine: AsyncEngine,
         sessionmaker: async_sessionmaker,
+        mongo_client: AsyncIOMotorClient,
+        redis: Redis,
+        outbox: Outbox,
+        loop_monitor: LoopMonitor,
 ) -> None:
     """
     Startup handler for the bot.
     """
-    # Create database tables
+    # Start measuring the event loop lag and enforcing the memory budgets of the caches
+    await loop_monitor.start()
+    CACHES.start(config.memory.CHECK_INTERVAL)
+
+    # Create database tables and the indexes added to existing tables
     async with engine.begin() as connection:
         await connection.run_sync(Base.metadata.create_all)
+        await connection.run_sync(create_missing_indexes)
 
     # Setup commands for the main bot
     await main_commands.setup(bot)
@@ -49,6 +68,11 @@ async def startup(
                     # Handle unauthorized errors
                     pass
 
+    # Resume broadcasts interrupted by the last shutdown, and later those of stopped instances
+    await Broadcast.watch(bot, session, redis, mongo_client, sessionmaker, config)
+    # Start delivering operator replies
+    await outbox.start()
+
 
 # noinspection PyUnusedLocal
 async def shutdown(
@@ -57,10 +81,29 @@ async def shutdown(
         session: AiohttpSession,
         engine: AsyncEngine,
         sessionmaker: async_sessionmaker,
+        outbox: Outbox,
+        confirmations: Confirmations,
+        error_reporter: ErrorReporter,
+        recorder: Optional[UpdateRecorder],
+        loop_monitor: LoopMonitor,
 ) -> None:
     """
     Shutdown handler for the bot.
     """
+    # Cancel running export and import jobs, releasing their locks
+    await ExportJob.cancel_all()
+    await ImportJob.cancel_all()
+    # Cancel running broadcasts, they are resumed on the next startup or by another instance
+    await Broadcast.cancel_all()
+    # Stop delivering operator replies, pending ones are delivered after the next startup
+    await outbox.stop()
+    await confirmations.close()
+    # Cancel pending error reports
+    await error_reporter.close()
+    # Write the buffered records of updates
+    if recorder is not None:
+        await recorder.close()
+
     # Delete commands and webhook for all active multi-bots
     async with sessionmaker() as async_session:
         for bot_db in await BotDB.all(async_session):
@@ -82,3 +125,7 @@ async def shutdown(
     # Close session and all database connections
     await session.close()
     await engine.dispose()
+
+    # Stop measuring the event loop lag and enforcing the memory budgets
+    await loop_monitor.stop()
+    await CACHES.stop()
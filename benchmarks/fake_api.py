@@ -0,0 +1,253 @@
+"""
+Fake Telegram Bot API server for integration and load tests.
+
+Implements the methods called by the bots with plausible results, with configurable latency, injected
+errors and flood limits, and records every call. Point the application at it with
+BOT_API_BASE_URL=http://127.0.0.1:8081 and read the recorded calls from GET /calls, or clear them
+with DELETE /calls.
+
+Usage:
+    python -m benchmarks.fake_api [--port 8081] [--latency 0.05] [--jitter 0.02]
+                                  [--error-rate 0.01] [--flood-rate 0.01] [--retry-after 1]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import typing as t
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from itertools import count
+
+from aiohttp import web
+
+Handler = t.Callable[["FakeBotAPI", int, t.Dict[str, t.Any]], t.Any]
+
+
+@dataclass
+class Faults:
+    # Seconds added to every call, plus a uniform random jitter
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Fraction of the calls failing with error_code
+    error_rate: float = 0.0
+    error_code: int = 500
+    # Fraction of the calls failing with a flood limit of retry_after seconds
+    flood_rate: float = 0.0
+    retry_after: int = 1
+
+
+@dataclass
+class Call:
+    bot_id: int
+    method: str
+    params: t.Dict[str, t.Any]
+    time: float
+    status: int = 200
+
+
+@dataclass
+class FakeBotAPI:
+    """
+    The state of the fake server: the faults, the recorded calls and the counters of the sent messages.
+    """
+    faults: Faults = field(default_factory=Faults)
+    # Faults of single methods, replacing the default ones
+    method_faults: t.Dict[str, Faults] = field(default_factory=dict)
+    max_calls: int = 100_000
+
+    def __post_init__(self) -> None:
+        self.calls: t.Deque[Call] = deque(maxlen=self.max_calls)
+        self.message_ids: t.Dict[int, t.Iterator[int]] = {}
+        self.thread_ids = count(1000)
+        self.webhooks: t.Dict[int, str] = {}
+
+    def next_message_id(self, chat_id: int) -> int:
+        if chat_id not in self.message_ids:
+            self.message_ids[chat_id] = count(1)
+        return next(self.message_ids[chat_id])
+
+    @staticmethod
+    def bot_user(bot_id: int) -> t.Dict[str, t.Any]:
+        return {"id": bot_id, "is_bot": True, "first_name": f"Bot {bot_id}", "username": f"bot{bot_id}"}
+
+    def message(self, bot_id: int, params: t.Dict[str, t.Any], **fields: t.Any) -> t.Dict[str, t.Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": self.next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": self.bot_user(bot_id),
+            **fields,
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = int(params["message_thread_id"])
+        return message
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 ** 2)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_get("/calls", self.get_calls)
+        app.router.add_delete("/calls", self.clear_calls)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot_id = int(request.match_info["token"].split(":", 1)[0])
+        method = request.match_info["method"]
+        params = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        call = Call(bot_id, method, params, time.time())
+        self.calls.append(call)
+
+        faults = self.method_faults.get(method, self.faults)
+        delay = faults.latency + random.uniform(0, faults.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if random.random() < faults.flood_rate:
+            call.status = 429
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {faults.retry_after}",
+                "parameters": {"retry_after": faults.retry_after},
+            }, status=429)
+        if random.random() < faults.error_rate:
+            call.status = faults.error_code
+            return web.json_response({
+                "ok": False,
+                "error_code": faults.error_code,
+                "description": "Injected error",
+            }, status=faults.error_code)
+
+        handler = METHODS.get(method.lower())
+        if handler is None:
+            call.status = 404
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        return web.json_response({"ok": True, "result": handler(self, bot_id, params)})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.calls.append(Call(int(request.match_info["token"].split(":", 1)[0]), "file", {
+            "path": request.match_info["path"],
+        }, time.time()))
+        return web.Response(body=b"")
+
+    async def get_calls(self, _: web.Request) -> web.Response:
+        return web.json_response([asdict(call) for call in self.calls])
+
+    async def clear_calls(self, _: web.Request) -> web.Response:
+        self.calls.clear()
+        return web.json_response({"ok": True})
+
+
+def send_media_group(api: FakeBotAPI, bot_id: int, params: t.Dict[str, t.Any]) -> t.List[t.Dict[str, t.Any]]:
+    media_group_id = str(random.getrandbits(63))
+    messages = []
+    for media in json.loads(params["media"]):
+        caption = {"caption": media["caption"]} if "caption" in media else {}
+        messages.append(api.message(bot_id, params, media_group_id=media_group_id, **caption))
+    return messages
+
+
+def get_chat_member(_: FakeBotAPI, __: int, params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    user = {"id": int(params["user_id"]), "is_bot": False, "first_name": "User", "language_code": "en"}
+    if int(params["chat_id"]) > 0:
+        return {"status": "member", "user": user}
+    return {
+        "status": "administrator",
+        "user": user,
+        "can_be_edited": False,
+        "is_anonymous": False,
+        "can_manage_chat": True,
+        "can_delete_messages": True,
+        "can_manage_video_chats": True,
+        "can_restrict_members": True,
+        "can_promote_members": False,
+        "can_change_info": True,
+        "can_invite_users": True,
+        "can_pin_messages": True,
+        "can_manage_topics": True,
+    }
+
+
+def set_webhook(api: FakeBotAPI, bot_id: int, params: t.Dict[str, t.Any]) -> bool:
+    api.webhooks[bot_id] = params["url"]
+    return True
+
+
+def delete_webhook(api: FakeBotAPI, bot_id: int, _: t.Dict[str, t.Any]) -> bool:
+    api.webhooks.pop(bot_id, None)
+    return True
+
+
+def get_webhook_info(api: FakeBotAPI, bot_id: int, _: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    return {"url": api.webhooks.get(bot_id, ""), "has_custom_certificate": False, "pending_update_count": 0}
+
+
+# Results of the methods by lowercase name, the Bot API method names are case-insensitive
+METHODS: t.Dict[str, Handler] = {
+    "getme": lambda api, bot_id, params: {**api.bot_user(bot_id), "can_join_groups": True},
+    "setwebhook": set_webhook,
+    "deletewebhook": delete_webhook,
+    "getwebhookinfo": get_webhook_info,
+    "setmycommands": lambda api, bot_id, params: True,
+    "deletemycommands": lambda api, bot_id, params: True,
+    "sendmessage": lambda api, bot_id, params: api.message(bot_id, params, text=params["text"]),
+    "senddocument": lambda api, bot_id, params: api.message(bot_id, params, document={
+        "file_id": "document", "file_unique_id": "document",
+    }),
+    "copymessage": lambda api, bot_id, params: {"message_id": api.next_message_id(int(params["chat_id"]))},
+    "sendmediagroup": send_media_group,
+    "editmessagetext": lambda api, bot_id, params: {
+        **api.message(bot_id, params, text=params["text"]),
+        "message_id": int(params["message_id"]),
+    },
+    "deletemessage": lambda api, bot_id, params: True,
+    "createforumtopic": lambda api, bot_id, params: {
+        "message_thread_id": next(api.thread_ids),
+        "name": params["name"],
+        "icon_color": int(params.get("icon_color", 7322096)),
+    },
+    "pinchatmessage": lambda api, bot_id, params: True,
+    "unpinchatmessage": lambda api, bot_id, params: True,
+    "getchatmember": get_chat_member,
+    "answercallbackquery": lambda api, bot_id, params: True,
+    "getfile": lambda api, bot_id, params: {
+        "file_id": params["file_id"],
+        "file_unique_id": params["file_id"],
+        "file_path": f"documents/{params['file_id']}",
+    },
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every call.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximal random seconds added to the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with --error-code.")
+    parser.add_argument("--error-code", type=int, default=500)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Fraction of calls failing with a 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry after seconds of the 429 responses.")
+    parser.add_argument("--max-calls", type=int, default=100_000, help="Number of recorded calls kept.")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(
+        faults=Faults(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            error_code=args.error_code,
+            flood_rate=args.flood_rate,
+            retry_after=args.retry_after,
+        ),
+        max_calls=args.max_calls,
+    )
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+I/O budgets of the update scenarios.
+
+budget_environment starts the application like benchmarks.webhooks, against the fake Bot API, a temporary
+SQLite database (or DB_URL), and the MongoDB and Redis servers of the environment or stand-ins of them, and
+yields the load generator posting the updates. scenario_budget asserts that every update posted in its block
+makes at most the budgeted number of SQL statements, MongoDB commands, Redis commands and Bot API requests of
+a scenario, so that changes adding I/O to a path fail.
+
+tests/test_io_budgets.py checks every scenario against mongomock and fakeredis with pytest. This script checks
+them against the servers of the environment and exits with status 1 when an update exceeds its budget.
+
+Lower a budget when a change removes I/O from a path, so that it does not come back.
+
+Usage:
+    python -m pytest tests/test_io_budgets.py
+    python -m benchmarks.io_budgets [--repeat 5] [--json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import typing as t
+from contextlib import asynccontextmanager
+
+from aiohttp import ClientSession, web
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
+
+from app.__main__ import create_app
+from app.monitoring import BACKENDS, IOBudget, MongoCommandMetrics, io_budget
+from benchmarks.fake_api import FakeBotAPI
+from benchmarks.webhooks import TENANT_BASE_ID, LoadGenerator, seed, setup_environment, wait_outbox
+
+TENANTS = 2
+USERS = 5
+# Seconds a user is throttled after an update, waited before every run so that no update is dropped
+THROTTLING_TTL = .7
+
+# Maximal number of operations by backend of every update of a scenario, the Bot API requests of the updates
+# of the tenant bots include the getMe of BotDBMiddleware
+BUDGETS: t.Dict[str, t.Dict[str, int]] = {
+    # Text message of a user with a topic
+    "private": {"sql": 1, "mongodb": 2, "redis": 1, "telegram": 2},
+    # First message of a user, creating the topic
+    "first_message": {"sql": 1, "mongodb": 4, "redis": 1, "telegram": 5},
+    # Every message of a media group of three photos
+    "album": {"sql": 1, "mongodb": 2, "redis": 1, "telegram": 3},
+    # Operator reply in the topic of a user, delivered later by the outbox
+    "reply": {"sql": 1, "mongodb": 2, "redis": 2, "telegram": 1},
+    # Main menu callback query of a tenant owner to the main bot
+    "callback": {"sql": 3, "mongodb": 0, "redis": 5, "telegram": 2},
+    # User blocking or unblocking a tenant bot
+    "member": {"sql": 1, "mongodb": 3, "redis": 1, "telegram": 2},
+}
+
+
+def scenarios(generator: LoadGenerator) -> t.Dict[str, t.Callable[[int], t.Awaitable[None]]]:
+    return {
+        "private": lambda i: generator.private(i % TENANTS, i % USERS),
+        # Users beyond the warmed up ones are new
+        "first_message": lambda i: generator.private(i % TENANTS, USERS + i),
+        "album": lambda i: generator.album(i % TENANTS, i % USERS),
+        "reply": lambda i: generator.reply(i % TENANTS, i % USERS),
+        "callback": lambda i: generator.callback(i % TENANTS, 0),
+        "member": lambda i: generator.member(i % TENANTS, i % USERS),
+    }
+
+
+@asynccontextmanager
+async def budget_environment(
+        port: int = 8090,
+        api_port: int = 8091,
+        redis_db: int = 15,
+        mongo: t.Optional[AsyncIOMotorClient] = None,
+        redis: t.Optional[Redis] = None,
+) -> t.AsyncIterator[LoadGenerator]:
+    """
+    Start the fake Bot API and the application with seeded tenants, and yield the load generator
+    of the scenarios once the users are warmed up and the outbox is drained.
+
+    :param port: The port of the application.
+    :param api_port: The port of the fake Bot API.
+    :param redis_db: The Redis database used by the application.
+    :param mongo: The MongoDB client of the application, e.g. a stand-in, by default one for the environment.
+    :param redis: The Redis client of the application, e.g. a stand-in, by default one for the environment.
+    """
+    api = FakeBotAPI()
+    api_runner = web.AppRunner(api.app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", api_port).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        args = argparse.Namespace(port=port, redis_db=redis_db)
+        config = setup_environment(args, api_port, os.path.join(directory, "budgets.sqlite3"))
+        await seed(config, TENANTS)
+
+        if mongo is None:
+            mongo = AsyncIOMotorClient(config.mongodb.dsn(), event_listeners=[MongoCommandMetrics()])
+        if redis is None:
+            redis = Redis.from_url(config.redis.dsn())
+
+        app_runner = web.AppRunner(create_app(config, mongo, redis))
+        await app_runner.setup()
+        await web.TCPSite(app_runner, "127.0.0.1", port).start()
+        try:
+            async with ClientSession() as http:
+                generator = LoadGenerator(http, config, TENANTS, USERS)
+                await generator.warm_up(mongo, concurrency=1)
+                await wait_outbox(redis)
+                yield generator
+        finally:
+            await app_runner.cleanup()
+            for tenant in range(TENANTS):
+                await mongo.drop_database(f"bot{TENANT_BASE_ID + tenant}")
+            mongo.close()
+            await redis.aclose()
+            await api_runner.cleanup()
+
+
+def scenario_budget(name: str) -> t.ContextManager[IOBudget]:
+    """
+    Assert that every update processed meanwhile stays within the budget of a scenario.
+
+    :raises AssertionError: An update exceeded the budget or no update was processed.
+    """
+    return io_budget(**BUDGETS[name])
+
+
+async def check(generator: LoadGenerator, repeat: int) -> t.Tuple[t.Dict[str, t.Dict[str, int]], t.List[str]]:
+    """
+    Post the updates of every scenario, returning the maximal operations of an update by scenario and the
+    updates exceeding their budget.
+    """
+    maxima, violations = {}, []
+    for name, run in scenarios(generator).items():
+        maxima[name] = dict.fromkeys(BACKENDS, 0)
+        for i in range(repeat):
+            await asyncio.sleep(THROTTLING_TTL)
+            try:
+                with scenario_budget(name) as budget:
+                    await run(i)
+            except AssertionError as ex:
+                violations.append(f"{name}: {ex}")
+            for backend, count in budget.maximum().items():
+                maxima[name][backend] = max(maxima[name][backend], count)
+    return maxima, violations
+
+
+async def main(args: argparse.Namespace) -> int:
+    async with budget_environment(args.port, args.api_port, args.redis_db) as generator:
+        maxima, violations = await check(generator, args.repeat)
+
+    if args.json:
+        print(json.dumps({"maxima": maxima, "budgets": BUDGETS, "violations": violations}, indent=2))
+    else:
+        print(f"{'scenario':<14}" + "".join(f"{backend:>14}" for backend in BACKENDS))
+        for name, counts in maxima.items():
+            print(f"{name:<14}" + "".join(
+                f"{f'{counts[backend]}/{BUDGETS[name][backend]}':>14}" for backend in BACKENDS
+            ))
+        for violation in violations:
+            print(violation)
+    return 1 if violations else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of every scenario.")
+    parser.add_argument("--port", type=int, default=8090, help="Port of the application.")
+    parser.add_argument("--api-port", type=int, default=8091, help="Port of the fake Bot API.")
+    parser.add_argument("--redis-db", type=int, default=15, help="Redis database used by the application.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(parse_args())))
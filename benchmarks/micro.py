@@ -0,0 +1,344 @@
+"""
+Microbenchmark suite of the hot-path components.
+
+Every benchmark runs a component in process without I/O: Bot objects are created with a dummy token and
+never make requests, middlewares call a no-op handler and the album middleware waits no latency.
+Results are the best time per operation in microseconds over five repeats, and the memory in bytes of
+the Mongo models, printed as a table or written as JSON, and compared with a stored baseline. Without
+a baseline the script fails, store one with --save-baseline on the machine running the comparisons.
+
+Usage:
+    python -m benchmarks.micro [--filter throttling] [--scale 1.0] [--json results.json]
+                               [--baseline benchmarks/baseline.json] [--save-baseline] [--no-compare]
+                               [--threshold 10]
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+import typing as t
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.types import Message
+from cryptography.fernet import Fernet
+
+from app.bot_main.middlewares.throttling import ThrottlingMiddleware as MainThrottlingMiddleware
+from app.bot_main.utils.keyboards import InlineKeyboardPaginator
+from app.bot_main.utils.pagination import page_cursors
+from app.bot_multi.middlewares.album import AlbumMiddleware
+from app.bot_multi.middlewares.throttling import ThrottlingMiddleware as MultiThrottlingMiddleware
+from app.bot_multi.texts import MessageCode, TextMessage, default_mongodb_texts
+from app.bot_multi.types.album import Album
+from app.database.models import BotDB
+from app.mongodb.models import TextMongo, UserMongo
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+REPEAT = 5
+# Number of objects created to measure the memory of an object
+MEMORY_OBJECTS = 10_000
+
+# Benchmarks by name, called with the number of operations per repeat, returning seconds per operation
+BENCHMARKS: t.Dict[str, t.Callable[[int], float]] = {}
+# Factories of the objects whose memory is measured by name
+MEMORY: t.Dict[str, t.Callable[[], t.Any]] = {}
+
+USER_DOCUMENT = {
+    "_id": 123456789,
+    "username": "username",
+    "full_name": "Full Name",
+    "language_code": "en",
+    "state": "member",
+    "is_banned": False,
+    "message_silent_mode": False,
+    "message_silent_id": None,
+    "message_thread_id": 42,
+    "created_at": datetime(2023, 11, 1, 12, 0),
+}
+TEXT_DOCUMENT = {
+    "_id": 1,
+    "code": "welcome_message",
+    "en": "Hello, {name}!\n" * 20,
+    "ru": "Привет, {name}!\n" * 20,
+    "media_url": "https://telegra.ph//file/e17f59a066f95a686b2ac.jpg",
+    "description_en": "Welcome message",
+    "description_ru": "Приветственное сообщение",
+}
+
+
+def benchmark(name: str, number: int) -> t.Callable:
+    """
+    Register a benchmark with its default number of operations per repeat.
+    """
+
+    def decorator(func: t.Callable[[int], float]) -> t.Callable[[int], float]:
+        func.number = number
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def per_call(func: t.Callable[[], t.Any], number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def per_call_async(make_batch: t.Callable[[], t.Awaitable[t.Any]], number: int) -> float:
+    """
+    Measure a coroutine running number operations, in a fresh event loop.
+    """
+
+    async def run() -> float:
+        best = float("inf")
+        for _ in range(REPEAT):
+            batch = make_batch()
+            start = time.perf_counter()
+            await batch
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    return asyncio.run(run()) / number
+
+
+def bytes_per_object(factory: t.Callable[[], t.Any], count: int = MEMORY_OBJECTS) -> int:
+    """
+    Measure the memory held by count objects created by the factory, in bytes per object.
+
+    Each object is built from its own copy of the document, as when it is read from MongoDB,
+    so a model keeping a reference to its document is charged for it.
+    """
+    tracemalloc.start()
+    objects = [factory() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size // count
+
+
+def legacy_class(model: type) -> type:
+    """
+    Build a plain dataclass with the same fields as the model.
+    """
+    return dataclasses.make_dataclass(
+        f"Legacy{model.__name__}",
+        [(f.name, f.type, f) for f in dataclasses.fields(model) if f.init],
+    )
+
+
+async def noop_handler(*_: t.Any) -> None:
+    return None
+
+
+def make_bot() -> Bot:
+    # Never used to make requests
+    return Bot("42:" + "A" * 35)
+
+
+def make_album_message(message_id: int, media_group_id: str) -> Message:
+    return Message.model_validate({
+        "message_id": message_id,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "media_group_id": media_group_id,
+        "photo": [{"file_id": f"photo{message_id}", "file_unique_id": f"photo{message_id}", "width": 1, "height": 1}],
+    })
+
+
+@benchmark("album_middleware_burst_10", number=200)
+def album_middleware_burst(number: int) -> float:
+    """
+    Media groups of ten photos arriving at once, per message.
+    """
+    bot = make_bot()
+    groups = [[make_album_message(i * 10 + j, f"group{i}") for j in range(10)] for i in range(number)]
+
+    async def batch() -> None:
+        middleware = AlbumMiddleware(latency=0)
+        await asyncio.gather(*[
+            middleware(noop_handler, message, {"bot": bot})
+            for messages in groups for message in messages
+        ])
+
+    return per_call_async(batch, number * 10)
+
+
+def throttling(middleware_class: type, users: int, number: int) -> float:
+    random.seed(users)
+    events = [{"event_from_user": SimpleNamespace(id=random.randrange(users))} for _ in range(number)]
+
+    async def batch() -> None:
+        middleware = middleware_class()
+        for data in events:
+            await middleware(noop_handler, None, data)
+
+    return per_call_async(batch, number)
+
+
+for _users in (10_000, 100_000, 1_000_000):
+    for _name, _class in (("main", MainThrottlingMiddleware), ("multi", MultiThrottlingMiddleware)):
+        benchmark(f"throttling_{_name}_{_users}_users", number=100_000)(
+            lambda number, c=_class, u=_users: throttling(c, u, number)
+        )
+
+
+@benchmark("paginator_as_markup", number=2_000)
+def paginator_as_markup(number: int) -> float:
+    items = [(f"bot{i}", 1000 + i) for i in range(10)]
+    cursors = page_cursors(25, [item[1] for item in items])
+    return per_call(lambda: InlineKeyboardPaginator(
+        items=items, current_page=25, total_pages=50, cursors=cursors,
+    ).as_markup(), number)
+
+
+@benchmark("text_message_get", number=1_000_000)
+def text_message_get(number: int) -> float:
+    text_message = TextMessage("en")
+    return per_call(lambda: text_message.get(MessageCode.message_sent_to_user), number)
+
+
+@benchmark("text_message_insert_mongodb_text", number=20_000)
+def text_message_insert_mongodb_text(number: int) -> float:
+    """
+    Insertion of the texts of a bot, hydrated from their documents as read from MongoDB.
+    """
+    documents = [text.to_document() for text in default_mongodb_texts]
+    text_message = TextMessage("en")
+    data = TextMessage.data
+    TextMessage.data = {language: dict(texts) for language, texts in data.items()}
+    try:
+        return per_call(lambda: text_message.insert_mongodb_text(
+            [TextMongo.from_document(document) for document in documents]
+        ), number)
+    finally:
+        TextMessage.data = data
+
+
+@benchmark("album_as_media_group_10", number=5_000)
+def album_as_media_group(number: int) -> float:
+    album = Album.model_validate({
+        "photo": [
+            {"file_id": f"photo{i}", "file_unique_id": f"photo{i}", "width": 1, "height": 1}
+            for i in range(10)
+        ],
+        "caption": "Caption",
+    }, context={"bot": make_bot()})
+    return per_call(lambda: album.as_media_group, number)
+
+
+def model_benchmarks(prefix: str, model: type, document: t.Dict[str, t.Any]) -> None:
+    """
+    Register the hydration and serialization of a Mongo model with its generated codec and with the
+    previous approach, a plain dataclass built with cls(**data) and serialized with dataclasses.asdict.
+    """
+    legacy = legacy_class(model)
+    benchmark(f"{prefix}_mongo_from_document", number=200_000)(
+        lambda number: per_call(lambda: model.from_document(document), number)
+    )
+    benchmark(f"{prefix}_mongo_to_document", number=200_000)(
+        lambda number: per_call(model.from_document(document).to_document, number)
+    )
+    benchmark(f"{prefix}_legacy_cls_data", number=200_000)(
+        lambda number: per_call(lambda: legacy(**document), number)
+    )
+    benchmark(f"{prefix}_legacy_asdict", number=200_000)(
+        lambda number, legacy_model=legacy(**document): per_call(lambda: dataclasses.asdict(legacy_model), number)
+    )
+    MEMORY[f"{prefix}_mongo_bytes"] = lambda: model.from_document(dict(document))
+    MEMORY[f"{prefix}_legacy_bytes"] = lambda: legacy(**dict(document))
+
+
+model_benchmarks("user", UserMongo, USER_DOCUMENT)
+model_benchmarks("text", TextMongo, TEXT_DOCUMENT)
+
+
+@benchmark("bot_db_decrypt_token", number=20_000)
+def bot_db_decrypt_token(number: int) -> float:
+    secret_key = Fernet.generate_key().decode()
+    encrypted = BotDB.encrypt_token(secret_key, "42:" + "A" * 35)
+    return per_call(lambda: BotDB.decrypt_token(secret_key, encrypted), number)
+
+
+def compare(
+        results: t.Dict[str, float],
+        baseline: t.Dict[str, float],
+        threshold: float,
+        unit: str = "us",
+) -> t.List[str]:
+    """
+    Print the change of every result against the baseline and return the names of the regressions.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<42} {f'baseline {unit}':>12} {f'current {unit}':>12} {'change':>8}")
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        change = (value - baseline[name]) / baseline[name] * 100
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = "  regression"
+        print(f"{name:<42} {baseline[name]:12.3f} {value:12.3f} {change:+7.1f}%{mark}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Run the benchmarks whose name contains this text.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor of the number of operations per repeat.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="The baseline JSON file.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline.")
+    parser.add_argument("--no-compare", action="store_true", help="Only measure, without a baseline.")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Slowdown in percent reported as regression, the exit code is 1 on regressions.")
+    args = parser.parse_args()
+
+    if not (args.save_baseline or args.no_compare or args.baseline.exists()):
+        sys.exit(f"Baseline {args.baseline} not found, store one with --save-baseline on the reference machine "
+                 f"or run with --no-compare")
+
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        results[name] = func(max(int(func.number * args.scale), 1)) * 1e6
+        print(f"{name:<42} {results[name]:12.3f} us")
+
+    memory = {}
+    for name, factory in MEMORY.items():
+        if args.filter not in name:
+            continue
+        memory[name] = bytes_per_object(factory)
+        print(f"{name:<42} {memory[name]:12d} B")
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+        "memory": memory,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(output, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(output, indent=2))
+        return
+    if args.no_compare:
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline["results"], args.threshold)
+    regressions += compare(memory, baseline.get("memory", {}), args.threshold, unit="B")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Replay of recorded webhook updates.
+
+Reads a recording of anonymized updates written by the application with RECORDING_PATH set, then starts
+the web application of app.__main__ against the fake Bot API of benchmarks.fake_api, a temporary SQLite
+database (or DB_URL), and the MongoDB and Redis servers of the environment, like benchmarks.webhooks.
+Seeds the recorded tenant bots with their owners and groups, then posts the updates to the main and
+multi-bot webhooks at their recorded pace divided by --speed, or as fast as possible with --speed 0.
+
+Reports the p50/p95/p99 latencies by update type, the updates per second, the outbound Bot API calls
+per update and the peak memory of the process. The databases of the recorded tenants are dropped at the end.
+
+Usage:
+    python -m benchmarks.replay updates.ndjson.gz [--speed 1] [--concurrency 100] [--limit 10000] [--json]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+import typing as t
+import zlib
+from collections import Counter
+
+from aiohttp import ClientSession, web
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.__main__ import create_app
+from app.config import Config
+from app.database.models import Base, BotDB, UserDB
+from benchmarks.fake_api import FakeBotAPI, Faults
+from benchmarks.webhooks import print_report, report, setup_environment, token, wait_outbox
+
+
+def read_records(path: str, limit: int = 0) -> t.List[t.Dict[str, t.Any]]:
+    """
+    Read the records of a recording ordered by time, the last line of a truncated recording is skipped.
+    """
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        try:
+            for line in file:
+                records.append(json.loads(line))
+                if limit and len(records) >= limit:
+                    break
+        except (EOFError, zlib.error, json.JSONDecodeError):
+            # The application stopped while writing
+            pass
+    records.sort(key=lambda record: record["time"])
+    return records
+
+
+async def seed(config: Config, records: t.List[t.Dict[str, t.Any]]) -> t.Set[int]:
+    """
+    Create the tenant bots of the recorded multi-bot updates and their owners, returning the tenant IDs.
+    """
+    tenants = {}
+    for record in records:
+        if record["dispatcher"] == "multi" and "owner_id" in record:
+            tenants[record["bot_id"]] = record
+
+    engine = create_async_engine(config.database.url())
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    async with async_sessionmaker(engine, expire_on_commit=False)() as async_session:
+        for bot_id, record in tenants.items():
+            if await BotDB.get(async_session, bot_id) is not None:
+                continue
+            if await UserDB.get(async_session, record["owner_id"]) is None:
+                await UserDB.create(async_session, id=record["owner_id"], full_name=f"Owner {record['owner_id']}")
+            await BotDB.create(
+                async_session,
+                id=bot_id,
+                user_id=record["owner_id"],
+                group_id=record.get("group_id"),
+                token=BotDB.encrypt_token(config.SECRET_KEY, token(bot_id)),
+                username=f"bot{bot_id}",
+            )
+    await engine.dispose()
+    return set(tenants)
+
+
+class Replayer:
+    """
+    Posts the recorded updates to the webhooks, recording their latencies by update type.
+    """
+
+    def __init__(self, http: ClientSession, config: Config) -> None:
+        self.http = http
+        self.config = config
+
+        self.latencies: t.Dict[str, t.List[float]] = {}
+        self.failures: Counter = Counter()
+
+    def url(self, record: t.Dict[str, t.Any]) -> str:
+        if record["dispatcher"] == "main":
+            path = self.config.webhook.PATH_BOT_MAIN.format(bot_token=self.config.bot.TOKEN)
+        else:
+            path = self.config.webhook.PATH_BOT_MULTI.format(bot_token=token(record["bot_id"]))
+        return f"http://127.0.0.1:{self.config.app.PORT}{path}"
+
+    async def post(self, record: t.Dict[str, t.Any]) -> None:
+        update = record["update"]
+        kind = next((key for key in update if key != "update_id"), "unknown")
+        start = time.perf_counter()
+        async with self.http.post(self.url(record), json=update) as response:
+            await response.read()
+            if response.status != 200:
+                self.failures[kind] += 1
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    async def run(self, records: t.List[t.Dict[str, t.Any]], speed: float, concurrency: int) -> float:
+        """
+        Post the records at their recorded pace divided by speed and return the elapsed time.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def replay(record: t.Dict[str, t.Any]) -> None:
+            if speed > 0:
+                await asyncio.sleep((record["time"] - first) / speed - (time.perf_counter() - start))
+            async with semaphore:
+                await self.post(record)
+
+        first, start = records[0]["time"], time.perf_counter()
+        await asyncio.gather(*[replay(record) for record in records])
+        return time.perf_counter() - start
+
+
+async def main(args: argparse.Namespace) -> None:
+    records = read_records(args.path, args.limit)
+    if not records:
+        raise SystemExit(f"No records in {args.path}")
+
+    api = FakeBotAPI(faults=Faults(latency=args.api_latency, jitter=args.api_latency / 2))
+    api_runner = web.AppRunner(api.app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", args.api_port).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = setup_environment(args, args.api_port, os.path.join(directory, "replay.sqlite3"))
+        tenants = await seed(config, records)
+
+        app_runner = web.AppRunner(create_app(config))
+        await app_runner.setup()
+        await web.TCPSite(app_runner, "127.0.0.1", args.port).start()
+
+        mongo = AsyncIOMotorClient(config.mongodb.dsn())
+        redis = Redis.from_url(config.redis.dsn())
+        try:
+            async with ClientSession() as http:
+                replayer = Replayer(http, config)
+                elapsed = await replayer.run(records, args.speed, args.concurrency)
+                # Replies are delivered by the outbox after their webhook returned
+                await wait_outbox(redis)
+                result = report(replayer, api, elapsed)
+        finally:
+            await app_runner.cleanup()
+            for bot_id in tenants:
+                await mongo.drop_database(f"bot{bot_id}")
+            mongo.close()
+            await redis.aclose()
+            await api_runner.cleanup()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="The recording, a gzip file of JSON lines.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Factor of the recorded pace, 0 to post the updates as fast as possible.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Number of concurrent webhook requests.")
+    parser.add_argument("--limit", type=int, default=0, help="Number of replayed records, 0 for all.")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Latency of the fake Bot API in seconds.")
+    parser.add_argument("--port", type=int, default=8090, help="Port of the application.")
+    parser.add_argument("--api-port", type=int, default=8091, help="Port of the fake Bot API.")
+    parser.add_argument("--redis-db", type=int, default=15, help="Redis database used by the application.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Slow updates are expected under load, only errors are logged
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main(parse_args()))
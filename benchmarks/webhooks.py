@@ -0,0 +1,430 @@
+"""
+End-to-end webhook load generator and throughput benchmark.
+
+Starts the web application of app.__main__ in this process against the fake Bot API of benchmarks.fake_api,
+a temporary SQLite database (or DB_URL), and the MongoDB and Redis servers of the environment. Seeds the
+tenants, their owners and users, then posts synthetic webhook updates to the main and multi-bot paths:
+
+- private: text messages of users to a tenant bot;
+- album: media groups of three photos of users to a tenant bot;
+- reply: operator replies in the topics of the users, delivered by the outbox;
+- callback: main menu callback queries of the tenant owners to the main bot;
+- member: users blocking and unblocking a tenant bot (my_chat_member).
+
+Webhooks are handled in the request, so the latency of an update is the time of its webhook request.
+Reports the p50/p95/p99 latencies by kind, the updates per second, the outbound Bot API calls per update,
+including the replies delivered by the outbox, and the peak memory of the process.
+
+Use a dedicated Redis database (--redis-db) and MongoDB server, the databases of the benchmark tenants
+are dropped at the end. Requires aiosqlite for the default SQLite database.
+
+Usage:
+    python -m benchmarks.webhooks [--tenants 10] [--users 100] [--updates 5000] [--concurrency 50]
+                                  [--mix private=50,album=5,reply=30,callback=10,member=5] [--json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+import typing as t
+from collections import Counter
+
+from aiohttp import ClientSession, web
+from cryptography.fernet import Fernet
+from environs import Env
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.__main__ import create_app
+from app.config import Config, load_config
+from app.database.models import Base, BotDB, UserDB
+from benchmarks.fake_api import FakeBotAPI, Faults
+
+KINDS = ["private", "album", "reply", "callback", "member"]
+
+# Ids of the benchmark bots and users, far from the ids of real accounts
+MAIN_BOT_ID = 9_000_000_000
+TENANT_BASE_ID = 9_000_000_100
+OWNER_BASE_ID = 9_100_000_000
+USER_BASE_ID = 9_200_000_000
+OPERATOR_BASE_ID = 9_300_000_000
+# Offset between the user ids of two tenants, users are throttled across bots
+TENANT_USERS = 1_000_000
+
+
+def token(bot_id: int) -> str:
+    return f"{bot_id}:{'A' * 35}"
+
+
+def parse_mix(value: str) -> t.Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        kind, weight = item.split("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown update kind {kind}, expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def setup_environment(args: argparse.Namespace, api_port: int, db_path: str) -> Config:
+    """
+    Load the configuration of the environment with the bots, the database and the Bot API of the benchmark.
+    """
+    Env().read_env()
+    os.environ.update({
+        "BOT_TOKEN": token(MAIN_BOT_ID),
+        "BOT_DEV_ID": str(OWNER_BASE_ID),
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{api_port}",
+        "APP_HOST": "127.0.0.1",
+        "APP_PORT": str(args.port),
+        "WEBHOOK_DOMAIN": f"http://127.0.0.1:{args.port}",
+        "WEBHOOK_PATH_BOT_MAIN": "/webhook/main/{bot_token}",
+        "WEBHOOK_PATH_BOT_MULTI": "/webhook/bot/{bot_token}",
+        "WEBHOOK_HANDLE_IN_BACKGROUND": "false",
+        "REDIS_DB": str(args.redis_db),
+        "DB_URL": os.environ.get("DB_URL") or f"sqlite+aiosqlite:///{db_path}",
+        "SECRET_KEY": Fernet.generate_key().decode(),
+        "RECORDING_PATH": "",
+    })
+    for key, value in {
+        "MONGO_HOST": "127.0.0.1", "MONGO_PORT": "27017", "MONGO_USER": "", "MONGO_PASSWORD": "",
+        "REDIS_HOST": "127.0.0.1", "REDIS_PORT": "6379",
+        "DB_HOST": "", "DB_PORT": "0", "DB_USERNAME": "", "DB_PASSWORD": "", "DB_DATABASE": "",
+    }.items():
+        os.environ.setdefault(key, value)
+    return load_config()
+
+
+async def seed(config: Config, tenants: int) -> None:
+    """
+    Create the tenant bots and their owners.
+    """
+    engine = create_async_engine(config.database.url())
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    async with async_sessionmaker(engine, expire_on_commit=False)() as async_session:
+        for i in range(tenants):
+            if await BotDB.get(async_session, TENANT_BASE_ID + i) is not None:
+                continue
+            await UserDB.create(async_session, id=OWNER_BASE_ID + i, full_name=f"Owner {i}")
+            await BotDB.create(
+                async_session,
+                id=TENANT_BASE_ID + i,
+                user_id=OWNER_BASE_ID + i,
+                group_id=-(1_000_000_000_000 + i),
+                token=BotDB.encrypt_token(config.SECRET_KEY, token(TENANT_BASE_ID + i)),
+                username=f"bot{TENANT_BASE_ID + i}",
+            )
+    await engine.dispose()
+
+
+class LoadGenerator:
+    """
+    Builds the synthetic updates and posts them to the webhooks, recording their latencies by kind.
+    """
+
+    def __init__(self, http: ClientSession, config: Config, tenants: int, users: int) -> None:
+        self.http = http
+        self.config = config
+        self.tenants = tenants
+        self.users = users
+
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.latencies: t.Dict[str, t.List[float]] = {kind: [] for kind in KINDS}
+        self.failures: Counter = Counter()
+        # Topic of every user by tenant and user id, read after the warm-up
+        self.topics: t.Dict[t.Tuple[int, int], int] = {}
+        # Users who blocked their bot
+        self.blocked: t.Set[t.Tuple[int, int]] = set()
+        # Owners in the bot list window of the main bot
+        self.in_bot_list: t.Set[int] = set()
+
+    def url(self, bot_id: int) -> str:
+        if bot_id == MAIN_BOT_ID:
+            path = self.config.webhook.PATH_BOT_MAIN
+        else:
+            path = self.config.webhook.PATH_BOT_MULTI
+        return f"http://127.0.0.1:{self.config.app.PORT}{path.format(bot_token=token(bot_id))}"
+
+    @staticmethod
+    def user(user_id: int) -> t.Dict[str, t.Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "language_code": "en"}
+
+    def message(self, chat: t.Dict[str, t.Any], user_id: int, **fields: t.Any) -> t.Dict[str, t.Any]:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+            "from": self.user(user_id),
+            **fields,
+        }
+
+    def private_chat(self, user_id: int) -> t.Dict[str, t.Any]:
+        return {"id": user_id, "type": "private", "first_name": f"User {user_id}"}
+
+    async def post(self, kind: str, bot_id: int, update: t.Dict[str, t.Any]) -> None:
+        update = {"update_id": next(self.update_ids), **update}
+        start = time.perf_counter()
+        async with self.http.post(self.url(bot_id), json=update) as response:
+            await response.read()
+            if response.status != 200:
+                self.failures[kind] += 1
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    @staticmethod
+    def user_id(tenant: int, user: int) -> int:
+        return USER_BASE_ID + tenant * TENANT_USERS + user
+
+    async def private(self, tenant: int, user: int) -> None:
+        user_id = self.user_id(tenant, user)
+        text = f"Message {random.getrandbits(32)}"
+        await self.post("private", TENANT_BASE_ID + tenant, {
+            "message": self.message(self.private_chat(user_id), user_id, text=text),
+        })
+
+    async def album(self, tenant: int, user: int) -> None:
+        user_id, media_group_id = self.user_id(tenant, user), str(random.getrandbits(63))
+        await asyncio.gather(*[
+            self.post("album", TENANT_BASE_ID + tenant, {
+                "message": self.message(self.private_chat(user_id), user_id, media_group_id=media_group_id, photo=[{
+                    "file_id": f"photo{i}", "file_unique_id": f"photo{i}", "width": 90, "height": 90,
+                }]),
+            })
+            for i in range(3)
+        ])
+
+    async def reply(self, tenant: int, user: int) -> None:
+        thread_id = self.topics.get((tenant, user))
+        if thread_id is None:
+            return await self.private(tenant, user)
+        group = {"id": -(1_000_000_000_000 + tenant), "type": "supergroup", "title": "Group", "is_forum": True}
+        operator_id = OPERATOR_BASE_ID + random.randrange(self.users)
+        await self.post("reply", TENANT_BASE_ID + tenant, {
+            "message": self.message(group, operator_id, text="Reply", message_thread_id=thread_id,
+                                    is_topic_message=True),
+        })
+
+    async def callback(self, tenant: int, _: int) -> None:
+        owner_id = OWNER_BASE_ID + tenant
+        # Owners go from the main menu to the bot list and back
+        data = "back" if owner_id in self.in_bot_list else "bot_management"
+        self.in_bot_list.symmetric_difference_update({owner_id})
+        await self.post("callback", MAIN_BOT_ID, {
+            "callback_query": {
+                "id": str(random.getrandbits(63)),
+                "from": self.user(owner_id),
+                "chat_instance": str(owner_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": self.private_chat(owner_id),
+                    "text": "Menu",
+                },
+            },
+        })
+
+    async def member(self, tenant: int, user: int) -> None:
+        user_id, bot_id = self.user_id(tenant, user), TENANT_BASE_ID + tenant
+        old, new = ("kicked", "member") if (tenant, user) in self.blocked else ("member", "kicked")
+        self.blocked.symmetric_difference_update({(tenant, user)})
+        bot_user = {"id": bot_id, "is_bot": True, "first_name": "Bot"}
+        await self.post("member", bot_id, {
+            "my_chat_member": {
+                "chat": self.private_chat(user_id),
+                "from": self.user(user_id),
+                "date": int(time.time()),
+                "old_chat_member": {"status": old, "user": bot_user, **({"until_date": 0} if old == "kicked" else {})},
+                "new_chat_member": {"status": new, "user": bot_user, **({"until_date": 0} if new == "kicked" else {})},
+            },
+        })
+
+    async def warm_up(self, mongo: AsyncIOMotorClient, concurrency: int) -> None:
+        """
+        Open the main menu of the owners and send a first message of every user, creating their topics.
+        """
+        jobs = [
+            self.post("callback", MAIN_BOT_ID, {
+                "message": self.message(self.private_chat(OWNER_BASE_ID + tenant), OWNER_BASE_ID + tenant,
+                                        text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}]),
+            })
+            for tenant in range(self.tenants)
+        ] + [self.private(tenant, user) for tenant in range(self.tenants) for user in range(self.users)]
+        await run_bounded(jobs, concurrency)
+
+        for tenant in range(self.tenants):
+            users = mongo[f"bot{TENANT_BASE_ID + tenant}"]["users"]
+            async for document in users.find({}, {"message_thread_id": 1}):
+                if document.get("message_thread_id"):
+                    user = document["_id"] - self.user_id(tenant, 0)
+                    self.topics[(tenant, user)] = document["message_thread_id"]
+
+        self.latencies = {kind: [] for kind in KINDS}
+        self.failures.clear()
+
+    async def run(self, updates: int, mix: t.Dict[str, float], concurrency: int) -> float:
+        """
+        Post the updates and return the elapsed time.
+        """
+        kinds = random.choices(list(mix), weights=list(mix.values()), k=updates)
+        jobs = [
+            getattr(self, kind)(random.randrange(self.tenants), random.randrange(self.users))
+            for kind in kinds
+        ]
+        start = time.perf_counter()
+        await run_bounded(jobs, concurrency)
+        return time.perf_counter() - start
+
+
+async def run_bounded(jobs: t.List[t.Awaitable[t.Any]], concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job: t.Awaitable[t.Any]) -> None:
+        async with semaphore:
+            await job
+
+    await asyncio.gather(*[run(job) for job in jobs])
+
+
+async def wait_outbox(redis: Redis, timeout: float = 60) -> None:
+    """
+    Wait until the outbox has delivered the queued replies.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # The queues, processing lists, delayed retries and parked replies of the shards, without the dead-letter
+        # list and the holds of the chats, which last as long as their retried reply is queued
+        keys = await redis.keys("outbox:[0-9]*")
+        sizes = [
+            await (redis.zcard(key) if key.endswith(b":delayed") else redis.llen(key))
+            for key in keys if b":hold:" not in key
+        ]
+        if not sum(sizes):
+            return
+        await asyncio.sleep(.1)
+
+
+def percentile(values: t.List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def report(generator: LoadGenerator, api: FakeBotAPI, elapsed: float) -> t.Dict[str, t.Any]:
+    updates = sum(len(values) for values in generator.latencies.values())
+    latencies = {}
+    for kind, values in generator.latencies.items():
+        if values:
+            latencies[kind] = {
+                "count": len(values),
+                "failures": generator.failures[kind],
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+    everything = [value for values in generator.latencies.values() for value in values]
+    methods = Counter(call.method for call in api.calls)
+    return {
+        "updates": updates,
+        "elapsed_s": elapsed,
+        "updates_per_s": updates / elapsed if elapsed else 0.0,
+        "latency": {
+            "all": {
+                "count": len(everything),
+                "failures": sum(generator.failures.values()),
+                "p50_ms": percentile(everything, 50) * 1000,
+                "p95_ms": percentile(everything, 95) * 1000,
+                "p99_ms": percentile(everything, 99) * 1000,
+            },
+            **latencies,
+        },
+        "api_calls_per_update": len(api.calls) / updates if updates else 0.0,
+        "api_calls": dict(methods.most_common()),
+        # Peak resident memory of the process running the application, the load generator and the fake Bot API
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_report(result: t.Dict[str, t.Any]) -> None:
+    print(f"{'kind':<10} {'count':>8} {'failed':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, values in result["latency"].items():
+        print(f"{kind:<10} {values['count']:>8} {values['failures']:>7} "
+              f"{values['p50_ms']:>9.2f} {values['p95_ms']:>9.2f} {values['p99_ms']:>9.2f}")
+    print(f"\n{'updates per second':<28} {result['updates_per_s']:10.1f}")
+    print(f"{'api calls per update':<28} {result['api_calls_per_update']:10.2f}")
+    print(f"{'peak rss mb':<28} {result['peak_rss_mb']:10.1f}")
+    for method, number in result["api_calls"].items():
+        print(f"  {method:<26} {number:10d}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(faults=Faults(latency=args.api_latency, jitter=args.api_latency / 2))
+    api_runner = web.AppRunner(api.app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", args.api_port).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = setup_environment(args, args.api_port, os.path.join(directory, "benchmark.sqlite3"))
+        await seed(config, args.tenants)
+
+        app_runner = web.AppRunner(create_app(config))
+        await app_runner.setup()
+        await web.TCPSite(app_runner, "127.0.0.1", args.port).start()
+
+        mongo = AsyncIOMotorClient(config.mongodb.dsn())
+        redis = Redis.from_url(config.redis.dsn())
+        try:
+            async with ClientSession() as http:
+                generator = LoadGenerator(http, config, args.tenants, args.users)
+                await generator.warm_up(mongo, args.concurrency)
+                await wait_outbox(redis)
+                api.calls.clear()
+
+                elapsed = await generator.run(args.updates, args.mix, args.concurrency)
+                # Replies are delivered by the outbox after their webhook returned
+                await wait_outbox(redis)
+                result = report(generator, api, elapsed)
+        finally:
+            await app_runner.cleanup()
+            for tenant in range(args.tenants):
+                await mongo.drop_database(f"bot{TENANT_BASE_ID + tenant}")
+            mongo.close()
+            await redis.aclose()
+            await api_runner.cleanup()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10, help="Number of tenant bots.")
+    parser.add_argument("--users", type=int, default=100, help="Number of users of every tenant.")
+    parser.add_argument("--updates", type=int, default=5000, help="Number of measured updates.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Number of concurrent webhook requests.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("private=50,album=5,reply=30,callback=10,member=5"),
+                        help="Weights of the update kinds.")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Latency of the fake Bot API in seconds.")
+    parser.add_argument("--port", type=int, default=8090, help="Port of the application.")
+    parser.add_argument("--api-port", type=int, default=8091, help="Port of the fake Bot API.")
+    parser.add_argument("--redis-db", type=int, default=15, help="Redis database used by the application.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Slow updates are expected under load, only errors are logged
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main(parse_args()))
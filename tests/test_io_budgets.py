@@ -0,0 +1,105 @@
+"""
+I/O budgets of the update scenarios, checked against stand-ins of the servers: the fake Bot API, a temporary
+SQLite database, mongomock and fakeredis. A change adding I/O to the path of a scenario fails its test,
+lower the budget in benchmarks.io_budgets when a change removes I/O from a path.
+"""
+import asyncio
+import functools
+import os
+import typing as t
+from unittest import mock
+
+import pytest
+from aiohttp.test_utils import unused_port
+from fakeredis.aioredis import FakeRedis
+from mongomock_motor import AsyncMongoMockClient
+
+from app.monitoring.io import count_io
+from benchmarks.io_budgets import BUDGETS, THROTTLING_TTL, budget_environment, scenario_budget, scenarios
+from benchmarks.webhooks import LoadGenerator
+
+# Runs of every scenario
+REPEAT = 3
+
+# Collection methods sending a single command with the driver
+COMMANDS = [
+    "bulk_write",
+    "count_documents",
+    "create_index",
+    "create_indexes",
+    "delete_many",
+    "delete_one",
+    "distinct",
+    "estimated_document_count",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_replace",
+    "find_one_and_update",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+]
+# Collection methods returning a cursor, counted as the command of its first batch
+CURSORS = ["aggregate", "find"]
+
+
+def counted(method: t.Callable) -> t.Callable:
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            count_io("mongodb")
+            return await method(*args, **kwargs)
+    else:
+        @functools.wraps(method)
+        def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            count_io("mongodb")
+            return method(*args, **kwargs)
+    return wrapper
+
+
+@pytest.fixture(scope="module")
+def mongo() -> t.Iterator[AsyncMongoMockClient]:
+    """
+    A mongomock client counting its commands, like the command listener of the application does with the driver.
+    """
+    client = AsyncMongoMockClient()
+    collection = type(client["db"]["collection"])
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name in COMMANDS + CURSORS:
+            monkeypatch.setattr(collection, name, counted(getattr(collection, name)))
+        yield client
+
+
+@pytest.fixture(scope="module")
+def environment(
+        mongo: AsyncMongoMockClient,
+) -> t.Iterator[t.Tuple[asyncio.AbstractEventLoop, LoadGenerator]]:
+    """
+    The application on the stand-ins with its event loop, started once as its routers are attached once.
+    """
+    loop = asyncio.new_event_loop()
+    context = budget_environment(unused_port(), unused_port(), mongo=mongo, redis=FakeRedis())
+    # The environment of the application is set up by the budget environment
+    with mock.patch.dict(os.environ):
+        generator = loop.run_until_complete(context.__aenter__())
+        try:
+            yield loop, generator
+        finally:
+            loop.run_until_complete(context.__aexit__(None, None, None))
+            loop.close()
+
+
+async def run_scenario(generator: LoadGenerator, name: str) -> None:
+    run = scenarios(generator)[name]
+    for i in range(REPEAT):
+        await asyncio.sleep(THROTTLING_TTL)
+        with scenario_budget(name):
+            await run(i)
+
+
+@pytest.mark.parametrize("name", list(BUDGETS))
+def test_scenario_budget(name: str, environment: t.Tuple[asyncio.AbstractEventLoop, LoadGenerator]) -> None:
+    loop, generator = environment
+    loop.run_until_complete(run_scenario(generator, name))